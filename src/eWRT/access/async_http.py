@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.async_http
+    asyncio counterpart of eWRT.access.http.Retrieve
+
+    AsyncRetrieve supports the same authentication, compression, retry and
+    throttling semantics as Retrieve, but allows many concurrent requests
+    from a single event loop. The number of concurrent requests is bounded
+    globally and per host.
+
+    Requests are performed with aiohttp, if it is available; otherwise
+    they are executed by Retrieve objects (with keep-alive connections) in
+    a thread pool of max_connections threads. Rate limiters with file or
+    Redis bucket stores are queried in the loop's default executor, since
+    their stores perform blocking I/O.
+
+    usage:
+      async with AsyncRetrieve('crawler', max_connections=200) as r:
+          pages = await asyncio.gather(*[r.open(url) for url in urls])
+
+    @remarks
+    This module requires Python 3.5 or later.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import asyncio
+import io
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from eWRT.access.compression import ACCEPT_ENCODING
+from eWRT.access.http import (Retrieve, DEFAULT_TIMEOUT,
+                              DEFAULT_WEB_REQUEST_SLEEP_TIME, USER_AGENT)
+from eWRT.access.ratelimit import MemoryBucketStore, RateLimiter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 8
+
+
+class AsyncResponse(io.BytesIO):
+    ''' @class AsyncResponse
+        the (uncompressed) content of a response together with its url,
+        status code and headers
+    '''
+
+    def __init__(self, url, code, headers, content):
+        io.BytesIO.__init__(self, content)
+        self.url = url
+        self.code = code
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+
+class _ThreadTransport(object):
+    ''' performs requests with Retrieve objects in a thread pool '''
+
+    def __init__(self, module, user_agent, timeout, max_connections,
+                 max_connections_per_host):
+        self.executor = ThreadPoolExecutor(max_connections)
+        self.retrieve = Retrieve(module, sleep_time=0, user_agent=user_agent,
+                                 default_timeout=timeout, keep_alive=True,
+                                 pool_size=max_connections_per_host)
+
+    async def request(self, url, data, headers, user, pwd,
+                      authentification_method, accept_gzip, head_only):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._request, url, data, headers, user, pwd,
+            authentification_method, accept_gzip, head_only)
+
+    def _request(self, url, data, headers, user, pwd,
+                 authentification_method, accept_gzip, head_only):
+        f = self.retrieve.open(url, data, headers, user, pwd,
+                               authentification_method=authentification_method,
+                               accept_gzip=accept_gzip, head_only=head_only)
+        try:
+            return AsyncResponse(f.url, f.code, f.headers, f.read())
+        finally:
+            f.close()
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.retrieve.close()
+
+
+class _AiohttpTransport(object):
+    ''' performs requests with an aiohttp client session '''
+
+    def __init__(self, module, user_agent, timeout, max_connections,
+                 max_connections_per_host):
+        self.user_agent = user_agent
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=max_connections, limit_per_host=max_connections_per_host),
+            timeout=aiohttp.ClientTimeout(total=timeout))
+
+    async def request(self, url, data, headers, user, pwd,
+                      authentification_method, accept_gzip, head_only):
+        if user and pwd and authentification_method != 'basic':
+            raise ValueError("aiohttp only supports basic authentication.")
+
+        headers = dict(headers)
+        headers['User-Agent'] = self.user_agent
+        headers['Accept-Encoding'] = ACCEPT_ENCODING if accept_gzip \
+            else 'identity'
+        method = 'HEAD' if head_only else 'POST' if data is not None \
+            else 'GET'
+        try:
+            async with self.session.request(
+                    method, url, data=data, headers=headers,
+                    auth=aiohttp.BasicAuth(user, pwd) if user and pwd
+                    else None) as response:
+                content = await response.read()
+        except aiohttp.ClientError as e:
+            # report errors like urllib2 does
+            raise URLError(e)
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, io.BytesIO(content))
+        return AsyncResponse(str(response.url), response.status,
+                             response.headers, content)
+
+    async def close(self):
+        await self.session.close()
+
+
+class AsyncRetrieve(object):
+    ''' @class AsyncRetrieve
+        retrieves URLs using HTTP from asyncio coroutines
+    '''
+
+    def __init__(self, module, sleep_time=DEFAULT_WEB_REQUEST_SLEEP_TIME,
+                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 rate_limiter=None, retry_policy=None, circuit_breaker=None,
+                 use_aiohttp=None):
+        ''' ::param module: the name of the module using the class (used
+                            in the user agent)
+            ::param sleep_time: minimum delay between two requests to the
+                                same host (ignored if a rate_limiter is
+                                given)
+            ::param user_agent: the user agent to use
+            ::param default_timeout: the request timeout
+            ::param max_connections: maximum number of concurrent requests
+            ::param max_connections_per_host: maximum number of concurrent
+                                              requests per host
+            ::param rate_limiter: an optional RateLimiter
+            ::param retry_policy: an optional RetryPolicy
+            ::param circuit_breaker: an optional CircuitBreaker
+            ::param use_aiohttp: whether to use aiohttp (default: if it is
+                                 available)
+        '''
+        self.module = module
+        self.user_agent = user_agent % module \
+            if "%s" in user_agent else user_agent
+        self.default_timeout = default_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        if rate_limiter is None and sleep_time > 0:
+            rate_limiter = RateLimiter(rate=1. / sleep_time)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+
+        if use_aiohttp is None:
+            use_aiohttp = aiohttp is not None
+        elif use_aiohttp and aiohttp is None:
+            raise ValueError("aiohttp is not installed.")
+        self.use_aiohttp = use_aiohttp
+
+        # created on first use, since they are bound to the event loop
+        self._transport = None
+        self._semaphore = None
+        self._host_semaphores = {}
+
+    async def open(self, url, data=None, headers={}, user=None, pwd=None,
+                   retry=None, authentification_method="basic",
+                   accept_gzip=True, head_only=False):
+        ''' retrieves the given URL (see Retrieve.open for the parameters)
+            ::returns: an AsyncResponse with the uncompressed content
+        '''
+        retry_policy = Retrieve._get_retry_policy(self.retry_policy, retry)
+        host = urlsplit(url).netloc
+        start_time = time.time()
+        tries = 0
+        while True:
+            # throttle first, since every request permitted by the circuit
+            # breaker (e.g. a half-open trial) has to record its outcome
+            await self._throttle(host)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_request(host)
+            try:
+                # requests waiting for a busy host must not hold one of the
+                # global slots
+                async with self._get_semaphore(host), \
+                        self._get_semaphore(None):
+                    response = await self._get_transport().request(
+                        url, data, headers, user, pwd,
+                        authentification_method, accept_gzip, head_only)
+            except Exception as e:
+                server_delay = await self._update_rate_limit(host, e.headers) \
+                    if isinstance(e, HTTPError) else None
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(host, e)
+                delay = retry_policy.next_delay(tries, e, start_time,
+                                                server_delay)
+                if delay is None:
+                    raise
+                log.info("Retrying %s in %.1f s after error: %s", url, delay,
+                         e)
+                await asyncio.sleep(max(0., delay - (server_delay or 0)))
+                tries += 1
+                continue
+
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(host)
+            await self._update_rate_limit(host, response.headers)
+            return response
+
+    async def close(self):
+        ''' closes the underlying connections '''
+        if self._transport is not None:
+            await self._transport.close()
+            self._transport = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_transport(self):
+        if self._transport is None:
+            transport = _AiohttpTransport if self.use_aiohttp \
+                else _ThreadTransport
+            self._transport = transport(
+                self.module, self.user_agent, self.default_timeout,
+                self.max_connections, self.max_connections_per_host)
+        return self._transport
+
+    def _get_semaphore(self, host):
+        ''' ::returns: the semaphore for the given host or the global
+                       semaphore, if host is None '''
+        if host is None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_connections)
+            return self._semaphore
+
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = \
+                asyncio.Semaphore(self.max_connections_per_host)
+        return semaphore
+
+    async def _throttle(self, host):
+        ''' waits according to the content provider's policy '''
+        if self.rate_limiter is not None:
+            wait = await self._call_rate_limiter(self.rate_limiter.reserve,
+                                                 host)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _update_rate_limit(self, host, headers):
+        if self.rate_limiter is None:
+            return None
+        return await self._call_rate_limiter(
+            self.rate_limiter.update_from_headers, host, headers)
+
+    async def _call_rate_limiter(self, method, *args):
+        ''' calls the given rate limiter method; methods of limiters whose
+            bucket store performs blocking I/O are run in the default
+            executor '''
+        if isinstance(self.rate_limiter.store, MemoryBucketStore):
+            return method(*args)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, method, *args)
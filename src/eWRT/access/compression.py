@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.compression
+    incremental decompression of HTTP responses
+
+    decompress() wraps a response with a Content-Encoding of gzip, deflate
+    or br (if the brotli module is available) into a buffered file object
+    which decompresses the data while it is read from the socket, rather
+    than buffering the whole compressed and decompressed body in memory.
+
+    usage:
+      f = decompress(urlObj, 'gzip')
+      for chunk in f.iter_chunks(1024 * 1024):
+          ...
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import io
+import zlib
+
+from functools import partial
+
+try:
+    import brotli
+except ImportError:
+    brotli = None   # brotli compression is not supported
+
+# size of the compressed blocks read from the response
+READ_SIZE = 64 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class _ZlibDecoder(object):
+    ''' decodes zlib streams '''
+
+    WBITS = zlib.MAX_WBITS
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(self.WBITS)
+
+    @property
+    def pending(self):
+        ''' whether compressed data is waiting to be decompressed '''
+        return bool(self._decompressor.unconsumed_tail)
+
+    def decompress(self, data, max_length):
+        return self._decompressor.decompress(
+            self._decompressor.unconsumed_tail + data, max_length)
+
+    def flush(self):
+        data = self._decompressor.flush()
+        if not getattr(self._decompressor, 'eof', True):
+            raise IOError("Compressed response ended prematurely.")
+        return data
+
+
+class _GzipDecoder(_ZlibDecoder):
+    ''' decodes (multi-member) gzip streams '''
+
+    WBITS = 16 + zlib.MAX_WBITS
+
+    @property
+    def pending(self):
+        return bool(self._decompressor.unconsumed_tail or
+                    self._decompressor.unused_data)
+
+    def decompress(self, data, max_length):
+        unused_data = self._decompressor.unused_data
+        if unused_data:
+            # the next member of a multi-member gzip file starts
+            self._decompressor = zlib.decompressobj(self.WBITS)
+            data = unused_data + data
+        return _ZlibDecoder.decompress(self, data, max_length)
+
+
+class _DeflateDecoder(_ZlibDecoder):
+    ''' decodes deflate streams, which are sent with and without the
+        zlib header, depending on the server '''
+
+    def __init__(self):
+        _ZlibDecoder.__init__(self)
+        self._started = False
+
+    def decompress(self, data, max_length):
+        if not self._started:
+            self._started = True
+            try:
+                return self._decompressor.decompress(data, max_length)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return _ZlibDecoder.decompress(self, data, max_length)
+
+
+class _BrotliDecoder(object):
+    ''' decodes brotli streams '''
+
+    pending = False
+
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data, max_length):
+        return self._decompressor.process(data)
+
+    def flush(self):
+        if not self._decompressor.is_finished():
+            raise IOError("Compressed response ended prematurely.")
+        return b''
+
+
+DECODERS = {'gzip': _GzipDecoder,
+            'x-gzip': _GzipDecoder,
+            'deflate': _DeflateDecoder}
+if brotli is not None:
+    DECODERS['br'] = _BrotliDecoder
+
+ACCEPT_ENCODING = ', '.join(sorted(encoding for encoding in DECODERS
+                                   if not encoding.startswith('x-')))
+
+
+class _DecompressingReader(io.RawIOBase):
+    ''' a raw stream which decompresses the data read from fileobj '''
+
+    def __init__(self, fileobj, decoder):
+        self.fileobj = fileobj
+        self._decoder = decoder
+        self._buffer = b''
+        self._eof = False
+        # whether any compressed data has been read
+        self._received = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            if self._eof:
+                return 0
+            data = b'' if self._decoder.pending \
+                else self.fileobj.read(READ_SIZE)
+            if data or self._decoder.pending:
+                self._received = True
+                self._buffer = self._decoder.decompress(data, len(b))
+            else:
+                # empty bodies (e.g. of HEAD requests or 204 responses)
+                # carry no compressed stream at all
+                self._buffer = self._decoder.flush() if self._received \
+                    else b''
+                self._eof = True
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+        io.RawIOBase.close(self)
+
+
+class DecompressedResponse(io.BufferedReader):
+    ''' @class DecompressedResponse
+        a file object yielding the decompressed content of a response,
+        which also provides the response's headers, url and status code
+    '''
+
+    def __init__(self, response, decoder, buffer_size=io.DEFAULT_BUFFER_SIZE):
+        io.BufferedReader.__init__(
+            self, _DecompressingReader(response, decoder), buffer_size)
+        self.response = response
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def url(self):
+        return self.response.geturl()
+
+    @property
+    def code(self):
+        return self.response.getcode()
+
+    def info(self):
+        return self.response.info()
+
+    def geturl(self):
+        return self.response.geturl()
+
+    def getcode(self):
+        return self.response.getcode()
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        ''' yields the decompressed content in chunks of chunk_size bytes '''
+        return iter_chunks(self, chunk_size)
+
+
+def decompress(response, encoding):
+    ''' ::param response: the response to decompress
+        ::param encoding: the response's Content-Encoding
+        ::returns: a DecompressedResponse or the response itself for
+                   unknown or missing encodings
+    '''
+    decoder = DECODERS.get((encoding or '').strip().lower())
+    if decoder is None:
+        return response
+    return DecompressedResponse(response, decoder())
+
+
+def iter_chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    ''' yields the content of the given file object in chunks of (at most)
+        chunk_size bytes '''
+    return iter(partial(fileobj.read, chunk_size), b'')
@@ -39,24 +39,35 @@ except:
     from urlparse import urlsplit, urlunsplit  # python2
 
 import time
-import io
 
-from gzip import GzipFile
-from random import randint
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+from six.moves.queue import Queue
+
+from eWRT.access.compression import (ACCEPT_ENCODING, DEFAULT_CHUNK_SIZE,
+                                     decompress, iter_chunks)
+from eWRT.access.keepalive import (HTTPConnectionPool, KeepAliveHandler,
+                                   DEFAULT_POOL_SIZE)
+from eWRT.access.ratelimit import RateLimiter
+from eWRT.access.retry import HTTP_TEMPORARY_ERROR_CODES, RetryPolicy
 
 
 # logging
 import logging
 log = logging.getLogger(__name__)
 
+# initial and maximum delay between retries, if no retry policy is given
 RETRY_WAIT_TIME_RANGE = (2, 10)              # in seconds
-# error codes which might trigger a retry:
-HTTP_TEMPORARY_ERROR_CODES = (500, 503, 504)
 
 # set default socket timeout (otherwise urllib might hang!)
 from socket import setdefaulttimeout
 DEFAULT_TIMEOUT = 60
 
+# default concurrency of Retrieve.fetch_many
+FETCH_MANY_WORKERS = 8
+FETCH_MANY_WORKERS_PER_HOST = 2
+
 
 def getHostName(x): return "://".join(urlsplit(x)[:2])
 
@@ -70,7 +81,12 @@ class Retrieve(object):
            - authentication and
            - compression
            - support for the context protocol (python)
-           - automatic throttling support
+           - automatic per-host throttling (see eWRT.access.ratelimit)
+           - persistent (keep-alive) connections, if keep_alive is set
+           - retries with exponential backoff and circuit breakers (see
+             eWRT.access.retry)
+           - conditional requests and response caching, if an http_cache
+             is given (see eWRT.access.httpcache)
 
         @warning
         There are certain urls such as
@@ -81,14 +97,49 @@ class Retrieve(object):
     '''
 
     __slots__ = ('module', 'sleep_time', 'last_access_time', 'user_agent',
-                 '_supported_http_authentification_methods')
+                 '_supported_http_authentification_methods',
+                 '_connection_pool', 'rate_limiter', 'retry_policy',
+                 'circuit_breaker', 'http_cache')
 
     def __init__(self, module, sleep_time=DEFAULT_WEB_REQUEST_SLEEP_TIME,
-                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT):
-        setdefaulttimeout(default_timeout)
+                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT,
+                 keep_alive=False, pool_size=DEFAULT_POOL_SIZE,
+                 rate_limiter=None, retry_policy=None, circuit_breaker=None,
+                 http_cache=None):
+        ''' ::param module: the name of the module using the class (used
+                            in the user agent)
+            ::param sleep_time: minimum delay between two requests to the
+                                same host (ignored if a rate_limiter is
+                                given)
+            ::param user_agent: the user agent to use
+            ::param default_timeout: the default socket timeout (None:
+                                     keep the process' current default)
+            ::param keep_alive: reuse connections to the same host
+            ::param pool_size: maximum number of idle connections kept per
+                               host, if keep_alive is set
+            ::param rate_limiter: an optional RateLimiter, which might be
+                                  shared with other Retrieve objects,
+                                  threads or processes
+            ::param retry_policy: an optional RetryPolicy (default: retry
+                                  temporary errors with exponential backoff
+                                  within RETRY_WAIT_TIME_RANGE)
+            ::param circuit_breaker: an optional CircuitBreaker, which might
+                                     be shared with other Retrieve objects
+            ::param http_cache: an optional HTTPCache for GET requests
+        '''
+        if default_timeout is not None:
+            setdefaulttimeout(default_timeout)
         self.module = module
         self.sleep_time = sleep_time
         self.last_access_time = 0
+        if rate_limiter is None and sleep_time > 0:
+            rate_limiter = RateLimiter(rate=1. / sleep_time)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.http_cache = http_cache
+        self._connection_pool = HTTPConnectionPool(pool_size) \
+            if keep_alive else None
 
         self._supported_http_authentification_methods = {
             'basic': Retrieve._getHTTPBasicAuthOpener,
@@ -97,9 +148,10 @@ class Retrieve(object):
         self.user_agent = user_agent % self.module \
             if "%s" in user_agent else user_agent
 
-    def open(self, url, data=None, headers={}, user=None, pwd=None, retry=0,
+    def open(self, url, data=None, headers={}, user=None, pwd=None,
+             retry=None,
              authentification_method="basic", accept_gzip=True,
-             head_only=False):
+             head_only=False, timeout=None):
         ''' Opens an URL and returns the matching file object
             @param[in] url
             @param[in] data    optional data to submit
@@ -107,18 +159,40 @@ class Retrieve(object):
             @param[in] user    optional user name
             @param[in] pwd     optional password
             @param[in] retry   number of retries in case of an temporary error
+                               (overrides the retry policy's max_retries)
             @param[in] authentification_method the used authentification_method
                         ('basic'*, 'digest')
-            @param[in] accept_gzip flag to change the accepted encoding, gzip
+            @param[in] accept_gzip flag to change the accepted encoding,
+                        compressed (gzip, deflate and, if available, br)
                         or not
             @param[in] head_only   if True: only execute a HEAD request
+            @param[in] timeout     optional timeout of this request (default:
+                                   the socket default timeout)
             @returns a file object for reading the url
         '''
         auth_handler = self._supported_http_authentification_methods[
             authentification_method]
-        urlObj = None
+        retry_policy = self._get_retry_policy(self.retry_policy, retry)
+        host = urlsplit(url).netloc
+
+        cache_entry = None
+        use_cache = self.http_cache is not None and data is None and \
+            not head_only
+        if use_cache:
+            # the request headers which responses may vary on
+            request_headers = dict(headers)
+            request_headers['User-Agent'] = self.user_agent
+            cache_entry = self.http_cache.get(url, user, request_headers)
+            if cache_entry is not None:
+                if self.http_cache.is_fresh(cache_entry):
+                    return self.http_cache.open_cached(cache_entry)
+                headers = dict(headers)
+                headers.update(
+                    self.http_cache.get_conditional_headers(cache_entry))
+
+        start_time = time.time()
         tries = 0
-        while not urlObj:
+        while True:
             request = urllib2.Request(url, data, headers)
 
             if head_only:
@@ -127,32 +201,151 @@ class Retrieve(object):
             request.add_header('User-Agent', self.user_agent)
 
             if accept_gzip:
-                request.add_header('Accept-encoding', 'gzip')
+                request.add_header('Accept-encoding', ACCEPT_ENCODING)
 
-            self._throttle()
+            # throttle first, since every request permitted by the circuit
+            # breaker (e.g. a half-open trial) has to record its outcome
+            self._throttle(url)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_request(host)
 
             opener = []
             if PROXY_SERVER:
                 opener.append(urllib2.ProxyHandler({"http": PROXY_SERVER}))
             if user and pwd:
                 opener.append(auth_handler(url, user, pwd))
+            if self._connection_pool is not None:
+                opener.append(KeepAliveHandler(self._connection_pool))
 
-            urllib2.install_opener(urllib2.build_opener(*opener))
             try:
-                urlObj = urllib2.urlopen(request)
-            except urllib2.HTTPError as e:
-                if e.code in HTTP_TEMPORARY_ERROR_CODES and tries < retry:
-                    time.sleep(randint(*RETRY_WAIT_TIME_RANGE))
-                    tries += 1
-                    continue
-                else:
-                    raise e
-
+                opener = urllib2.build_opener(*opener)
+                urlObj = opener.open(request) if timeout is None \
+                    else opener.open(request, timeout=timeout)
+            except Exception as e:
+                if cache_entry is not None and \
+                        isinstance(e, urllib2.HTTPError) and e.code == 304:
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record(host)
+                    return self.http_cache.revalidated(url, cache_entry,
+                                                       e.headers, user)
+                server_delay = self._update_rate_limit(url, e.headers) \
+                    if isinstance(e, urllib2.HTTPError) else None
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(host, e)
+                delay = retry_policy.next_delay(tries, e, start_time,
+                                                server_delay)
+                if delay is None:
+                    raise
+                log.info("Retrying %s in %.1f s after error: %s", url, delay,
+                         e)
+                # server requested delays are enforced by the rate limiter
+                time.sleep(max(0., delay - (server_delay or 0)))
+                tries += 1
+                continue
+
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(host)
+            self._update_rate_limit(url, urlObj.headers)
             # check whether the data stream is compressed
-            if urlObj.headers.get('Content-Encoding') == 'gzip':
-                return self._getUncompressedStream(urlObj)
+            if urlObj.headers.get('Content-Encoding'):
+                urlObj = self._getUncompressedStream(urlObj)
+            if use_cache:
+                return self.http_cache.store(url, urlObj, user,
+                                             request_headers)
+            return urlObj
 
-        return urlObj
+    @staticmethod
+    def _get_retry_policy(retry_policy, retry=None):
+        ''' ::param retry_policy: the configured retry policy or None
+            ::param retry: optional number of retries
+            ::returns: the retry policy for the given number of retries
+        '''
+        if retry_policy is None:
+            return RetryPolicy(max_retries=retry or 0,
+                               backoff=RETRY_WAIT_TIME_RANGE[0],
+                               max_backoff=RETRY_WAIT_TIME_RANGE[1])
+        if retry is None:
+            return retry_policy
+        return retry_policy.replace(max_retries=retry)
+
+    def fetch_many(self, urls, workers=FETCH_MANY_WORKERS,
+                   workers_per_host=FETCH_MANY_WORKERS_PER_HOST, **kargs):
+        ''' retrieves the given urls concurrently
+            @param[in] urls     the urls to retrieve
+            @param[in] workers  the maximum number of concurrent requests
+            @param[in] workers_per_host the maximum number of concurrent
+                                requests per host
+            @param[in] kargs    further arguments passed to open()
+            @returns an iterator yielding (url, content) tuples in the order
+                     of completion; content is the exception raised for
+                     urls which could not be retrieved.
+
+            @remarks
+            Requests to hosts which have reached workers_per_host are
+            deferred in favor of other hosts, so that slow or throttled
+            hosts do not block the whole pool.
+        '''
+        pending = OrderedDict()
+        for url in urls:
+            pending.setdefault(urlsplit(url).netloc, deque()).append(url)
+        remaining = sum(len(host_urls) for host_urls in pending.values())
+        if not remaining:
+            return
+
+        active = dict((host, 0) for host in pending)
+        running = 0
+        results = Queue()
+        pool = ThreadPool(min(workers, remaining))
+        try:
+            while remaining:
+                # dispatch urls of hosts below their concurrency limit
+                for host, host_urls in list(pending.items()):
+                    while host_urls and running < workers and \
+                            active[host] < workers_per_host:
+                        active[host] += 1
+                        running += 1
+                        pool.apply_async(self._fetch,
+                                         (host, host_urls.popleft(), kargs),
+                                         callback=results.put)
+                    if not host_urls:
+                        del pending[host]
+
+                host, url, content = results.get()
+                active[host] -= 1
+                running -= 1
+                remaining -= 1
+                yield url, content
+        finally:
+            pool.terminate()
+
+    def _fetch(self, host, url, kargs):
+        ''' retrieves the url's content for fetch_many
+            @returns a (host, url, content or exception) tuple
+        '''
+        try:
+            f = self.open(url, **kargs)
+            try:
+                return host, url, f.read()
+            finally:
+                f.close()
+        except Exception as e:
+            log.warning("Cannot retrieve %s: %s", url, e)
+            return host, url, e
+
+    def iter_chunks(self, url, chunk_size=DEFAULT_CHUNK_SIZE, **kargs):
+        ''' retrieves the given url in chunks, which is suitable for large
+            downloads
+            @param[in] url
+            @param[in] chunk_size  the maximum size of the yielded chunks
+            @param[in] kargs       further arguments passed to open()
+            @returns an iterator over the (uncompressed) content
+        '''
+        urlObj = self.open(url, **kargs)
+        try:
+            for chunk in iter_chunks(urlObj, chunk_size):
+                yield chunk
+        finally:
+            urlObj.close()
 
     @staticmethod
     def _getHTTPBasicAuthOpener(url, user, pwd):
@@ -174,27 +367,40 @@ class Retrieve(object):
 
     @staticmethod
     def _getUncompressedStream(urlObj):
-        ''' transparently uncompressed the given data stream
+        ''' transparently uncompresses the given data stream while it is
+            read
             @param[in] urlObj
             @returns an urlObj containing the uncompressed data
         '''
-        compressedStream = io.BytesIO(urlObj.read())
-        return GzipFile(fileobj=compressedStream)
+        return decompress(urlObj, urlObj.headers.get('Content-Encoding'))
 
-    def _throttle(self):
+    def _throttle(self, url):
         ''' delays web access according to the content provider's policy '''
-
-        if (time.time() - self.last_access_time) < \
-                DEFAULT_WEB_REQUEST_SLEEP_TIME:
-            time.sleep(self.sleep_time)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(urlsplit(url).netloc)
         self.last_access_time = time.time()
 
+    def _update_rate_limit(self, url, headers):
+        ''' blocks the url's host, if the response headers request a delay
+            ::returns: the requested delay in seconds or None
+        '''
+        if self.rate_limiter is None:
+            return None
+        return self.rate_limiter.update_from_headers(urlsplit(url).netloc,
+                                                     headers)
+
+    def close(self):
+        ''' closes all idle keep-alive connections '''
+        if self._connection_pool is not None:
+            self._connection_pool.close()
+
     def __enter__(self):
         ''' support of the context protocol '''
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         ''' context protocol support '''
+        self.close()
         if exc_type is not None:
             log.critical("%s" % exc_type)
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.httpcache
+    HTTP response cache with conditional requests
+
+    The HTTPCache stores the (uncompressed) bodies of GET responses together
+    with their validators (ETag, Last-Modified) and freshness information
+    (Cache-Control max-age, Expires) in an eWRT cache. Retrieve objects with
+    an http_cache
+
+    - serve fresh responses without contacting the server,
+    - revalidate stale responses with If-None-Match / If-Modified-Since and
+      serve them from the cache, if the server answers 304 Not Modified.
+
+    Responses with a Vary header are only served to requests which send the
+    same values for the listed request headers; responses with "Vary: *"
+    are not cached.
+
+    usage:
+      r = Retrieve('rss', http_cache=HTTPCache('./cache/http'))
+      feed = r.open('http://www.heise.de/newsticker/heise-atom.xml').read()
+
+    @remarks
+    Cached responses are read completely into memory; the cache is not
+    intended for large downloads.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import io
+import logging
+import time
+
+from email.message import Message
+from email.utils import mktime_tz, parsedate_tz
+from threading import Lock
+
+from eWRT.util.cache import DiskCache
+
+log = logging.getLogger(__name__)
+
+# headers which do not apply to the cached (uncompressed) body
+EXCLUDED_HEADERS = ('content-encoding', 'content-length', 'connection',
+                    'keep-alive', 'transfer-encoding')
+# headers of a 304 response which update the cached entry
+UPDATED_HEADERS = ('cache-control', 'date', 'etag', 'expires',
+                   'last-modified')
+# request headers listed in Vary which do not affect the cached body, since
+# the cache stores uncompressed content
+IGNORED_VARY_HEADERS = ('accept-encoding', )
+
+
+def parse_cache_control(headers):
+    ''' ::returns: a dictionary with the Cache-Control directives '''
+    directives = {}
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def _parse_date(value):
+    date = parsedate_tz(value) if value else None
+    return mktime_tz(date) if date else None
+
+
+def get_max_age(headers):
+    ''' ::returns: the freshness lifetime of a response in seconds based on
+                   its Cache-Control and Expires headers (0 if the response
+                   needs to be revalidated) '''
+    directives = parse_cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']))
+        except ValueError:
+            return 0
+    expires = _parse_date(headers.get('Expires'))
+    if expires is None:
+        return 0
+    date = _parse_date(headers.get('Date')) or time.time()
+    return max(0, expires - date)
+
+
+def _get_all(headers, name):
+    ''' ::returns: the values of all headers with the given name '''
+    if hasattr(headers, 'get_all'):         # python 3, email messages
+        return headers.get_all(name) or []
+    if hasattr(headers, 'getheaders'):      # python 2 responses
+        return headers.getheaders(name)
+    value = headers.get(name)
+    return [value] if value else []
+
+
+def get_vary(response_headers, request_headers):
+    ''' ::returns: a sorted list of the (lower case) names and values of the
+                   request headers listed in the response's Vary header or
+                   None, if the response varies on all headers ("*") '''
+    names = set()
+    for value in _get_all(response_headers, 'Vary'):
+        names.update(name.strip().lower() for name in value.split(','))
+    if '*' in names:
+        return None
+    request_headers = _get_message((request_headers or {}).items())
+    return sorted((name, request_headers.get(name)) for name in names
+                  if name and name not in IGNORED_VARY_HEADERS)
+
+
+def _get_message(headers):
+    ''' ::returns: a Message (case insensitive headers) with the given
+                   (name, value) pairs '''
+    message = Message()
+    for name, value in headers:
+        message[name] = value
+    return message
+
+
+class CachedResponse(io.BytesIO):
+    ''' @class CachedResponse
+        a response served from the HTTPCache
+    '''
+
+    def __init__(self, entry):
+        io.BytesIO.__init__(self, entry['body'])
+        self.url = entry['url']
+        self.code = entry['code']
+        self.headers = _get_message(entry['headers'])
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+
+class HTTPCache(object):
+    ''' @class HTTPCache
+        stores responses and their validators for conditional requests
+    '''
+
+    def __init__(self, cache_dir=None, cache=None, **options):
+        ''' ::param cache_dir: the directory of the DiskCache holding the
+                               responses
+            ::param cache: an eWRT cache to use instead of a DiskCache
+                           (e.g. a MemoryCache or RedisCache)
+            ::param options: further arguments of the DiskCache
+        '''
+        if cache is None:
+            if cache_dir is None:
+                raise ValueError("HTTPCache requires a cache_dir or cache.")
+            cache = DiskCache(cache_dir, **options)
+        self.cache = cache
+        self._lock = Lock()
+        self._statistics = {'hits': 0, 'revalidated': 0, 'misses': 0,
+                            'stored': 0}
+
+    def get(self, url, user=None, headers=None):
+        ''' ::param headers: the request headers
+            ::returns: the cached entry for the given url or None, if there
+                       is no entry or it has been stored for a request with
+                       other values of the headers listed in its Vary header
+        '''
+        try:
+            entry = self.cache[self.cache.getKey(url, user)]
+        except KeyError:
+            return None
+        vary = entry.get('vary')
+        if vary and vary != get_vary(_get_message(entry['headers']),
+                                     headers):
+            return None
+        return entry
+
+    def is_fresh(self, entry, now=None):
+        ''' ::returns: True if the entry can be served without revalidation
+        '''
+        return (now or time.time()) - entry['stored_at'] < entry['max_age']
+
+    @staticmethod
+    def get_conditional_headers(entry):
+        ''' ::returns: the headers for revalidating the given entry '''
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def open_cached(self, entry, revalidated=False):
+        ''' ::returns: a CachedResponse for the given entry '''
+        self._count('revalidated' if revalidated else 'hits')
+        return CachedResponse(entry)
+
+    def revalidated(self, url, entry, headers, user=None):
+        ''' updates the entry after a 304 Not Modified response
+            ::param headers: the headers of the 304 response
+            ::returns: a CachedResponse for the entry
+        '''
+        cached = _get_message(entry['headers'])
+        updated = [(name, value) for name, value in entry['headers']
+                   if name.lower() not in UPDATED_HEADERS]
+        for name in UPDATED_HEADERS:
+            value = headers.get(name) or cached.get(name)
+            if value:
+                updated.append((name.title(), value))
+        entry = self._get_entry(entry['url'], entry['code'], updated,
+                                entry['body'], entry.get('vary'))
+        self.cache[self.cache.getKey(url, user)] = entry
+        return self.open_cached(entry, revalidated=True)
+
+    def store(self, url, response, user=None, headers=None):
+        ''' stores the given response, if it is cacheable
+            ::param url: the requested url
+            ::param response: the (uncompressed) response object
+            ::param headers: the request headers
+            ::returns: a CachedResponse with the response's content or the
+                       unchanged response, if it is not cacheable
+        '''
+        self._count('misses')
+        vary = get_vary(response.headers, headers)
+        if 'no-store' in parse_cache_control(response.headers) or \
+                vary is None or response.getcode() != 200:
+            return response
+
+        # responses without validator or freshness lifetime are streamed to
+        # the caller rather than read into memory
+        response_headers = [
+            (name.title(), value) for name, value in response.headers.items()
+            if name.lower() not in EXCLUDED_HEADERS]
+        message = _get_message(response_headers)
+        if not (get_max_age(message) or message.get('ETag') or
+                message.get('Last-Modified')):
+            return response
+
+        entry = self._get_entry(response.geturl(), response.getcode(),
+                                response_headers, response.read(), vary)
+        response.close()
+        self.cache[self.cache.getKey(url, user)] = entry
+        self._count('stored')
+        return CachedResponse(entry)
+
+    def get_statistics(self):
+        ''' ::returns: the number of fresh hits, revalidated responses,
+                       misses and stored responses '''
+        with self._lock:
+            return dict(self._statistics)
+
+    @staticmethod
+    def _get_entry(url, code, headers, body, vary=None):
+        message = _get_message(headers)
+        return {'url': url, 'code': code, 'headers': headers, 'body': body,
+                'vary': vary,
+                'etag': message.get('ETag'),
+                'last_modified': message.get('Last-Modified'),
+                'max_age': get_max_age(message),
+                'stored_at': time.time()}
+
+    def _count(self, name):
+        with self._lock:
+            self._statistics[name] += 1
+
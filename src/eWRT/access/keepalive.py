@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.keepalive
+    persistent (keep-alive) HTTP connections for urllib2
+
+    The KeepAliveHandler replaces urllib2's HTTP and HTTPS handlers, which
+    open a new connection for every request. Connections are returned to a
+    thread-safe HTTPConnectionPool as soon as their response has been read
+    completely and are reused by subsequent requests to the same host.
+
+    usage:
+      pool = HTTPConnectionPool(pool_size=4)
+      opener = urllib2.build_opener(KeepAliveHandler(pool))
+      opener.open('http://www.weblyzard.com').read()
+      ...
+      pool.close()
+
+    @remarks
+    Responses which are not read completely (or closed before) cannot be
+    reused, since the server's remaining data would be mistaken for the
+    next response. Under Python 2 only responses with a Content-Length are
+    returned to the pool.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import logging
+import socket
+import time
+
+from collections import defaultdict
+from threading import Lock
+
+import six
+
+from six.moves import http_client
+from six.moves.urllib.error import URLError
+from six.moves.urllib.request import HTTPHandler, HTTPSHandler
+from six.moves.urllib.response import addinfourl
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 60   # in seconds
+
+
+class HTTPConnectionPool(object):
+    ''' @class HTTPConnectionPool
+        thread-safe pool of idle HTTP connections, grouped by host
+    '''
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        ''' ::param pool_size: maximum number of idle connections kept per
+                               host (additional connections are closed)
+            ::param idle_timeout: connections which have been idle for more
+                                  than idle_timeout seconds are discarded
+        '''
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._idle = defaultdict(list)
+        self._lock = Lock()
+
+    def get(self, key):
+        ''' returns an idle connection for the given key or None '''
+        expired = []
+        conn = None
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                candidate, last_used = idle.pop()
+                if time.time() - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        return conn
+
+    def put(self, key, conn, reusable=True):
+        ''' returns the connection to the pool
+            ::param key: the pool key (connection class and host)
+            ::param conn: the connection
+            ::param reusable: False, if the connection must not be reused
+        '''
+        if reusable and conn.sock is not None:
+            with self._lock:
+                idle = self._idle[key]
+                if len(idle) < self.pool_size:
+                    idle.append((conn, time.time()))
+                    return
+        conn.close()
+
+    def close(self):
+        ''' closes all idle connections '''
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def __len__(self):
+        ''' ::returns: the number of idle connections '''
+        with self._lock:
+            return sum(len(connections) for connections in self._idle.values())
+
+
+class _PooledResponse(http_client.HTTPResponse):
+    ''' an HTTPResponse which returns its connection to the pool, once it
+        has been read completely or closed '''
+
+    _pool_release = None
+    _last_chunk = False
+
+    # python 3 only: the python 2 response neither reads chunks through
+    # _read_next_chunk_size nor releases the connection through _close_conn
+    # (it calls close() once the response has been read completely)
+    if hasattr(http_client.HTTPResponse, '_read_next_chunk_size'):
+        def _read_next_chunk_size(self):
+            chunk_size = http_client.HTTPResponse._read_next_chunk_size(self)
+            if chunk_size == 0:
+                self._last_chunk = True
+            return chunk_size
+
+    if hasattr(http_client.HTTPResponse, '_close_conn'):
+        def _close_conn(self):
+            http_client.HTTPResponse._close_conn(self)
+            self._release()
+
+    def close(self):
+        http_client.HTTPResponse.close(self)
+        self._release()
+
+    def _release(self):
+        release, self._pool_release = self._pool_release, None
+        if release is not None:
+            release(not self.will_close and
+                    (self.length == 0 or self._last_chunk))
+
+
+class _HTTPConnection(http_client.HTTPConnection):
+    response_class = _PooledResponse
+
+
+class _HTTPSConnection(http_client.HTTPSConnection):
+    response_class = _PooledResponse
+
+
+class KeepAliveHandler(HTTPHandler, HTTPSHandler):
+    ''' @class KeepAliveHandler
+        urllib2 handler for HTTP and HTTPS requests which reuses the
+        connections of an HTTPConnectionPool
+    '''
+
+    def __init__(self, pool=None, debuglevel=0, context=None):
+        ''' ::param pool: the HTTPConnectionPool to use (default: a new pool)
+            ::param debuglevel: debug level of the http connections
+            ::param context: optional ssl context for HTTPS connections
+        '''
+        HTTPSHandler.__init__(self, debuglevel=debuglevel, context=context)
+        self.pool = pool if pool is not None else HTTPConnectionPool()
+        self.context = context
+
+    def http_open(self, req):
+        return self._open(_HTTPConnection, req)
+
+    def https_open(self, req):
+        if self.context is None:
+            return self._open(_HTTPSConnection, req)
+        return self._open(_HTTPSConnection, req, context=self.context)
+
+    def _open(self, connection_class, req, **kargs):
+        ''' sends the request over a pooled (or new) connection
+            ::param connection_class: the http_client connection class
+            ::param req: the urllib2 request
+            ::returns: the response object
+        '''
+        host = req.host if hasattr(req, 'host') else req.get_host()
+        if not host:
+            raise URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((name, value) for name, value in req.headers.items()
+                       if name not in headers)
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), value)
+                       for name, value in headers.items())
+
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        tunnel_headers = {}
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = \
+                headers.pop('Proxy-Authorization')
+
+        selector = req.selector if hasattr(req, 'selector') \
+            else req.get_selector()
+        key = (connection_class, host, tunnel_host)
+
+        conn = self.pool.get(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = connection_class(host, timeout=req.timeout, **kargs)
+                conn.set_debuglevel(self._debuglevel)
+                if tunnel_host:
+                    conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            try:
+                conn.request(req.get_method(), selector, req.data, headers)
+                response = conn.getresponse()
+                break
+            except socket.timeout as e:
+                conn.close()
+                raise URLError(e)
+            except (socket.error, http_client.HTTPException) as e:
+                conn.close()
+                if not reused:
+                    raise URLError(e)
+                # the server has closed the idle connection in the meantime
+                log.debug("Reconnecting to %s after error: %s", host, e)
+                conn, reused = None, False
+
+        response._pool_release = lambda reusable: \
+            self.pool.put(key, conn, reusable)
+        if response.isclosed():
+            response._release()
+
+        if six.PY3:
+            # the python 3 response already is a file-like object
+            response.url = req.get_full_url()
+            response.msg = response.reason
+            return response
+
+        resp = addinfourl(response, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
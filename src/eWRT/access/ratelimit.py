@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.ratelimit
+    per-host token bucket rate limiting
+
+    A RateLimiter grants every host `rate` requests per second and allows
+    bursts of up to `burst` requests. The buckets are kept in a bucket store
+    which determines who shares the limits:
+
+    - MemoryBucketStore: all threads of the current process (default)
+    - FileBucketStore: all processes on the local machine
+    - RedisBucketStore: all processes using the same Redis server
+
+    Servers which signal an overload (Retry-After, X-RateLimit-Remaining and
+    X-RateLimit-Reset headers) block the host's bucket until the given time.
+
+    usage:
+      limiter = RateLimiter(rate=2, burst=5,
+                            store=FileBucketStore('/tmp/crawler-buckets'))
+      limiter.acquire('www.weblyzard.com')
+      ...
+      limiter.update_from_headers('www.weblyzard.com', response.headers)
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import logging
+import os
+import time
+
+from email.utils import mktime_tz, parsedate_tz
+from hashlib import sha1
+from os.path import exists, join
+from struct import Struct
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # not available on windows
+
+log = logging.getLogger(__name__)
+
+# values of X-RateLimit-Reset above this threshold are considered to be
+# unix timestamps rather than a number of seconds
+RESET_TIMESTAMP_THRESHOLD = 10 ** 9
+
+# a bucket's state: the number of tokens at the time of the last update
+BUCKET_STATE = Struct('>dd')
+
+
+def reserve(state, now, rate, burst):
+    ''' takes a token from the bucket
+        ::param state: the bucket's (tokens, updated) tuple or None for new
+                       buckets. updated lies in the future for blocked
+                       buckets and buckets with outstanding reservations.
+        ::param now: the current time
+        ::param rate: tokens added per second
+        ::param burst: the bucket's capacity
+        ::returns: the new state and the seconds to wait for the token
+    '''
+    tokens, updated = state or (burst, now)
+    if now > updated:
+        tokens = min(burst, tokens + (now - updated) * rate)
+        updated = now
+    tokens -= 1
+    wait = updated - now + (max(0., -tokens) / rate)
+    return (tokens, updated), wait
+
+
+def block(state, now, until):
+    ''' blocks the bucket until the given time
+        ::param state: the bucket's (tokens, updated) tuple or None
+        ::param now: the current time
+        ::param until: the time at which the next request is permitted
+        ::returns: the new state
+    '''
+    if state and state[1] >= until:
+        return state
+    # a single token becomes available at `until`; further requests are
+    # spread according to the bucket's rate
+    return (1., max(now, until))
+
+
+class MemoryBucketStore(object):
+    ''' @class MemoryBucketStore
+        keeps buckets in memory; they are shared among all threads
+    '''
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = Lock()
+
+    def update(self, key, function):
+        ''' atomically updates the bucket
+            ::param key: the bucket key
+            ::param function: a function which translates the current state
+                              to the new state and a result
+            ::returns: the result of the function
+        '''
+        with self._lock:
+            state, result = function(self._buckets.get(key))
+            self._buckets[key] = state
+        return result
+
+
+class FileBucketStore(object):
+    ''' @class FileBucketStore
+        keeps buckets in a local directory; they are shared among all
+        processes which use the same directory
+    '''
+
+    def __init__(self, bucket_dir):
+        ''' ::param bucket_dir: the directory holding the bucket files '''
+        if fcntl is None:
+            raise ValueError("FileBucketStore requires file locking (fcntl).")
+        if not exists(bucket_dir):
+            os.makedirs(bucket_dir)
+        self.bucket_dir = bucket_dir
+        self._lock = Lock()
+
+    def update(self, key, function):
+        ''' atomically updates the bucket (see MemoryBucketStore.update) '''
+        fname = join(self.bucket_dir, sha1(key.encode('utf-8')).hexdigest())
+        with self._lock:
+            fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.read(fd, BUCKET_STATE.size)
+                state = BUCKET_STATE.unpack(data) \
+                    if len(data) == BUCKET_STATE.size else None
+                state, result = function(state)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, BUCKET_STATE.pack(*state))
+            finally:
+                os.close(fd)    # also releases the lock
+        return result
+
+
+class RedisBucketStore(object):
+    ''' @class RedisBucketStore
+        keeps buckets in Redis; they are shared among all processes using
+        the same server and prefix
+    '''
+
+    def __init__(self, connection, prefix='eWRT:ratelimit', expire=3600):
+        ''' ::param connection: a redis.StrictRedis connection
+            ::param prefix: prefix of the bucket keys
+            ::param expire: seconds after which unused buckets are removed
+        '''
+        self.connection = connection
+        self.prefix = prefix
+        self.expire = expire
+
+    def update(self, key, function):
+        ''' atomically updates the bucket (see MemoryBucketStore.update) '''
+        redis_key = '%s:%s' % (self.prefix, key)
+        result = []
+
+        def transaction(pipe):
+            data = pipe.get(redis_key)
+            state = tuple(float(value) for value in data.split()) \
+                if data else None
+            state, res = function(state)
+            result[:] = [res]
+            pipe.multi()
+            pipe.set(redis_key, '%r %r' % state, ex=self.expire)
+
+        self.connection.transaction(transaction, redis_key)
+        return result[0]
+
+
+class RateLimiter(object):
+    ''' @class RateLimiter
+        thread-safe, per-host token bucket rate limiter
+    '''
+
+    def __init__(self, rate=1., burst=1, store=None, clock=time.time):
+        ''' ::param rate: number of requests per second and host
+            ::param burst: number of requests which may be issued at once
+            ::param store: the bucket store (default: a MemoryBucketStore)
+            ::param clock: function returning the current time in seconds
+        '''
+        if rate <= 0 or burst < 1:
+            raise ValueError("Invalid rate limit (rate=%s, burst=%s)."
+                             % (rate, burst))
+        self.rate = float(rate)
+        self.burst = burst
+        self.store = store if store is not None else MemoryBucketStore()
+        self.clock = clock
+
+    def reserve(self, host):
+        ''' reserves a request to the given host
+            ::returns: the number of seconds to wait before the request
+        '''
+        return self.store.update(
+            host, lambda state: reserve(state, self.clock(), self.rate,
+                                        self.burst))
+
+    def acquire(self, host):
+        ''' blocks until a request to the given host is permitted
+            ::returns: the number of seconds waited
+        '''
+        wait = self.reserve(host)
+        if wait > 0:
+            log.debug("Waiting %.2f s for host %s.", wait, host)
+            time.sleep(wait)
+        return max(wait, 0)
+
+    def block(self, host, seconds):
+        ''' blocks all requests to the given host for the given time '''
+        now = self.clock()
+        self.store.update(host, lambda state: (block(state, now,
+                                                     now + seconds), None))
+
+    def update_from_headers(self, host, headers):
+        ''' honors the Retry-After and X-RateLimit-* response headers
+            ::param host: the host which returned the headers
+            ::param headers: the response headers
+            ::returns: the number of seconds the host has been blocked for
+                       or None
+        '''
+        delay = get_retry_after(headers)
+        if delay is None:
+            delay = get_rate_limit_reset(headers)
+        if delay is not None and delay > 0:
+            log.info("Host %s requested a delay of %.1f s.", host, delay)
+            self.block(host, delay)
+        return delay
+
+
+def get_retry_after(headers, now=None):
+    ''' ::returns: the delay in seconds requested by a Retry-After header
+                   or None '''
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0., mktime_tz(date) - (now or time.time()))
+
+
+def get_rate_limit_reset(headers, now=None):
+    ''' ::returns: the delay in seconds until the rate limit is reset, if
+                   the X-RateLimit-Remaining header indicates that it has
+                   been exhausted, or None '''
+    if not headers:
+        return None
+    try:
+        remaining = int(headers.get('X-RateLimit-Remaining'))
+        reset = float(headers.get('X-RateLimit-Reset'))
+    except (TypeError, ValueError):
+        return None
+    if remaining > 0:
+        return None
+    if reset > RESET_TIMESTAMP_THRESHOLD:
+        reset -= now or time.time()
+    return max(0., reset)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.retry
+    retry policies and circuit breakers for HTTP requests
+
+    A RetryPolicy decides which errors are retried (temporary HTTP errors,
+    socket errors and timeouts) and how long to wait before the next try
+    (exponential backoff with full jitter, limited by an optional total
+    deadline).
+
+    A CircuitBreaker keeps track of the failures per host. After
+    failure_threshold consecutive failures the circuit opens and requests
+    to the host fail immediately with a CircuitOpenError. After
+    recovery_timeout seconds a single trial request is permitted, which
+    either closes the circuit again or re-opens it.
+
+    usage:
+      breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
+      r = Retrieve('crawler', circuit_breaker=breaker,
+                   retry_policy=RetryPolicy(max_retries=3, deadline=60))
+      ...
+      print(breaker.get_statistics())
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import logging
+import socket
+import time
+
+from random import uniform
+from threading import Lock
+
+from six.moves import http_client
+from six.moves.urllib.error import HTTPError, URLError
+
+log = logging.getLogger(__name__)
+
+# error codes which might trigger a retry
+HTTP_TEMPORARY_ERROR_CODES = (429, 500, 502, 503, 504)
+# errors which might trigger a retry (besides HTTPErrors)
+TEMPORARY_ERRORS = (URLError, socket.error, socket.timeout,
+                    http_client.HTTPException)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(URLError):
+    ''' raised for requests to hosts whose circuit is open '''
+
+    def __init__(self, host, retry_in):
+        URLError.__init__(self, "Circuit for host %s is open (retry in "
+                                "%.1f s)." % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class RetryPolicy(object):
+    ''' @class RetryPolicy
+        determines whether and when failed requests are retried
+    '''
+
+    def __init__(self, max_retries=0, backoff=1., max_backoff=60.,
+                 jitter=True, deadline=None,
+                 retry_codes=HTTP_TEMPORARY_ERROR_CODES,
+                 retry_errors=TEMPORARY_ERRORS):
+        ''' ::param max_retries: maximum number of retries
+            ::param backoff: the delay before the first retry; the delay
+                             doubles with every retry
+            ::param max_backoff: the maximum delay between two retries
+            ::param jitter: randomize the delays between 0 and the backoff
+                            ("full jitter"), so that clients which failed
+                            at the same time do not retry simultaneously
+            ::param deadline: optional maximum time in seconds spent on a
+                              request including all retries
+            ::param retry_codes: HTTP status codes which are retried
+            ::param retry_errors: exception classes which are retried (other
+                                  than HTTPErrors)
+        '''
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_codes = retry_codes
+        self.retry_errors = retry_errors
+
+    def replace(self, **kargs):
+        ''' ::returns: a copy of the policy with the given settings '''
+        settings = dict(vars(self))
+        settings.update(kargs)
+        return RetryPolicy(**settings)
+
+    def is_retryable(self, error):
+        ''' ::returns: True if the error indicates a temporary failure '''
+        if isinstance(error, HTTPError):
+            return error.code in self.retry_codes
+        return isinstance(error, self.retry_errors)
+
+    def get_delay(self, retry):
+        ''' ::param retry: the number of the retry (starting with 0)
+            ::returns: the delay in seconds before the given retry
+        '''
+        delay = min(self.max_backoff, self.backoff * 2 ** retry)
+        return uniform(0, delay) if self.jitter else delay
+
+    def next_delay(self, retry, error, start_time, min_delay=0):
+        ''' ::param retry: the number of retries so far
+            ::param error: the exception raised by the last try
+            ::param start_time: the time of the first try
+            ::param min_delay: the minimum delay requested by the server
+                               (e.g. through a Retry-After header)
+            ::returns: the delay before the next retry or None, if the
+                       request should not be retried
+        '''
+        if retry >= self.max_retries or not self.is_retryable(error):
+            return None
+        delay = max(self.get_delay(retry), min_delay or 0)
+        if self.deadline is not None and \
+                time.time() + delay - start_time > self.deadline:
+            log.info("Not retrying: the deadline of %s s would be exceeded.",
+                     self.deadline)
+            return None
+        return delay
+
+
+class CircuitBreaker(object):
+    ''' @class CircuitBreaker
+        thread-safe, per-host circuit breaker
+    '''
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.,
+                 retry_policy=None):
+        ''' ::param failure_threshold: number of consecutive failures which
+                                       open the circuit
+            ::param recovery_timeout: seconds after which a trial request is
+                                      permitted for an open circuit
+            ::param retry_policy: the policy used to distinguish failures
+                                  from other errors (default: RetryPolicy())
+        '''
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._hosts = {}
+        self._lock = Lock()
+
+    def _get_host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {
+                'state': CIRCUIT_CLOSED, 'consecutive_failures': 0,
+                'opened_at': 0., 'successes': 0, 'failures': 0,
+                'rejected': 0, 'opened': 0}
+        return state
+
+    def before_request(self, host):
+        ''' checks whether a request to the given host is permitted
+            ::raises CircuitOpenError: if the host's circuit is open
+        '''
+        with self._lock:
+            state = self._get_host(host)
+            if state['state'] == CIRCUIT_CLOSED:
+                return
+            retry_in = state['opened_at'] + self.recovery_timeout - time.time()
+            if state['state'] == CIRCUIT_OPEN and retry_in <= 0:
+                log.info("Circuit for host %s is half-open.", host)
+                state['state'] = CIRCUIT_HALF_OPEN
+                return
+            state['rejected'] += 1
+        raise CircuitOpenError(host, max(0., retry_in))
+
+    def record(self, host, error=None):
+        ''' records the outcome of a request
+            ::param host: the requested host
+            ::param error: the request's exception or None on success; only
+                           temporary errors count as failures
+        '''
+        if error is not None and not self.retry_policy.is_retryable(error):
+            error = None
+
+        with self._lock:
+            state = self._get_host(host)
+            if error is None:
+                state['successes'] += 1
+                state['consecutive_failures'] = 0
+                if state['state'] != CIRCUIT_CLOSED:
+                    log.info("Circuit for host %s is closed.", host)
+                    state['state'] = CIRCUIT_CLOSED
+                return
+
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            if state['state'] == CIRCUIT_HALF_OPEN or \
+                    state['consecutive_failures'] >= self.failure_threshold:
+                if state['state'] != CIRCUIT_OPEN:
+                    log.warning("Circuit for host %s is open after %d "
+                                "failures.", host,
+                                state['consecutive_failures'])
+                    state['opened'] += 1
+                state['state'] = CIRCUIT_OPEN
+                state['opened_at'] = time.time()
+
+    def get_state(self, host):
+        ''' ::returns: the state of the host's circuit '''
+        with self._lock:
+            return self._get_host(host)['state']
+
+    def get_statistics(self):
+        ''' ::returns: a dictionary with the circuit state and the number of
+                       successes, failures, rejected requests and openings
+                       per host '''
+        with self._lock:
+            return dict((host, dict(state))
+                        for host, state in self._hosts.items())
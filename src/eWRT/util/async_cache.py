@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.async_cache
+    caches the results of coroutine functions
+
+    AsyncCache wraps the synchronous caches of eWRT.util.cache. Concurrent
+    requests for the same key only await the wrapped coroutine once; all
+    other callers wait for its result. Lookups in caches which perform I/O
+    (DiskCache, RedisCache, ...) are executed in an executor, so that they
+    do not block the event loop.
+
+    usage:
+      @AsyncDiskCached('./cache/geocoder')
+      async def geocode(address):
+          ...
+
+    @remarks
+    This module requires Python 3.5 or later.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import asyncio
+import logging
+
+from concurrent.futures import TimeoutError
+from functools import partial
+
+from eWRT.util.cache import DiskCache, MemoryCache, RedisCache
+
+# seconds the background refresher waits for a stale object's recomputation
+DEFAULT_REFRESH_TIMEOUT = 60
+
+log = logging.getLogger(__name__)
+
+
+class AsyncCache(object):
+    ''' @class AsyncCache
+        memoizes coroutine functions based on a synchronous eWRT cache
+    '''
+
+    def __init__(self, cache, fn=None, executor=None, offload=None,
+                 refresh_timeout=DEFAULT_REFRESH_TIMEOUT):
+        ''' ::param cache: the underlying cache (e.g. a MemoryCache)
+            ::param fn: the coroutine function to cache (optional)
+            ::param executor: the executor used for cache lookups (default:
+                              the event loop's default executor)
+            ::param offload: whether to perform cache lookups in the
+                             executor; defaults to True for all caches
+                             except for the MemoryCache
+            ::param refresh_timeout: seconds after which the refresh of a
+                                     stale object is cancelled
+        '''
+        self.cache = cache
+        self.fn = fn
+        self.executor = executor
+        self.refresh_timeout = refresh_timeout
+        self.offload = not isinstance(cache, MemoryCache) \
+            if offload is None else offload
+
+        self._in_flight = {}
+        self._cache_hit = 0
+        self._cache_miss = 0
+        self._cache_wait = 0
+
+    async def __call__(self, *args, **kargs):
+        assert self.fn
+        return await self.fetch(self.fn, *args, **kargs)
+
+    async def fetch(self, fetch_function, *args, **kargs):
+        ''' returns the cached result of the coroutine function or awaits
+            the fetch_function and caches its result '''
+        key = self.cache.getKey(*args, **kargs)
+        return await self.fetchObjectId(key, fetch_function, *args, **kargs)
+
+    async def fetchObjectId(self, key, fetch_function, *args, **kargs):
+        ''' returns the object cached under the given key or awaits the
+            fetch_function and caches its result
+
+            @remarks
+            If the caller computing the object is cancelled, all callers
+            waiting for the result are cancelled as well.
+        '''
+        obj_id = self.cache.getObjectId(key)
+        flight = self._in_flight.get(obj_id)
+        if flight is None:
+            refresh = partial(self._refresh_threadsafe,
+                              asyncio.get_event_loop(), key, fetch_function,
+                              args, kargs)
+            try:
+                obj = await self._run(self.cache.lookup, key, refresh)
+                self._cache_hit += 1
+                return obj
+            except KeyError:
+                pass
+            # another task might have started the computation in between
+            flight = self._in_flight.get(obj_id)
+
+        if flight is not None:
+            self._cache_wait += 1
+            return await asyncio.shield(flight)
+
+        self._cache_miss += 1
+        flight = self._in_flight[obj_id] = \
+            asyncio.get_event_loop().create_future()
+        try:
+            obj = await fetch_function(*args, **kargs)
+            if obj is not None:
+                await self._run(self.cache.__setitem__, key, obj)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()      # the exception is raised to the caller
+            raise
+        else:
+            flight.set_result(obj)
+        finally:
+            del self._in_flight[obj_id]
+        return obj
+
+    def _refresh_threadsafe(self, loop, key, fetch_function, args, kargs):
+        ''' recomputes a stale object in the event loop (called by the
+            background refresher of caches like the DiskCache) '''
+        if loop.is_closed():
+            log.debug("Not refreshing %s, since its event loop is closed.",
+                      key)
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self._refresh(key, fetch_function, args, kargs), loop)
+        try:
+            future.result(self.refresh_timeout)
+        except TimeoutError:
+            # the loop is blocked or does not run anymore
+            future.cancel()
+            raise
+
+    async def _refresh(self, key, fetch_function, args, kargs):
+        obj = await fetch_function(*args, **kargs)
+        if obj is not None:
+            await self._run(self.cache.__setitem__, key, obj)
+
+    def getCacheStatistics(self):
+        ''' returns the number of cache hits, misses and of callers which
+            waited for a concurrent computation '''
+        return {'cache_hits': self._cache_hit,
+                'cache_misses': self._cache_miss,
+                'cache_waits': self._cache_wait}
+
+    async def _run(self, function, *args):
+        ''' calls the function in the executor (if required) '''
+        if not self.offload:
+            return function(*args)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, partial(function, *args))
+
+
+class AsyncMemoryCached(AsyncCache):
+    ''' Decorator based on MemoryCache for caching coroutine functions
+        usage:
+          @AsyncMemoryCached or @AsyncMemoryCached(max_cache_size)
+          async def myfunction(*args):
+    '''
+
+    def __init__(self, arg, **options):
+        ''' ::param arg: either the max_cache_size or the function to call
+            ::param options: further arguments of the MemoryCache
+        '''
+        if hasattr(arg, '__call__'):
+            AsyncCache.__init__(self, MemoryCache(**options), fn=arg)
+        else:
+            AsyncCache.__init__(self, MemoryCache(max_cache_size=arg,
+                                                  **options))
+
+    def __call__(self, *args, **kargs):
+        if self.fn is None:
+            self.fn = args[0]
+            return self
+        return AsyncCache.__call__(self, *args, **kargs)
+
+
+class AsyncDiskCached(object):
+    ''' Decorator based on DiskCache for caching coroutine functions
+        usage:
+          @AsyncDiskCached("./cache/myfunction")
+          async def myfunction(*args):
+    '''
+    __slots__ = ('cache', )
+
+    def __init__(self, cache_dir, executor=None, **options):
+        ''' ::param cache_dir: the cache base directory
+            ::param executor: optional executor for the disk I/O
+            ::param options: further arguments of the DiskCache
+        '''
+        self.cache = AsyncCache(DiskCache(cache_dir, **options),
+                                executor=executor)
+
+    def __call__(self, fn):
+        self.cache.fn = fn
+        return self.cache
+
+
+class AsyncRedisCached(AsyncMemoryCached):
+    ''' Decorator based on RedisCache for caching coroutine functions
+        usage:
+          @AsyncRedisCached or @AsyncRedisCached({'host': 'localhost'})
+          async def myfunction(*args):
+    '''
+
+    def __init__(self, arg):
+        ''' ::param arg: either a dictionary with the RedisCache's arguments
+                         or the function to call
+        '''
+        if hasattr(arg, '__call__'):
+            AsyncCache.__init__(self, RedisCache(), fn=arg)
+        else:
+            AsyncCache.__init__(self, RedisCache(**arg))
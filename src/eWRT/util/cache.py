@@ -5,17 +5,33 @@
 '''
 from __future__ import print_function
 
+import atexit
+import logging
 import redis
 import pickle
+import weakref
 
-from gzip import GzipFile
-from hashlib import sha1
+from collections import OrderedDict
+from functools import partial
 from operator import itemgetter
-from os import makedirs, remove, getpid, link
-from os.path import join, exists, dirname, basename, join
+from os import makedirs, remove, getpid, listdir, stat, utime, walk
+try:
+    from os import replace
+except ImportError:  # python2
+    from os import rename as replace
+from os.path import join, exists, dirname, basename, isdir
 from socket import gethostname
+from sys import getsizeof
+from threading import Event, RLock, Thread
 from time import time
+from types import ModuleType
+
+from six.moves.queue import Queue
 
+from eWRT.util.cachekey import KEY_DIGESTS, get_memory_key, legacy_digest
+from eWRT.util.codec import (LegacyCodec, MAX_HEADER_SIZE, decode,
+                             get_expiry)
+from eWRT.util.packstore import DEFAULT_SEGMENT_SIZE, PackStore
 from eWRT.util.pickleIterator import WritePickleIterator, ReadPickleIterator
 
 
@@ -36,11 +52,15 @@ from eWRT.util.pickleIterator import WritePickleIterator, ReadPickleIterator
 __author__ = "Albert Weichselbraun"
 __copyright__ = "GPL"
 
+log = logging.getLogger(__name__)
 
-try:
-    from cPickle import dump, load
-except ImportError:
-    from pickle import dump, load
+# freshness of DiskCache entries
+ENTRY_FRESH, ENTRY_STALE, ENTRY_EXPIRED = range(3)
+
+# fraction of the DiskCache's size limits the janitor evicts down to
+JANITOR_LOW_WATERMARK = 0.9
+# shards (object id prefixes) of FileStores without nesting
+FLAT_SHARDS = '0123456789abcdef'
 
 
 def get_unique_temp_file(fname): return join(dirname(fname),
@@ -48,6 +68,201 @@ def get_unique_temp_file(fname): return join(dirname(fname),
                                                             gethostname(), getpid()))
 
 
+def get_cache_fname(cache_dir, obj_id, cache_nesting_level=0,
+                    cache_file_suffix=""):
+    ''' Computes the filename of the file with the given
+        object identifier and creates the required directory
+        structure (if necessary).
+
+        @returns the full path of the given object's cache file
+    '''
+    assert len(obj_id) >= cache_nesting_level
+
+    obj_dir = join(*([cache_dir] + list(obj_id[:cache_nesting_level])))
+    if not exists(obj_dir):
+        try:
+            makedirs(obj_dir)
+        except OSError:            # required for multithreading
+            pass
+
+    return join(obj_dir, obj_id + cache_file_suffix)
+
+
+def align_results(keys, results):
+    ''' returns the results of a batch fetch function as list aligned with
+        the given keys
+        ::param keys: the keys passed to the batch fetch function
+        ::param results: a sequence with one result per key or a dictionary
+                         mapping keys to results
+    '''
+    if isinstance(results, dict):
+        return [results.get(key) for key in keys]
+    results = list(results)
+    if len(results) != len(keys):
+        raise ValueError("The batch fetch function returned %d results for "
+                         "%d keys." % (len(results), len(keys)))
+    return results
+
+
+def _iter_items(items):
+    ''' returns the (key, object) pairs of a dictionary or sequence '''
+    return items.items() if isinstance(items, dict) else items
+
+
+class FileStore(object):
+    ''' @class FileStore
+        DiskCache storage backend which keeps every object in a separate
+        file.
+
+        @remarks
+        The first level of the cache directory's nesting forms the store's
+        shards, which are scanned one by one by the DiskCache's janitor.
+        Stores without nesting are sharded by the first character of the
+        object ids; their directory is listed once per cycle through all
+        shards.
+    '''
+
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="",
+                 track_access=False):
+        ''' ::param track_access: update the modification time of files on
+                                  every read, so that the janitor can evict
+                                  the least recently used files even if the
+                                  file system does not record access times
+        '''
+        self.cache_dir = cache_dir
+        self.cache_nesting_level = cache_nesting_level
+        self.cache_file_suffix = cache_file_suffix
+        self.track_access = track_access
+        # file names per shard which have not been scanned yet (stores
+        # without nesting only)
+        self._listing = {}
+
+    def get_fname(self, obj_id):
+        ''' returns the full path of the given object's cache file '''
+        return get_cache_fname(self.cache_dir, obj_id,
+                               self.cache_nesting_level,
+                               self.cache_file_suffix)
+
+    def __contains__(self, obj_id):
+        return exists(self.get_fname(obj_id))
+
+    def get(self, obj_id):
+        ''' returns the data stored for the given object
+            ::raises KeyError: if the object is not cached
+        '''
+        cache_file = self.get_fname(obj_id)
+        try:
+            with open(cache_file, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            raise KeyError(obj_id)
+
+        if self.track_access:
+            try:
+                utime(cache_file, None)
+            except OSError:     # removed in the meantime
+                pass
+        return data
+
+    def get_head(self, obj_id, size):
+        ''' returns the first size bytes stored for the given object without
+            updating its access time
+            ::raises KeyError: if the object is not cached
+        '''
+        try:
+            with open(self.get_fname(obj_id), "rb") as f:
+                return f.read(size)
+        except (IOError, OSError):
+            raise KeyError(obj_id)
+
+    def put(self, obj_id, data):
+        ''' stores the data of the given object '''
+        cache_file = self.get_fname(obj_id)
+        temp_file = get_unique_temp_file(cache_file)
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        # atomically publish the new entry
+        replace(temp_file, cache_file)
+
+    def put_many(self, items):
+        ''' stores the data of multiple (object id, data) pairs '''
+        for obj_id, data in items:
+            self.put(obj_id, data)
+
+    def delete(self, obj_id):
+        ''' removes the given object from the cache
+            ::raises KeyError: if the object is not cached
+        '''
+        try:
+            remove(self.get_fname(obj_id))
+        except OSError:
+            raise KeyError(obj_id)
+
+    def shards(self):
+        ''' returns the names of the store's shards, i.e. the first level
+            directories (or the object id prefixes, if the store does not
+            use nesting) '''
+        if not self.cache_nesting_level:
+            return list(FLAT_SHARDS)
+        try:
+            return sorted(name for name in listdir(self.cache_dir)
+                          if isdir(join(self.cache_dir, name)))
+        except OSError:
+            return []
+
+    def scan_shard(self, shard):
+        ''' returns the access time, size and file name of all cache files
+            in the given shard '''
+        if self.cache_nesting_level:
+            files = ((path, fname) for path, _, fnames
+                     in walk(join(self.cache_dir, shard)) for fname in fnames)
+        else:
+            files = ((self.cache_dir, fname)
+                     for fname in self._pop_listing(shard))
+
+        entries = []
+        for path, fname in files:
+            if fname.startswith('_'):   # temporary files
+                continue
+            fname = join(path, fname)
+            try:
+                st = stat(fname)
+            except OSError:
+                continue
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size,
+                            fname))
+        return entries
+
+    def _pop_listing(self, shard):
+        ''' returns the file names of the given shard of a store without
+            nesting; the cache directory is listed again once all shards
+            of the previous listing have been scanned '''
+        fnames = self._listing.pop(shard, None)
+        if fnames is not None:
+            return fnames
+
+        listing = dict((prefix, []) for prefix in FLAT_SHARDS)
+        try:
+            for fname in listdir(self.cache_dir):
+                prefix = fname[:1].lower()
+                listing[prefix if prefix in listing
+                        else FLAT_SHARDS[0]].append(fname)
+        except OSError:
+            pass
+        fnames = listing.pop(shard, [])
+        self._listing = listing
+        return fnames
+
+    @staticmethod
+    def remove_file(fname):
+        ''' removes the given cache file and returns whether it existed '''
+        try:
+            remove(fname)
+            return True
+        except OSError:
+            return False
+
+
 class Cache(object):
     ''' An abstract class for caching functions '''
 
@@ -84,15 +299,151 @@ class Cache(object):
         '''
         raise NotImplementedError
 
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' Fetches the objects for all given keys from the cache and calls
+            the batch_fetch_function once with the list of missing keys.
+
+            ::param keys: the keys to fetch
+            ::param batch_fetch_function: function returning the objects of
+                the missing keys, either as list aligned with the keys or as
+                dictionary key -> object
+            ::returns: a list with the object of every key
+        '''
+        keys = list(keys)
+        results, missing = [], []
+        for no, key in enumerate(keys):
+            try:
+                results.append(self[key])
+            except KeyError:
+                results.append(None)
+                missing.append(no)
+        self._fetch_missing(keys, results, missing, batch_fetch_function)
+        return results
+
+    def set_many(self, items):
+        ''' stores multiple objects
+            ::param items: a dictionary or a sequence of (key, object) pairs
+        '''
+        for key, obj in _iter_items(items):
+            self[key] = obj
+
+    def lookup(self, key, refresh=None):
+        ''' returns the cached object for the given key
+            ::param refresh: optional function without arguments which
+                             recomputes and stores the object; caches which
+                             serve stale objects call it in the background
+            ::raises KeyError: if the key is not cached
+        '''
+        return self[key]
+
+    def _fetch_missing(self, keys, results, missing, batch_fetch_function):
+        ''' computes the results at the positions listed in missing and
+            stores them in bulk (None results are not cached) '''
+        if not missing:
+            return
+        missing_keys = [keys[no] for no in missing]
+        computed = align_results(missing_keys,
+                                 batch_fetch_function(missing_keys))
+        for no, obj in zip(missing, computed):
+            results[no] = obj
+        self.set_many([(key, obj) for key, obj in zip(missing_keys, computed)
+                       if obj != None])
+
     @staticmethod
     def getKey(*args, **kargs):
-        ''' returns the key for a set of function parameters '''
-        return (args, tuple(kargs.items()))
+        ''' returns the key for a set of function parameters
+
+            @remarks
+            Keyword arguments are sorted by name. Caches with the 'legacy'
+            key_digest use get_legacy_key() instead, which keeps the
+            identifiers of existing entries.
+        '''
+        return (args, tuple(sorted(kargs.items(), key=itemgetter(0))))
 
     @staticmethod
     def getObjectId(obj):
-        ''' returns an identifier representing the object '''
-        return sha1(repr(obj).encode("utf8")).hexdigest()
+        ''' returns an identifier representing the object
+
+            @remarks
+            Caches replace this method with the digest configured by their
+            key_digest parameter (see eWRT.util.cachekey.KEY_DIGESTS).
+        '''
+        return legacy_digest(obj)
+
+
+def get_legacy_key(*args, **kargs):
+    ''' returns the key for a set of function parameters as computed by
+        previous versions, i.e. with the keyword arguments in the order of
+        the call '''
+    return (args, tuple(kargs.items()))
+
+
+class _Refresher(object):
+    ''' refreshes stale cache entries in a background thread '''
+
+    def __init__(self):
+        self._queue = Queue()
+        self._lock = RLock()
+        self._pending = set()
+        self._thread = None
+
+    def submit(self, task_id, function, *args):
+        ''' schedules the given function unless a task with the same id
+            is already pending '''
+        with self._lock:
+            if task_id in self._pending:
+                return
+            self._pending.add(task_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((task_id, function, args))
+
+    def join(self):
+        ''' blocks until all scheduled tasks have been completed '''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            task_id, function, args = self._queue.get()
+            try:
+                function(*args)
+            except Exception:
+                log.exception("Refreshing the cache entry %s failed.",
+                              task_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(task_id)
+                self._queue.task_done()
+
+
+class _Janitor(object):
+    ''' calls the cache's collect_garbage method periodically in a daemon
+        thread; the thread only keeps a weak reference to the cache, so that
+        caches which are not closed can be collected '''
+
+    def __init__(self, cache, interval):
+        self._stopped = Event()
+        thread = Thread(target=self._run, args=(weakref.ref(cache),
+                                                self._stopped, interval))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    @staticmethod
+    def _run(cache_ref, stopped, interval):
+        while not stopped.wait(interval):
+            cache = cache_ref()
+            if cache is None:
+                return
+            try:
+                cache.collect_garbage()
+            except Exception:
+                log.exception("The cache janitor failed.")
+            del cache
 
 
 class DiskCache(Cache):
@@ -101,25 +452,253 @@ class DiskCache(Cache):
         on a user defined key (fetchObjectId)
 
         @remarks
-        This version of DiskCached is threadsafe
+        This version of DiskCached is threadsafe.
+
+        Caches with a ttl record the expiry time in the header of every
+        entry (see eWRT.util.codec.get_expiry). Expired entries are
+        recomputed; within the stale_while_revalidate period after their
+        expiry they are still returned while a background thread refreshes
+        them. Entries without expiry information (i.e. entries written by
+        caches without ttl) are considered expired by caches with a ttl.
+
+        The size of caches with max_cache_bytes or max_cache_entries limits
+        is enforced by a janitor thread which scans one shard (first level
+        directory) per janitor_interval and evicts the shard's least
+        recently used files in proportion to the cache's excess size. Pack
+        stores evict their oldest segments instead.
     '''
 
-    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="", fn=None):
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="",
+                 fn=None, storage='file', codec=None, key_digest='legacy',
+                 ttl=0, stale_while_revalidate=0, max_cache_bytes=0,
+                 max_cache_entries=0, janitor_interval=1):
         ''' initializes the Cache object
             ::param cache_dir: the cache base directory
             ::param cache_nesting_level: optional number of nesting level (0)
             ::param cache_file_suffix: optional suffix for cache files
             ::param fn: function to cache (optional; required for directly calling the class
                           using __call__
+            ::param storage: the storage backend to use - 'file'* (one file
+                             per object), 'pack' (append-only segment files,
+                             see eWRT.util.packstore) or a custom store
+            ::param codec: the eWRT.util.codec.Codec used for writing new
+                           entries (default: gzip compressed pickles without
+                           header). Entries are always readable, regardless
+                           of the codec they have been written with.
+            ::param key_digest: the digest used for computing object
+                                identifiers ('legacy'*, 'sha1', 'md5',
+                                'blake2b', 'fast'). All digests except for
+                                'legacy' are based on the canonical key
+                                encoding (see eWRT.util.cachekey) and
+                                sort keyword arguments.
+            ::param ttl: optional time to live of new entries in seconds or
+                         a function(key, obj) returning the time to live of
+                         the given object (0 ... the entry never expires)
+            ::param stale_while_revalidate: number of seconds after their
+                         expiry during which entries are returned while
+                         being refreshed in the background
+            ::param max_cache_bytes: optional limit of the cache's size on
+                                     disk in bytes (0 ... unlimited)
+            ::param max_cache_entries: optional limit of the number of
+                                       cached objects (0 ... unlimited)
+            ::param janitor_interval: seconds between two janitor steps;
+                                      0 disables the janitor thread, i.e.
+                                      collect_garbage() needs to be called
+                                      explicitly
         '''
         Cache.__init__(self, fn)
         self.cache_dir = cache_dir
         self.cache_file_suffix = cache_file_suffix
         self.cache_nesting_level = cache_nesting_level
+        self.max_cache_bytes = max_cache_bytes
+        self.max_cache_entries = max_cache_entries
+        limited = bool(max_cache_bytes or max_cache_entries)
+
+        if storage == 'file':
+            self._store = FileStore(cache_dir, cache_nesting_level,
+                                    cache_file_suffix, track_access=limited)
+        elif storage == 'pack':
+            # smaller segments allow for a more fine grained eviction
+            self._store = PackStore(cache_dir, segment_size=min(
+                DEFAULT_SEGMENT_SIZE, max_cache_bytes // 8 or
+                DEFAULT_SEGMENT_SIZE))
+        else:
+            self._store = storage
+        if limited and not isinstance(self._store, (FileStore, PackStore)):
+            raise ValueError("Size limits require the 'file' or 'pack' "
+                             "storage.")
+
+        self.codec = codec or LegacyCodec()
+        self.key_digest = key_digest
+        self.getObjectId = KEY_DIGESTS[key_digest]
+        if key_digest == 'legacy':
+            self.getKey = get_legacy_key
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._refresher = _Refresher()
+
+        self._janitor_lock = RLock()
+        self._shard_stats = {}
+        self._next_shard = 0
+        self._janitor = _Janitor(self, janitor_interval) \
+            if limited and janitor_interval else None
 
         self._cache_hit = 0
         self._cache_miss = 0
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the janitor keeps running in the process which created the cache
+        for attr in ('_refresher', '_janitor_lock', '_janitor'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._refresher = _Refresher()
+        self._janitor_lock = RLock()
+        self._janitor = None
+
+    def close(self):
+        ''' stops the janitor thread and closes the cache's store '''
+        if self._janitor is not None:
+            self._janitor.stop()
+            self._janitor = None
+        if hasattr(self._store, 'close'):
+            self._store.close()
+
+    def collect_garbage(self, full=False):
+        ''' performs an incremental janitor step, i.e. scans the next shard,
+            updates its statistics and evicts the shard's least recently
+            used files if the cache exceeds its size limits
+            ::param full: process all shards rather than a single one
+            ::returns: the number of evicted objects
+        '''
+        with self._janitor_lock:
+            if isinstance(self._store, PackStore):
+                return self._collect_segments()
+
+            shards = self._store.shards()
+            for shard in set(self._shard_stats).difference(shards):
+                del self._shard_stats[shard]
+            evicted = 0
+            for _ in range(len(shards) if full else min(len(shards), 1)):
+                shard = shards[self._next_shard % len(shards)]
+                self._next_shard += 1
+                evicted += self._collect_shard(shard, len(shards))
+            return evicted
+
+    def get_hot_entries(self, max_entries=0):
+        ''' returns the most recently used (file stores) or written (pack
+            stores) entries as (object id, encoded object) pairs, starting
+            with the most recent one
+            ::param max_entries: optional maximum number of entries
+        '''
+        if isinstance(self._store, PackStore):
+            obj_ids = self._store.newest_keys(max_entries)
+        elif isinstance(self._store, FileStore):
+            files = sorted((entry for shard in self._store.shards()
+                            for entry in self._store.scan_shard(shard)),
+                           reverse=True)
+            suffix_len = len(self.cache_file_suffix)
+            obj_ids = [basename(fname)[:len(basename(fname)) - suffix_len]
+                       for _, _, fname in files]
+        else:
+            obj_ids = list(self._store)
+
+        entries = []
+        for obj_id in obj_ids:
+            if max_entries and len(entries) >= max_entries:
+                break
+            try:
+                entries.append((obj_id, self._store.get(obj_id)))
+            except KeyError:    # removed in the meantime
+                pass
+        return entries
+
+    def restore_entries(self, entries):
+        ''' stores the (object id, encoded object) pairs returned by
+            get_hot_entries
+            ::returns: the number of restored objects
+        '''
+        entries = list(entries)
+        if hasattr(self._store, 'put_many'):
+            self._store.put_many(entries)
+        else:
+            for obj_id, data in entries:
+                self._store.put(obj_id, data)
+        return len(entries)
+
+    def getShardStatistics(self):
+        ''' returns the number of entries and bytes per shard as of their
+            last janitor scan (pack stores: the statistics of their
+            segments) '''
+        if isinstance(self._store, PackStore):
+            return self._store.get_statistics()
+        with self._janitor_lock:
+            return dict((shard, dict(stats))
+                        for shard, stats in self._shard_stats.items())
+
+    @staticmethod
+    def _get_excess(total, limit):
+        ''' returns the amount to evict for getting below the limit's low
+            watermark '''
+        if not limit or total <= limit:
+            return 0
+        return total - int(limit * JANITOR_LOW_WATERMARK)
+
+    def _collect_shard(self, shard, shard_count):
+        ''' scans the given shard and evicts its share of the cache's
+            excess entries and bytes '''
+        entries = self._store.scan_shard(shard)
+        stats = self._shard_stats[shard] = {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'scanned': time()}
+
+        # extrapolate the cache's size from the shards scanned so far
+        scale = float(shard_count) / len(self._shard_stats)
+        total_entries = scale * sum(s['entries']
+                                    for s in self._shard_stats.values())
+        total_bytes = scale * sum(s['bytes']
+                                  for s in self._shard_stats.values())
+        excess_entries = self._get_excess(total_entries,
+                                          self.max_cache_entries)
+        excess_bytes = self._get_excess(total_bytes, self.max_cache_bytes)
+        if not excess_entries and not excess_bytes:
+            return 0
+
+        evict_entries = excess_entries * stats['entries'] / total_entries \
+            if excess_entries else 0
+        evict_bytes = excess_bytes * stats['bytes'] / total_bytes \
+            if excess_bytes else 0
+        evicted = freed = 0
+        for _, size, fname in sorted(entries):
+            if evicted >= evict_entries and freed >= evict_bytes:
+                break
+            if self._store.remove_file(fname):
+                evicted += 1
+                freed += size
+
+        stats['entries'] -= evicted
+        stats['bytes'] -= freed
+        return evicted
+
+    def _collect_segments(self):
+        ''' evicts the oldest segments of pack stores until the cache
+            satisfies its size limits '''
+        evicted = 0
+        while True:
+            segments = self._store.get_statistics()
+            if len(segments) < 2 or not (
+                    (self.max_cache_bytes and sum(
+                        s['bytes'] for s in segments.values()) >
+                     self.max_cache_bytes) or
+                    (self.max_cache_entries and
+                     len(self._store) > self.max_cache_entries)):
+                return evicted
+            evicted += self._store.evict_oldest_segment()
+
     def fetch(self, fetch_function, *args, **kargs):
         ''' fetches the object with the given id, querying
              a) the cache and
@@ -137,14 +716,105 @@ class DiskCache(Cache):
         return self.fetchObjectId(objectId, fetch_function, *args, **kargs)
 
     def __contains__(self, key):
-        ''' returns whether the key is already stored in the cache '''
-        cache_file = self._get_fname(self.getObjectId(key))
-        return exists(cache_file)
+        ''' returns whether the key is stored in the cache and has not
+            expired (stale entries are considered cached) '''
+        obj_id = self.getObjectId(key)
+        if not self.ttl:
+            return obj_id in self._store
+
+        # only the header is required for checking the entry's expiry
+        try:
+            if hasattr(self._store, 'get_head'):
+                data = self._store.get_head(obj_id, MAX_HEADER_SIZE)
+            else:
+                data = self._store.get(obj_id)
+        except KeyError:
+            return False
+        return self.get_entry_state(data) != ENTRY_EXPIRED
 
     def __delitem__(self, key):
         ''' removes the given item from the cache '''
-        cache_file = self._get_fname(self.getObjectId(key))
-        remove(cache_file)
+        try:
+            self._store.delete(self.getObjectId(key))
+        except KeyError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        ''' returns the cached object for the given key
+            ::raises KeyError: if the key is not cached or expired
+        '''
+        return self.lookup(key)
+
+    def lookup(self, key, refresh=None):
+        ''' returns the cached object for the given key; stale objects are
+            returned and refreshed in the background by calling refresh
+            (see Cache.lookup)
+            ::raises KeyError: if the key is not cached or expired
+        '''
+        obj_id = self.getObjectId(key)
+        try:
+            data, state = self._get_entry(obj_id)
+        except KeyError:
+            raise KeyError(key)
+        if state == ENTRY_STALE and refresh is not None:
+            self._refresher.submit(obj_id, refresh)
+        return decode(data)
+
+    def _get_entry(self, obj_id, now=None):
+        ''' returns the encoded entry and its state (ENTRY_FRESH or
+            ENTRY_STALE)
+            ::raises KeyError: if the object is not cached or expired
+        '''
+        data = self._store.get(obj_id)
+        state = self.get_entry_state(data, now)
+        if state == ENTRY_EXPIRED:
+            raise KeyError(obj_id)
+        return data, state
+
+    def __setitem__(self, key, obj):
+        ''' stores the object under the given key '''
+        self._store.put(self.getObjectId(key), self._encode(key, obj))
+
+    def get_entry_state(self, data, now=None):
+        ''' returns whether the given encoded entry is fresh, stale (i.e.
+            expired but within the stale_while_revalidate period) or
+            expired, based on the expiry time stamp in its header
+            ::returns: ENTRY_FRESH, ENTRY_STALE or ENTRY_EXPIRED
+        '''
+        expiry = get_expiry(data)
+        if expiry is None:
+            return ENTRY_EXPIRED if self.ttl else ENTRY_FRESH
+
+        now = time() if now is None else now
+        if not expiry or expiry > now:
+            return ENTRY_FRESH
+        elif now < expiry + self.stale_while_revalidate:
+            return ENTRY_STALE
+        return ENTRY_EXPIRED
+
+    def wait_for_refreshes(self):
+        ''' blocks until all scheduled background refreshes of stale
+            entries have been completed '''
+        self._refresher.join()
+
+    def _encode(self, key, obj):
+        ''' encodes the object including its expiry time (if required) '''
+        if not self.ttl:
+            return self.codec.encode(obj)
+        ttl = self.ttl(key, obj) if callable(self.ttl) else self.ttl
+        return self.codec.encode(obj, expires=time() + ttl if ttl else 0)
+
+    def _refresh_object(self, obj_id, key, fetch_function, args, kargs):
+        ''' recomputes a stale object (called by the refresher) '''
+        obj = fetch_function(*args, **kargs)
+        if obj != None:
+            self._store.put(obj_id, self._encode(key, obj))
+
+    def _refresh_many(self, keys, batch_fetch_function):
+        ''' recomputes stale objects (called by the refresher) '''
+        self.set_many([(key, obj) for key, obj in zip(
+            keys, align_results(keys, batch_fetch_function(keys)))
+            if obj != None])
 
     def fetchObjectId(self, key, fetch_function, *args, **kargs):
         ''' fetches the object with the given id, querying
@@ -160,21 +830,23 @@ class DiskCache(Cache):
 
             ::returns: the object (retrieved from the cache or computed)
         '''
-        cache_file = self._get_fname(self.getObjectId(key))
-        if exists(cache_file):
+        obj_id = self.getObjectId(key)
+        try:
             #
-            # case 1: cache hit - return the cached result
+            # case 1: cache hit - return the cached result and refresh
+            # stale entries in the background
             #
+            obj = self.lookup(key, partial(self._refresh_object, obj_id, key,
+                                           fetch_function, args, kargs))
             self._cache_hit += 1
-            with GzipFile(cache_file) as f:
-                return load(f)
+            return obj
+        except KeyError:
+            pass
 
         #
-        # case 2: cache miss
+        # case 2: cache miss or expired entry
         # - compute and cache the result
         #
-        temp_file = get_unique_temp_file(cache_file)
-
         self._cache_miss += 1
         obj = fetch_function(*args, **kargs)
 
@@ -182,18 +854,49 @@ class DiskCache(Cache):
         if obj == None:
             return obj
 
-        with GzipFile(temp_file, "w") as f:
-            dump(obj, f)
+        self._store.put(obj_id, self._encode(key, obj))
+        return obj
 
-        try:
-            link(temp_file, cache_file)
-        # ignore file exists errors
-        except OSError as e:
-            if e.errno != 17:
-                raise e
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' fetches the objects for all given keys and calls the
+            batch_fetch_function once with the list of missing keys
+            (see Cache.fetch_many)
+        '''
+        keys = list(keys)
+        results, missing, stale = [], [], []
+        now = time()
+        for no, key in enumerate(keys):
+            try:
+                data, state = self._get_entry(self.getObjectId(key), now)
+            except KeyError:
+                self._cache_miss += 1
+                results.append(None)
+                missing.append(no)
+                continue
 
-        remove(temp_file)
-        return obj
+            self._cache_hit += 1
+            results.append(decode(data))
+            if state == ENTRY_STALE:
+                stale.append(key)
+
+        if stale:
+            self._refresher.submit(
+                tuple(self.getObjectId(key) for key in stale),
+                self._refresh_many, stale, batch_fetch_function)
+        self._fetch_missing(keys, results, missing, batch_fetch_function)
+        return results
+
+    def set_many(self, items):
+        ''' encodes and stores multiple objects in a single store operation
+            ::param items: a dictionary or a sequence of (key, object) pairs
+        '''
+        entries = [(self.getObjectId(key), self._encode(key, obj))
+                   for key, obj in _iter_items(items)]
+        if hasattr(self._store, 'put_many'):
+            self._store.put_many(entries)
+        else:
+            for obj_id, data in entries:
+                self._store.put(obj_id, data)
 
     def _remove(self, fname):
         ''' removes the given files (if it exists) '''
@@ -213,17 +916,9 @@ class DiskCache(Cache):
 
             @returns the full path of the given object's cache file
         '''
-        assert len(obj_id) >= self.cache_nesting_level
-
-        obj_dir = join(
-            *([self.cache_dir] + list(obj_id[:self.cache_nesting_level])))
-        if not exists(obj_dir):
-            try:
-                makedirs(obj_dir)
-            except OSError:            # required for multithreading
-                pass
-
-        return join(obj_dir, obj_id + self.cache_file_suffix)
+        return get_cache_fname(self.cache_dir, obj_id,
+                               self.cache_nesting_level,
+                               self.cache_file_suffix)
 
 
 class DiskCached(object):
@@ -237,72 +932,508 @@ class DiskCached(object):
     '''
     __slots__ = ('cache', )
 
-    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix=""):
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="",
+                 storage='file', codec=None, key_digest='legacy', ttl=0,
+                 stale_while_revalidate=0, max_cache_bytes=0,
+                 max_cache_entries=0):
         ''' initializes the Cache object
             ::param fn:                  the function to cache
             ::param cache_dir:           the cache base directory
             ::param cache_nesting_level: optional number of nesting level (0)
             ::param cache_file_suffix:   optional suffix for cache files
+            ::param storage:             the storage backend ('file'*, 'pack')
+            ::param codec:               optional codec for new entries
+            ::param key_digest:          the digest used for object ids
+            ::param ttl:                 optional time to live of entries
+            ::param stale_while_revalidate: optional period in which
+                                         expired entries are returned while
+                                         being refreshed
+            ::param max_cache_bytes:     optional size limit in bytes
+            ::param max_cache_entries:   optional limit of cached objects
         '''
         self.cache = DiskCache(
-            cache_dir, cache_nesting_level, cache_file_suffix)
+            cache_dir, cache_nesting_level, cache_file_suffix,
+            storage=storage, codec=codec, key_digest=key_digest, ttl=ttl,
+            stale_while_revalidate=stale_while_revalidate,
+            max_cache_bytes=max_cache_bytes,
+            max_cache_entries=max_cache_entries)
 
     def __call__(self, fn):
         self.cache.fn = fn
         return self.cache
 
 
+def rekey_cache(cache, keys=(), old_digest='legacy', calls=()):
+    ''' moves the entries of a DiskCache which have been stored under the
+        object identifiers computed by old_digest to the identifiers used by
+        the cache's current key_digest.
+
+        usage:
+          cache = DiskCache('./cache', key_digest='fast')
+          rekey_cache(cache, urls)
+          rekey_cache(cache, calls=[((url, ), {'lang': 'de'})
+                                    for url in urls])
+
+        ::param cache: the DiskCache to migrate
+        ::param keys: the keys of entries stored with fetchObjectId
+        ::param old_digest: the digest the entries have been stored with
+        ::param calls: the (args, kargs) of entries stored with fetch; the
+                       keyword arguments need to be in the order of the
+                       original calls for migrating 'legacy' entries
+        ::returns: the number of migrated entries
+    '''
+    old_object_id = KEY_DIGESTS[old_digest]
+    old_get_key = get_legacy_key if old_digest == 'legacy' else Cache.getKey
+    pairs = [(key, key) for key in keys] + \
+        [(old_get_key(*args, **kargs), cache.getKey(*args, **kargs))
+         for args, kargs in calls]
+    migrated = 0
+    for old_key, key in pairs:
+        old_id, new_id = old_object_id(old_key), cache.getObjectId(key)
+        if old_id == new_id:
+            continue
+        try:
+            data = cache._store.get(old_id)
+        except KeyError:
+            continue
+        cache._store.put(new_id, data)
+        cache._store.delete(old_id)
+        migrated += 1
+    return migrated
+
+
+def get_object_size(obj):
+    ''' returns the approximate memory footprint of the given object in
+        bytes, including the objects referenced by containers and instance
+        dictionaries (objects referenced multiple times are counted once)
+    '''
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        if hasattr(obj, '__dict__') and \
+                not isinstance(obj, (type, ModuleType)):
+            pending.append(obj.__dict__)
+    return size
+
+
+def _move_to_end(ordered_dict, key):
+    ''' moves the given key to the end of an OrderedDict '''
+    try:
+        ordered_dict.move_to_end(key)
+    except AttributeError:  # python2
+        ordered_dict[key] = ordered_dict.pop(key)
+
+
+class LRUPolicy(object):
+    ''' @class LRUPolicy
+        Evicts the least recently used object; all operations are O(1).
+    '''
+    __slots__ = ('_order', )
+
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def __len__(self):
+        return len(self._order)
+
+    def add(self, key):
+        ''' registers a newly cached key '''
+        self._order[key] = None
+
+    def touch(self, key):
+        ''' records a cache hit for the given key '''
+        _move_to_end(self._order, key)
+
+    def remove(self, key):
+        ''' forgets the given key (if present) '''
+        self._order.pop(key, None)
+
+    def evict(self):
+        ''' removes and returns the key to evict next '''
+        return self._order.popitem(last=False)[0]
+
+    def ranked(self):
+        ''' returns all keys, starting with the most recently used one '''
+        return list(reversed(self._order))
+
+
+class LFUPolicy(object):
+    ''' @class LFUPolicy
+        Evicts the least frequently used object (ties are resolved in LRU
+        order); all operations are O(1).
+    '''
+    __slots__ = ('_freq', '_buckets', '_min_freq')
+
+    def __init__(self):
+        self._freq = {}
+        self._buckets = {}
+        self._min_freq = 0
+
+    def __len__(self):
+        return len(self._freq)
+
+    def add(self, key):
+        ''' registers a newly cached key '''
+        self._freq[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_freq = 1
+
+    def touch(self, key):
+        ''' records a cache hit for the given key '''
+        freq = self._freq[key]
+        self._discard(key, freq)
+        if self._min_freq == freq and freq not in self._buckets:
+            self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def remove(self, key):
+        ''' forgets the given key (if present) '''
+        freq = self._freq.pop(key, None)
+        if freq is not None:
+            self._discard(key, freq)
+
+    def evict(self):
+        ''' removes and returns the key to evict next '''
+        if self._min_freq not in self._buckets:
+            # only required after remove() emptied the lowest bucket
+            self._min_freq = min(self._buckets)
+        key = self._buckets[self._min_freq].popitem(last=False)[0]
+        self._discard(key, self._min_freq, remove_key=False)
+        del self._freq[key]
+        return key
+
+    def ranked(self):
+        ''' returns all keys, starting with the most frequently used one '''
+        return [key for freq in sorted(self._buckets, reverse=True)
+                for key in reversed(self._buckets[freq])]
+
+    def _discard(self, key, freq, remove_key=True):
+        ''' removes the key from the given frequency bucket '''
+        bucket = self._buckets[freq]
+        if remove_key:
+            del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+
+
+EVICTION_POLICIES = {'lru': LRUPolicy, 'lfu': LFUPolicy}
+
+
+class _DummyLock(object):
+    ''' no-op lock used by caches which are not thread safe '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _Flight(object):
+    ''' a computation in progress which is shared by all callers requesting
+        the same key '''
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        ''' waits for the computation and returns its result '''
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 class MemoryCache(Cache):
     '''
         @class MemoryCached
 
         Caches abitrary functions based on the function's arguments (fetch) or
         on a user defined key (fetchObjectId)
+
+        @remarks
+        Thread safety is optional. Thread safe caches use single-flight
+        semantics, i.e. concurrent misses of the same key only call the
+        fetch_function once and all other callers wait for its result.
     '''
-    __slots__ = ('max_cache_size', '_cacheData', '_usage')
+    __slots__ = ('max_cache_size', 'max_cache_bytes', 'ttl', '_cacheData',
+                 '_policy', '_expires', '_sizer', '_sizes', '_cache_bytes',
+                 '_lock', '_in_flight', '_cache_hit', '_cache_miss',
+                 '_cache_wait')
 
-    def __init__(self, max_cache_size=0, fn=None):
-        ''' initializes the Cache object '''
+    def __init__(self, max_cache_size=0, fn=None, policy='lru', ttl=0,
+                 thread_safe=False, max_cache_bytes=0, sizer=None):
+        ''' initializes the Cache object
+            ::param max_cache_size: maximum number of cached objects
+                                    (0 ... unlimited)
+            ::param fn:     function to cache (optional)
+            ::param policy: the eviction policy ('lru'*, 'lfu')
+            ::param ttl:    optional time to live of cached objects in
+                            seconds (0 ... objects never expire)
+            ::param thread_safe: whether to synchronize access to the
+                                 cache (False*)
+            ::param max_cache_bytes: optional memory budget in bytes
+                                     (0 ... unlimited)
+            ::param sizer:  function returning the (approximate) size of an
+                            object in bytes; defaults to get_object_size if
+                            a max_cache_bytes budget has been specified
+        '''
         Cache.__init__(self, fn)
+        # in-memory caches do not require hashed keys
+        self.getObjectId = get_memory_key
         self._cacheData = {}
-        self._usage = {}
+        self._policy = EVICTION_POLICIES[policy]()
+        self._expires = {}
         self.max_cache_size = max_cache_size
+        self.max_cache_bytes = max_cache_bytes
+        self.ttl = ttl
+
+        self._sizer = sizer or (get_object_size if max_cache_bytes else None)
+        self._sizes = {}
+        self._cache_bytes = 0
+
+        self._lock = RLock() if thread_safe else _DummyLock()
+        self._in_flight = {} if thread_safe else None
+
+        self._cache_hit = 0
+        self._cache_miss = 0
+        self._cache_wait = 0
 
     def fetch(self, fetch_function, *args, **kargs):
         key = self.getKey(*args, **kargs)
         return self.fetchObjectId(key, fetch_function, *args, **kargs)
 
     def fetchObjectId(self, key, fetch_function, *args, **kargs):
-        # update the object's last usage time stamp
-        key = self.getObjectId(key)
-        self._usage[key] = time()
+        obj_id = self.getObjectId(key)
+        if self._in_flight is not None:
+            return self._fetch_single_flight(obj_id, fetch_function, args,
+                                             kargs)
         try:
-            return self._cacheData[key]
+            return self._lookup(obj_id)
         except KeyError:
-            obj = fetch_function(*args, **kargs)
-            if obj != None:
-                self.garbage_collect_cache()
-                self._cacheData[key] = obj
-            return obj
+            self._cache_miss += 1
+
+        obj = fetch_function(*args, **kargs)
+        if obj != None:
+            self._store_object(obj_id, obj)
+        return obj
+
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' fetches the objects for all given keys and calls the
+            batch_fetch_function once with the list of missing keys
+            (see Cache.fetch_many)
+        '''
+        keys = list(keys)
+        results, missing = [], []
+        with self._lock:
+            for no, key in enumerate(keys):
+                try:
+                    results.append(self._lookup(self.getObjectId(key)))
+                except KeyError:
+                    self._cache_miss += 1
+                    results.append(None)
+                    missing.append(no)
+        self._fetch_missing(keys, results, missing, batch_fetch_function)
+        return results
+
+    def set_many(self, items):
+        ''' stores multiple objects
+            ::param items: a dictionary or a sequence of (key, object) pairs
+        '''
+        with self._lock:
+            for key, obj in _iter_items(items):
+                self._store_object(self.getObjectId(key), obj)
+
+    def _fetch_single_flight(self, obj_id, fetch_function, args, kargs):
+        ''' thread safe version of fetchObjectId which ensures that only one
+            thread computes a missing object '''
+        with self._lock:
+            try:
+                return self._lookup(obj_id)
+            except KeyError:
+                flight = self._in_flight.get(obj_id)
+                if flight is None:
+                    flight = self._in_flight[obj_id] = _Flight()
+                    self._cache_miss += 1
+                    is_leader = True
+                else:
+                    self._cache_wait += 1
+                    is_leader = False
+
+        if not is_leader:
+            return flight.wait()
+
+        try:
+            flight.result = fetch_function(*args, **kargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.result != None:
+                    self._store_object(obj_id, flight.result)
+                del self._in_flight[obj_id]
+            flight.done.set()
+        return flight.result
+
+    def _lookup(self, obj_id):
+        ''' returns the cached object with the given identifier
+            ::raises KeyError: if the object is not cached or expired
+        '''
+        obj = self._cacheData[obj_id]
+        if self._expire(obj_id):
+            raise KeyError(obj_id)
+
+        self._policy.touch(obj_id)
+        self._cache_hit += 1
+        return obj
+
+    def _expire(self, obj_id):
+        ''' removes the object with the given identifier, if its time to
+            live has passed
+            ::returns: True if the object has expired
+        '''
+        if self.ttl and self._expires[obj_id] <= time():
+            self._remove_object(obj_id)
+            return True
+        return False
 
     def __contains__(self, key):
-        ''' returns whether the key is already stored in the cache '''
-        return self.getObjectId(key) in self._cacheData
+        ''' returns whether the key is stored in the cache and has not
+            expired yet '''
+        obj_id = self.getObjectId(key)
+        with self._lock:
+            return obj_id in self._cacheData and not self._expire(obj_id)
 
     def __delitem__(self, key):
         ''' removes the given item from the cache '''
-        del self._cacheData[self.getObjectId(key)]
+        obj_id = self.getObjectId(key)
+        with self._lock:
+            if obj_id not in self._cacheData:
+                raise KeyError(key)
+            self._remove_object(obj_id)
+
+    def __getitem__(self, key):
+        ''' returns the cached object for the given key
+            ::raises KeyError: if the key is not cached
+        '''
+        with self._lock:
+            try:
+                return self._lookup(self.getObjectId(key))
+            except KeyError:
+                raise KeyError(key)
+
+    def __setitem__(self, key, obj):
+        ''' stores the object under the given key '''
+        with self._lock:
+            self._store_object(self.getObjectId(key), obj)
+
+    def __len__(self):
+        return len(self._cacheData)
+
+    @property
+    def cache_bytes(self):
+        ''' the (approximate) number of bytes occupied by cached objects;
+            only available if a sizer or a max_cache_bytes budget has been
+            specified '''
+        return self._cache_bytes
 
-    def garbage_collect_cache(self):
-        ''' removes the object which have not been in use for the
-            longest time '''
-        if self.max_cache_size == 0 or len(self._cacheData) <= self.max_cache_size:
+    def getCacheStatistics(self):
+        ''' returns statistics regarding the cache's hit/miss ratio, the
+            number of callers which waited for a concurrent computation and
+            the cache's size '''
+        return {'cache_hits': self._cache_hit,
+                'cache_misses': self._cache_miss,
+                'cache_waits': self._cache_wait,
+                'cache_size': len(self._cacheData),
+                'cache_bytes': self._cache_bytes}
+
+    def get_hot_entries(self, max_entries=0):
+        ''' returns the cache's hot set as (object id, object, expiry time)
+            triples, starting with the object the eviction policy would
+            evict last
+            ::param max_entries: optional maximum number of entries
+        '''
+        with self._lock:
+            ranked = self._policy.ranked()
+            if max_entries:
+                ranked = ranked[:max_entries]
+            return [(obj_id, self._cacheData[obj_id],
+                     self._expires.get(obj_id, 0)) for obj_id in ranked]
+
+    def restore_entries(self, entries):
+        ''' adds the (object id, object, expiry time) triples returned by
+            get_hot_entries, skipping expired objects
+            ::returns: the number of restored objects
+        '''
+        now = time()
+        restored = 0
+        with self._lock:
+            # the hottest objects are added last
+            for obj_id, obj, expires in reversed(list(entries)):
+                if expires and expires <= now:
+                    continue
+                self._store_object(obj_id, obj)
+                if expires and obj_id in self._cacheData:
+                    self._expires[obj_id] = expires
+                restored += 1
+        return restored
+
+    def garbage_collect_cache(self, required_bytes=0):
+        ''' evicts objects according to the cache's eviction policy until
+            there is room for at least one additional object
+            ::param required_bytes: the size of the object to add
+        '''
+        with self._lock:
+            while self._cacheData and (
+                    (self.max_cache_size and
+                     len(self._cacheData) >= self.max_cache_size) or
+                    (self.max_cache_bytes and self._cache_bytes +
+                     required_bytes > self.max_cache_bytes)):
+                self._remove_object(self._policy.evict())
+
+    def _store_object(self, obj_id, obj):
+        ''' stores the object with the given object identifier '''
+        if obj_id in self._cacheData:
+            self._remove_object(obj_id)
+
+        size = self._sizer(obj) if self._sizer else 0
+        if self.max_cache_bytes and size > self.max_cache_bytes:
+            # the replaced object has been removed nevertheless
             return
 
-        (key, _) = sorted(self._usage.items(),
-                          key=itemgetter(1), reverse=True).pop()
-        del self._usage[key]
-        del self._cacheData[key]
+        self.garbage_collect_cache(size)
+        self._policy.add(obj_id)
+        self._cacheData[obj_id] = obj
+        if self._sizer:
+            self._sizes[obj_id] = size
+            self._cache_bytes += size
+        if self.ttl:
+            self._expires[obj_id] = time() + self.ttl
+
+    def _remove_object(self, obj_id):
+        ''' removes the object with the given identifier '''
+        self._policy.remove(obj_id)
+        self._expires.pop(obj_id, None)
+        self._cache_bytes -= self._sizes.pop(obj_id, 0)
+        del self._cacheData[obj_id]
 
 
 class MemoryCached(MemoryCache):
@@ -312,15 +1443,23 @@ class MemoryCached(MemoryCache):
           def myfunction(*args):            ...
     '''
 
-    def __init__(self, arg):
+    def __init__(self, arg, policy='lru', ttl=0, thread_safe=False,
+                 max_cache_bytes=0, sizer=None):
         ''' initializes the MemoryCache object
             ::param arg: either the max_cache_size or the function to call
+            ::param policy: the eviction policy ('lru'*, 'lfu')
+            ::param ttl: optional time to live of cached objects in seconds
+            ::param thread_safe: whether to synchronize access to the cache
+            ::param max_cache_bytes: optional memory budget in bytes
+            ::param sizer: optional function computing an object's size
         '''
+        options = {'policy': policy, 'ttl': ttl, 'thread_safe': thread_safe,
+                   'max_cache_bytes': max_cache_bytes, 'sizer': sizer}
         if hasattr(arg, '__call__'):
-            MemoryCache.__init__(self)
+            MemoryCache.__init__(self, **options)
             self._fn = arg
         else:
-            MemoryCache.__init__(self, max_cache_size=arg)
+            MemoryCache.__init__(self, max_cache_size=arg, **options)
             self._fn = None
 
     def __call__(self, *args, **kargs):
@@ -334,8 +1473,36 @@ class MemoryCached(MemoryCache):
             return self.fetch(self._fn, *args, **kargs)
 
 
+class _CachingIterator(object):
+    ''' passes the elements of an iterable through and writes them to the
+        given cache file '''
+
+    def __init__(self, iterable, cache_file):
+        self._iterator = iter(iterable)
+        self._pickle_iterator = WritePickleIterator(cache_file)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            obj = next(self._iterator)
+        except StopIteration:
+            self._pickle_iterator.close()
+            raise
+        self._pickle_iterator.dump(obj)
+        return obj
+
+    next = __next__
+
+
 class IterableCache(DiskCache):
-    ''' caches arbitrary iterable content identified by an identifier '''
+    ''' caches arbitrary iterable content identified by an identifier
+
+        @remarks
+        Content is only cached once the iterable has been consumed
+        completely (see eWRT.util.pickleIterator).
+    '''
 
     def __iter__(self):
         return self
@@ -356,10 +1523,10 @@ class IterableCache(DiskCache):
         '''
         cache_file = self._get_fname(self.getObjectId(key))
 
-        if exists(cache_file):
-            self._cached = True
+        try:
             self._pickle_iterator = ReadPickleIterator(cache_file)
-        else:
+            self._cached = True
+        except IOError:     # missing or incomplete cache file
             self._fetch_function_iterator = function(*args, **kargs).__iter__()
             self._cached = False
             self._pickle_iterator = WritePickleIterator(cache_file)
@@ -369,6 +1536,37 @@ class IterableCache(DiskCache):
     def next(self):
         return self._read_next_element() if self._cached else self._cache_next_element()
 
+    __next__ = next
+
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' returns an iterator for every given key and calls the
+            batch_fetch_function once with the list of missing keys
+
+            ::param keys: the keys to fetch
+            ::param batch_fetch_function: function returning an iterable for
+                every missing key (as list or as dictionary key -> iterable)
+            ::returns: a list of iterators; iterators over missing content
+                       write the content to the cache while being consumed
+        '''
+        keys = list(keys)
+        cache_files = [self._get_fname(self.getObjectId(key)) for key in keys]
+        results, missing = [], []
+        for no, cache_file in enumerate(cache_files):
+            try:
+                results.append(ReadPickleIterator(cache_file))
+                self._cache_hit += 1
+            except IOError:
+                self._cache_miss += 1
+                results.append(None)
+                missing.append(no)
+
+        if missing:
+            missing_keys = [keys[no] for no in missing]
+            for no, iterable in zip(missing, align_results(
+                    missing_keys, batch_fetch_function(missing_keys))):
+                results[no] = _CachingIterator(iterable, cache_files[no])
+        return results
+
     def _cache_next_element(self):
         ''' a) retrieves the next element from the fetch function
             b) writes the data to the cache
@@ -381,73 +1579,269 @@ class IterableCache(DiskCache):
             return obj
         except StopIteration:
             self._pickle_iterator.close()
-            raise StopIteration
+            raise
 
     def _read_next_element(self):
         ''' returns the next element from the cache '''
         self._cache_hit += 1
         try:
             return next(self._pickle_iterator)
-        except IOError:
+        except StopIteration:
             self._pickle_iterator.close()
-            raise StopIteration
+            raise
 
 
 class RedisCache(Cache):
+    ''' @class RedisCache
+        Caches abitrary functions in a Redis database.
+
+        @remarks
+        Objects are stored under '<prefix>:d:<object id>'. If the cache size
+        is limited by max_cache_size or max_cache_bytes the recency of objects
+        is tracked in the sorted set '<prefix>:lru', so that evictions do not
+        require scanning all keys. Without these limits the cache relies on
+        the server's eviction (e.g. maxmemory-policy allkeys-lru) and the
+        optional ttl. All commands required for a lookup are pipelined.
+    '''
+
+    EVICTION_BATCH_SIZE = 16
 
-    def __init__(self, max_cache_size=0, fn=None, host='localhost', port=6379, db=0):
-        ''' initializes the Cache object '''
+    def __init__(self, max_cache_size=0, fn=None, host='localhost', port=6379, db=0,
+                 key_digest='legacy', max_cache_bytes=0, ttl=0, prefix='eWRT',
+                 connection=None):
+        ''' initializes the Cache object
+            ::param max_cache_size: maximum number of cached objects
+            ::param fn: function to cache (optional)
+            ::param host, port, db: the Redis server and database to use
+            ::param key_digest: the digest used for object ids
+            ::param max_cache_bytes: optional budget for the size of the
+                                     pickled objects in bytes
+            ::param ttl: optional time to live of cached objects in seconds
+            ::param prefix: prefix of all keys used by the cache
+            ::param connection: an existing Redis client (optional; overrides
+                                host, port and db)
+        '''
         Cache.__init__(self, fn)
-        self._cacheData = redis.StrictRedis(host=host, port=port, db=db)
-        self._usage = redis.StrictRedis(host=host, port=port, db=1)
+        self.getObjectId = KEY_DIGESTS[key_digest]
+        if key_digest == 'legacy':
+            self.getKey = get_legacy_key
+        self.max_cache_size = max_cache_size
+        self.max_cache_bytes = max_cache_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = connection if connection is not None else \
+            redis.StrictRedis(host=host, port=port, db=db)
+
+        self._lru_key = '%s:lru' % prefix
+        self._sizes_key = '%s:sizes' % prefix
+        self._bytes_key = '%s:bytes' % prefix
+
         try:
-            self._cacheData.ping()
-            self.max_cache_size = max_cache_size
-        except:
-            print("RedisCache requires a running Redis server.")
+            self._redis.ping()
+        except redis.RedisError:
+            log.error("RedisCache requires a running Redis server.")
+
+    @property
+    def _track_usage(self):
+        return bool(self.max_cache_size or self.max_cache_bytes)
+
+    def _data_key(self, obj_id):
+        return '%s:d:%s' % (self.prefix, obj_id)
 
     def fetch(self, fetch_function, *args, **kargs):
         key = self.getKey(*args, **kargs)
         return self.fetchObjectId(key, fetch_function, *args, **kargs)
 
     def fetchObjectId(self, key, fetch_function, *args, **kargs):
-        # update the object's last usage time stamp
-        key = self.getObjectId(key)
-        self._usage[key] = time()
+        obj_id = self.getObjectId(key)
         # pickling is necessary because Redis turns every input into
         # a string
-        try:
-            return(pickle.loads(self._cacheData[key]))
-        except KeyError:
-            obj = fetch_function(*args, **kargs)
-            if obj != None:
-                self.garbage_collect_cache()
-                p_obj = pickle.dumps(obj)
-                self._cacheData[key] = p_obj
-            return(obj)
-
-    def garbage_collect_cache(self):
-        ''' removes the object which have not been in use for the
-            longest time '''
-        if self.max_cache_size == 0 or self._cacheData.dbsize() < self.max_cache_size:
+        data = self._get_many([obj_id])[0]
+        if data is not None:
+            return pickle.loads(data)
+
+        obj = fetch_function(*args, **kargs)
+        if obj != None:
+            self._set_many([(obj_id, obj)])
+        return obj
+
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' fetches all keys with a single pipelined request and calls the
+            batch_fetch_function once with the list of missing keys
+            (see Cache.fetch_many)
+        '''
+        keys = list(keys)
+        results = [None if data is None else pickle.loads(data)
+                   for data in self._get_many(
+                       [self.getObjectId(key) for key in keys])]
+        missing = [no for no, obj in enumerate(results) if obj is None]
+        self._fetch_missing(keys, results, missing, batch_fetch_function)
+        return results
+
+    def set_many(self, items):
+        ''' stores multiple objects with a single pipelined request
+            ::param items: a dictionary or a sequence of (key, object) pairs
+        '''
+        self._set_many([(self.getObjectId(key), obj)
+                        for key, obj in _iter_items(items)])
+
+    def __contains__(self, key):
+        ''' returns whether the key is already stored in the cache '''
+        return bool(self._redis.exists(self._data_key(self.getObjectId(key))))
+
+    def __getitem__(self, key):
+        ''' returns the cached object for the given key
+            ::raises KeyError: if the key is not cached
+        '''
+        data = self._get_many([self.getObjectId(key)])[0]
+        if data is None:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def __setitem__(self, key, obj):
+        ''' stores the object under the given key '''
+        self._set_many([(self.getObjectId(key), obj)])
+
+    def __delitem__(self, key):
+        ''' removes the given item from the cache '''
+        if not self._remove_objects([self.getObjectId(key)]):
+            raise KeyError(key)
+
+    @property
+    def cache_bytes(self):
+        ''' the number of bytes occupied by the pickled objects (only
+            tracked if the cache size is limited) '''
+        return int(self._redis.get(self._bytes_key) or 0)
+
+    def _get_many(self, obj_ids):
+        ''' returns the pickled objects (or None) for the given object ids
+            and updates their usage time stamps '''
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.mget([self._data_key(obj_id) for obj_id in obj_ids])
+        if self._track_usage:
+            now = time()
+            for obj_id in obj_ids:
+                pipe.execute_command('ZADD', self._lru_key, 'XX', now, obj_id)
+        return pipe.execute()[0]
+
+    def _set_many(self, items):
+        ''' pickles and stores the given (object id, object) pairs; objects
+            exceeding max_cache_bytes are not stored, but remove the objects
+            they replace '''
+        entries, oversized = [], []
+        for obj_id, obj in items:
+            data = pickle.dumps(obj)
+            if not self.max_cache_bytes or len(data) <= self.max_cache_bytes:
+                entries.append((obj_id, data))
+            else:
+                oversized.append(obj_id)
+        if not entries and not oversized:
+            return
+
+        if self._track_usage:
+            # objects which are already cached only change the byte count
+            previous = [int(size or 0) for size in self._redis.hmget(
+                self._sizes_key, [obj_id for obj_id, _ in entries] +
+                oversized)]
+            if entries:
+                self.garbage_collect_cache(
+                    sum(1 for size in previous[:len(entries)] if not size),
+                    sum(len(data) for _, data in entries) -
+                    sum(previous[:len(entries)]))
+
+        now = time()
+        pipe = self._redis.pipeline(transaction=False)
+        for obj_id, data in entries:
+            pipe.set(self._data_key(obj_id), data, ex=int(self.ttl) or None)
+            if self._track_usage:
+                pipe.execute_command('ZADD', self._lru_key, now, obj_id)
+                pipe.hset(self._sizes_key, obj_id, len(data))
+        for obj_id in oversized:
+            pipe.delete(self._data_key(obj_id))
+            pipe.zrem(self._lru_key, obj_id)
+            pipe.hdel(self._sizes_key, obj_id)
+        if self._track_usage:
+            pipe.incrby(self._bytes_key,
+                        sum(len(data) for _, data in entries) - sum(previous))
+        pipe.execute()
+
+    def _remove_objects(self, obj_ids):
+        ''' removes the given objects and returns the number of removed
+            objects '''
+        pipe = self._redis.pipeline(transaction=False)
+        for obj_id in obj_ids:
+            pipe.delete(self._data_key(obj_id))
+        if not self._track_usage:
+            return sum(pipe.execute())
+
+        pipe.hmget(self._sizes_key, obj_ids)
+        for obj_id in obj_ids:
+            pipe.zrem(self._lru_key, obj_id)
+        replies = pipe.execute()
+        deleted = sum(replies[:len(obj_ids)])
+        sizes, removed = replies[len(obj_ids)], replies[len(obj_ids) + 1:]
+
+        # only account for objects which have not been removed concurrently
+        freed = sum(int(size) for size, was_removed in zip(sizes, removed)
+                    if size and was_removed)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hdel(self._sizes_key, *obj_ids)
+        if freed:
+            pipe.incrby(self._bytes_key, -freed)
+        pipe.execute()
+        return deleted
+
+    def garbage_collect_cache(self, required_entries=1, required_bytes=0):
+        ''' removes the objects which have not been in use for the
+            longest time until the new objects fit into the cache
+            ::param required_entries: the number of objects to add
+            ::param required_bytes: the size of the objects to add
+        '''
+        if not self._track_usage:
             return
-        usage_dict = {k: self._usage[k] for k in self._usage.keys()}
-        (key, _) = sorted(usage_dict.items(),
-                          key=itemgetter(1), reverse=True).pop()
-        del self._usage[key]
-        del self._cacheData[key]
+
+        while True:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.zcard(self._lru_key)
+            pipe.get(self._bytes_key)
+            entries, cache_bytes = pipe.execute()
+            cache_bytes = int(cache_bytes or 0)
+
+            excess_entries = entries + required_entries - self.max_cache_size \
+                if self.max_cache_size else 0
+            excess_bytes = cache_bytes + required_bytes - self.max_cache_bytes \
+                if self.max_cache_bytes else 0
+            if (excess_entries <= 0 and excess_bytes <= 0) or not entries:
+                return
+
+            count = max(excess_entries, 1 if excess_bytes <= 0
+                        else self.EVICTION_BATCH_SIZE)
+            victims = [obj_id.decode('utf8') if isinstance(obj_id, bytes)
+                       else obj_id for obj_id
+                       in self._redis.zrange(self._lru_key, 0, count - 1)]
+            if excess_entries <= 0:
+                # only evict as many objects as required to free the bytes
+                sizes = self._redis.hmget(self._sizes_key, victims)
+                freed = 0
+                for no, size in enumerate(sizes):
+                    freed += int(size or 0)
+                    if freed >= excess_bytes:
+                        victims = victims[:no + 1]
+                        break
+            self._remove_objects(victims)
 
 
 class RedisCached(RedisCache):
-    ''' Decorator based on MemoryCache for caching arbitrary function calls
+    ''' Decorator based on RedisCache for caching arbitrary function calls
         usage:
-          @MemoryCached or @MemoryCached(max_cache_size)
+          @RedisCached or @RedisCached({'host': 'localhost', 'ttl': 3600})
           def myfunction(*args):            ...
     '''
 
     def __init__(self, arg):
         ''' initializes the RedisCache object
-            ::param arg: either the max_cache_size or the function to call
+            ::param arg: either a dictionary with the RedisCache's arguments
+                         or the function to call
         '''
         if hasattr(arg, '__call__'):
             RedisCache.__init__(self)
@@ -465,3 +1859,305 @@ class RedisCached(RedisCache):
             return wrapped_fn
         else:
             return self.fetch(self._fn, *args, **kargs)
+
+
+def _flush_tiered_cache(cache_ref):
+    ''' flushes the referenced TieredCache, if it still exists '''
+    cache = cache_ref()
+    if cache is not None:
+        cache.flush()
+
+
+def _flush_periodically(cache_ref, closed, interval):
+    ''' flushes the referenced TieredCache every interval seconds until it
+        is closed or collected '''
+    while not closed.wait(interval):
+        cache = cache_ref()
+        if cache is None:
+            return
+        cache.flush()
+        del cache
+
+
+class TieredCache(Cache):
+    ''' @class TieredCache
+        Combines a fast in-process first level cache (usually a MemoryCache)
+        with a shared second level cache (DiskCache or RedisCache).
+
+        Lookups query the first level, the second level and finally the
+        fetch_function. Objects found in the second level are promoted to
+        the first level. New objects are either written to both levels
+        immediately (write-through) or buffered and written to the second
+        level by flush() (write-back).
+
+        usage:
+          cache = TieredCache(MemoryCache(10000, thread_safe=True),
+                              DiskCache('./cache'))
+          cache.fetch(geocode, 'Wien')
+    '''
+
+    def __init__(self, l1, l2, write_back=False, fn=None, max_pending=1000,
+                 flush_interval=0):
+        ''' initializes the TieredCache
+            ::param l1: the first level cache
+            ::param l2: the second level cache
+            ::param write_back: buffer writes to the second level cache
+                                (False*)
+            ::param fn: function to cache (optional)
+            ::param max_pending: number of buffered objects which triggers
+                                 a flush in write-back mode
+            ::param flush_interval: optional interval in seconds for
+                                    flushing buffered objects in a background
+                                    thread (write-back mode only)
+        '''
+        Cache.__init__(self, fn)
+        self.l1 = l1
+        self.l2 = l2
+        # keys are computed like the ones of the persistent level
+        self.getKey = l2.getKey
+        self.write_back = write_back
+        self.max_pending = max_pending
+
+        self._lock = RLock()
+        self._pending = {}
+        self._requests = 0
+        self._l2_requests = 0
+        self._l2_hits = 0
+
+        self._closed = Event()
+        if write_back:
+            # weak references allow collecting caches which are not closed
+            atexit.register(_flush_tiered_cache, weakref.ref(self))
+            if flush_interval:
+                flusher = Thread(target=_flush_periodically,
+                                 args=(weakref.ref(self), self._closed,
+                                       flush_interval))
+                flusher.daemon = True
+                flusher.start()
+
+    def fetch(self, fetch_function, *args, **kargs):
+        key = self.getKey(*args, **kargs)
+        return self.fetchObjectId(key, fetch_function, *args, **kargs)
+
+    def fetchObjectId(self, key, fetch_function, *args, **kargs):
+        ''' fetches the object with the given key from the first level cache,
+            the second level cache or the fetch_function '''
+        self._count(requests=1)
+        promoted = Event()
+        try:
+            return self.l1.fetchObjectId(key, self._fetch_l2, key,
+                                         fetch_function, args, kargs,
+                                         promoted)
+        finally:
+            promoted.set()
+
+    def _fetch_l2(self, key, fetch_function, args, kargs, promoted):
+        ''' retrieves first level misses from the second level cache or the
+            fetch_function
+            ::param promoted: event which is set once the first level cache
+                              holds the returned object
+        '''
+        try:
+            obj = self._get_l2(key, partial(self._refresh, key,
+                                            fetch_function, args, kargs,
+                                            promoted))
+            self._count(l2_requests=1, l2_hits=1)
+            return obj
+        except KeyError:
+            self._count(l2_requests=1)
+
+        obj = fetch_function(*args, **kargs)
+        if obj != None:
+            self._set_l2(key, obj)
+        return obj
+
+    def fetch_many(self, keys, batch_fetch_function):
+        ''' fetches the objects for all given keys from the first level
+            cache, the second level cache and finally calls the
+            batch_fetch_function once with the remaining keys
+            (see Cache.fetch_many)
+        '''
+        keys = list(keys)
+        self._count(requests=len(keys))
+        promoted = Event()
+        try:
+            return self.l1.fetch_many(
+                keys, lambda missing: self._fetch_many_l2(
+                    missing, batch_fetch_function, promoted))
+        finally:
+            promoted.set()
+
+    def _fetch_many_l2(self, keys, batch_fetch_function, promoted):
+        ''' retrieves first level misses from the second level cache or the
+            batch_fetch_function '''
+        results, missing = [], []
+        for no, key in enumerate(keys):
+            try:
+                results.append(self._get_l2(key, partial(
+                    self._refresh_many, [key], batch_fetch_function,
+                    promoted)))
+            except KeyError:
+                results.append(None)
+                missing.append(no)
+        self._count(l2_requests=len(keys), l2_hits=len(keys) - len(missing))
+        if not missing:
+            return results
+
+        missing_keys = [keys[no] for no in missing]
+        computed = align_results(missing_keys,
+                                 batch_fetch_function(missing_keys))
+        for no, obj in zip(missing, computed):
+            results[no] = obj
+        self._set_many_l2([(key, obj) for key, obj
+                           in zip(missing_keys, computed) if obj != None])
+        return results
+
+    def _get_l2(self, key, refresh=None):
+        ''' returns the object from the write-back buffer or the second
+            level cache, which refreshes stale objects by calling refresh
+        '''
+        if self.write_back:
+            with self._lock:
+                pending = self._pending.get(self.l2.getObjectId(key))
+            if pending is not None:
+                return pending[1]
+        return self.l2.lookup(key, refresh)
+
+    def _refresh(self, key, fetch_function, args, kargs, promoted):
+        ''' recomputes a stale object and updates both cache levels, once
+            the stale object has been promoted to the first level '''
+        obj = fetch_function(*args, **kargs)
+        promoted.wait()
+        if obj != None:
+            self[key] = obj
+
+    def _refresh_many(self, keys, batch_fetch_function, promoted):
+        ''' recomputes stale objects and updates both cache levels '''
+        items = [(key, obj) for key, obj in zip(
+            keys, align_results(keys, batch_fetch_function(keys)))
+            if obj != None]
+        promoted.wait()
+        self.l1.set_many(items)
+        self._set_many_l2(items)
+
+    def _set_l2(self, key, obj):
+        self._set_many_l2([(key, obj)])
+
+    def _set_many_l2(self, items):
+        if not self.write_back:
+            self.l2.set_many(items)
+            return
+
+        with self._lock:
+            for key, obj in items:
+                self._pending[self.l2.getObjectId(key)] = (key, obj)
+            flush = len(self._pending) >= self.max_pending
+        if flush:
+            self.flush()
+
+    def flush(self):
+        ''' writes all buffered objects to the second level cache '''
+        with self._lock:
+            pending = list(self._pending.items())
+
+        self.l2.set_many([entry for _, entry in pending])
+
+        with self._lock:
+            for obj_id, entry in pending:
+                # keep objects which have been replaced during the flush
+                if self._pending.get(obj_id) is entry:
+                    del self._pending[obj_id]
+
+    def close(self):
+        ''' flushes all buffered objects and stops the background flusher '''
+        self._closed.set()
+        if self.write_back:
+            self.flush()
+
+    def _count(self, requests=0, l2_requests=0, l2_hits=0):
+        ''' updates the request statistics '''
+        with self._lock:
+            self._requests += requests
+            self._l2_requests += l2_requests
+            self._l2_hits += l2_hits
+
+    def __contains__(self, key):
+        ''' returns whether the key is stored in any of the cache levels '''
+        if key in self.l1:
+            return True
+        try:
+            self._get_l2(key)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, key):
+        ''' returns the cached object and promotes it to the first level
+            ::raises KeyError: if the key is not cached
+        '''
+        try:
+            return self.l1[key]
+        except KeyError:
+            obj = self._get_l2(key)
+            self.l1[key] = obj
+            return obj
+
+    def __setitem__(self, key, obj):
+        ''' stores the object in both cache levels '''
+        self.l1[key] = obj
+        self._set_l2(key, obj)
+
+    def __delitem__(self, key):
+        ''' removes the given item from all cache levels '''
+        with self._lock:
+            found = self._pending.pop(self.l2.getObjectId(key), None) \
+                is not None
+        for cache in (self.l1, self.l2):
+            try:
+                del cache[key]
+                found = True
+            except KeyError:
+                pass
+        if not found:
+            raise KeyError(key)
+
+    def getCacheStatistics(self):
+        ''' returns the number of requests, the hits per cache level and the
+            corresponding hit ratios '''
+        with self._lock:
+            requests, l2_requests, l2_hits = \
+                self._requests, self._l2_requests, self._l2_hits
+        l1_hits = requests - l2_requests
+        return {'cache_requests': requests,
+                'l1_hits': l1_hits,
+                'l2_hits': l2_hits,
+                'cache_misses': l2_requests - l2_hits,
+                'l1_hit_ratio': float(l1_hits) / requests
+                if requests else 0.,
+                'l2_hit_ratio': float(l2_hits) / l2_requests
+                if l2_requests else 0.}
+
+
+class TieredCached(object):
+    ''' Decorator based on TieredCache for caching arbitrary function calls
+        usage:
+          @TieredCached(MemoryCache(1000), DiskCache("./cache/myfunction"))
+          def myfunction(*args):
+    '''
+    __slots__ = ('cache', )
+
+    def __init__(self, l1, l2, write_back=False, max_pending=1000,
+                 flush_interval=0):
+        ''' initializes the TieredCache object
+            ::param l1: the first level cache
+            ::param l2: the second level cache
+            ::param write_back: buffer writes to the second level cache
+            ::param max_pending: number of buffered objects triggering a flush
+            ::param flush_interval: optional background flush interval
+        '''
+        self.cache = TieredCache(l1, l2, write_back, max_pending=max_pending,
+                                 flush_interval=flush_interval)
+
+    def __call__(self, fn):
+        self.cache.fn = fn
+        return self.cache
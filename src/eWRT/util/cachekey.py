@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.cachekey
+    canonical and version-stable cache keys
+
+    encode_key() serializes keys into a canonical byte string, i.e. equal
+    keys always yield the same encoding regardless of dictionary or set
+    ordering, the float representation or the Python version. The digests
+    in KEY_DIGESTS compute the object identifiers used by persistent
+    caches; in-memory caches use get_memory_key() which avoids hashing
+    altogether.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import hashlib
+
+from six import PY2, binary_type, integer_types, text_type
+
+# types which are used as in-memory keys without any conversion
+FAST_KEY_TYPES = (text_type, int)
+
+
+def _length_prefixed(tag, payload):
+    return tag + str(len(payload)).encode('ascii') + b':' + payload
+
+
+def _encode_sequence(tag, items):
+    return tag + str(len(items)).encode('ascii') + b':' + b''.join(items)
+
+
+def encode_key(obj):
+    ''' returns the canonical binary encoding of the given key
+
+        Supported are None, booleans, numbers, strings, bytes, tuples,
+        lists, dictionaries and sets (and their subclasses). Other objects
+        are encoded based on their type name and repr().
+    '''
+    obj_type = type(obj)
+    if obj_type is text_type:
+        return _length_prefixed(b's', obj.encode('utf8'))
+    elif obj_type is int:
+        return b'i' + str(obj).encode('ascii') + b';'
+    elif obj_type is tuple:
+        return _encode_sequence(b't', [encode_key(item) for item in obj])
+    elif obj is None:
+        return b'N'
+    elif isinstance(obj, bool):
+        return b'T' if obj else b'F'
+    elif isinstance(obj, integer_types):
+        return b'i' + str(obj).encode('ascii') + b';'
+    elif isinstance(obj, float):
+        return b'f' + obj.hex().encode('ascii') + b';'
+    elif isinstance(obj, text_type):
+        return _length_prefixed(b's', obj.encode('utf8'))
+    elif isinstance(obj, binary_type):
+        if PY2:
+            # python2 strings are encoded like python3 strings, if possible
+            try:
+                return _length_prefixed(b's', obj.decode('ascii')
+                                        .encode('utf8'))
+            except UnicodeDecodeError:
+                pass
+        return _length_prefixed(b'b', obj)
+    elif isinstance(obj, tuple):
+        return _encode_sequence(b't', [encode_key(item) for item in obj])
+    elif isinstance(obj, list):
+        return _encode_sequence(b'l', [encode_key(item) for item in obj])
+    elif isinstance(obj, dict):
+        return _encode_sequence(b'd', sorted(
+            encode_key(key) + encode_key(value)
+            for key, value in obj.items()))
+    elif isinstance(obj, (set, frozenset)):
+        return _encode_sequence(b'S', sorted(encode_key(item)
+                                             for item in obj))
+
+    return _length_prefixed(b'r', ('%s.%s:%r' % (
+        obj_type.__module__, obj_type.__name__, obj)).encode('utf8'))
+
+
+def is_fast_key(obj):
+    ''' returns whether the key only consists of strings, integers and
+        tuples thereof, i.e. types which are hashable and do not collide
+        with objects of other types '''
+    if type(obj) in FAST_KEY_TYPES:
+        return True
+    elif type(obj) is tuple:
+        return all(is_fast_key(item) for item in obj)
+    return False
+
+
+def get_memory_key(key):
+    ''' returns the identifier used by in-memory caches, i.e. the key itself
+        for simple keys and its canonical encoding otherwise '''
+    if is_fast_key(key):
+        return key
+    # encodings are tagged, since python 2 considers byte strings equal to
+    # the corresponding unicode text keys
+    return (binary_type, encode_key(key))
+
+
+def legacy_digest(key):
+    ''' the (non canonical) object identifier used by previous versions '''
+    return hashlib.sha1(repr(key).encode("utf8")).hexdigest()
+
+
+def sha1_digest(key):
+    return hashlib.sha1(encode_key(key)).hexdigest()
+
+
+def md5_digest(key):
+    return hashlib.md5(encode_key(key)).hexdigest()
+
+
+def blake2b_digest(key):
+    return hashlib.blake2b(encode_key(key), digest_size=16).hexdigest()
+
+
+KEY_DIGESTS = {'legacy': legacy_digest,
+               'sha1': sha1_digest,
+               'md5': md5_digest,
+               # available on every interpreter, i.e. the object identifiers
+               # do not depend on the Python version
+               'fast': md5_digest}
+
+if hasattr(hashlib, 'blake2b'):
+    KEY_DIGESTS['blake2b'] = blake2b_digest
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.cachesnapshot
+    snapshots and warm-up of caches
+
+    save_snapshot() writes the hot set of a MemoryCache or DiskCache to a
+    compact file (see eWRT.util.pickleIterator), which load_snapshot()
+    restores into a cache of the same type, e.g. when starting a new
+    worker. warm_up() pre-populates a cache by replaying a list of function
+    arguments through the cached function in parallel.
+
+    usage:
+      save_snapshot(gazetteer_cache, '/var/cache/gazetteer.snapshot')
+      ...
+      cache = MemoryCache(100000)
+      load_snapshot(cache, '/var/cache/gazetteer.snapshot')
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import logging
+
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+from eWRT.util.cache import DiskCache, MemoryCache
+from eWRT.util.pickleIterator import ReadPickleIterator, WritePickleIterator
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 'eWRT cache snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def _get_cache_type(cache):
+    ''' returns the snapshot type and key digest of the given cache '''
+    if isinstance(cache, MemoryCache):
+        return 'memory', None
+    elif isinstance(cache, DiskCache):
+        return 'disk', cache.key_digest
+    raise ValueError("Snapshots are only supported for MemoryCache and "
+                     "DiskCache objects, not %s." % type(cache).__name__)
+
+
+def save_snapshot(cache, fname, max_entries=0):
+    ''' writes the cache's hot set to the given file
+        ::param cache: a MemoryCache or DiskCache
+        ::param fname: the snapshot file
+        ::param max_entries: optional maximum number of entries to save
+        ::returns: the number of saved entries
+    '''
+    cache_type, key_digest = _get_cache_type(cache)
+    entries = cache.get_hot_entries(max_entries)
+    with WritePickleIterator(fname) as w:
+        w.dump({'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+                'cache': cache_type, 'key_digest': key_digest})
+        w.dump_many(entries)
+    log.info("Saved %d entries to the snapshot %s.", len(entries), fname)
+    return len(entries)
+
+
+def load_snapshot(cache, fname, max_entries=0):
+    ''' restores the entries of the given snapshot
+        ::param cache: a cache of the snapshot's cache type (entries of
+                       DiskCaches also require the same key digest)
+        ::param fname: the snapshot file
+        ::param max_entries: optional maximum number of entries to restore
+                             (the hottest entries are restored first)
+        ::returns: the number of restored entries
+        ::raises ValueError: for incompatible snapshots
+    '''
+    reader = ReadPickleIterator(fname)
+    try:
+        header = next(reader, None)
+        if not isinstance(header, dict) or \
+                header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError("%s is not a cache snapshot." % fname)
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version %s."
+                             % header['version'])
+        if (header['cache'], header['key_digest']) != _get_cache_type(cache):
+            raise ValueError("The snapshot %s has been created by an "
+                             "incompatible cache." % fname)
+
+        restored = cache.restore_entries(
+            islice(reader, max_entries or None))
+    finally:
+        reader.close()
+    log.info("Restored %d entries from the snapshot %s.", restored, fname)
+    return restored
+
+
+class _Replay(object):
+    ''' calls the fetch_function with the arguments encoded in a cache
+        key (picklable, unlike a closure) '''
+
+    def __init__(self, fetch_function):
+        self.fetch_function = fetch_function
+
+    def __call__(self, key):
+        args, kargs = key
+        return self.fetch_function(*args, **dict(kargs))
+
+
+def warm_up(cache, fetch_function, arg_list, workers=8, batch_size=1000,
+            pool=None):
+    ''' pre-populates the cache by calling the fetch_function for all
+        arguments which are not cached yet
+
+        ::param cache: the cache to populate
+        ::param fetch_function: the cached function
+        ::param arg_list: the function arguments; either argument tuples or
+                          single arguments
+        ::param workers: number of threads computing missing objects
+        ::param batch_size: number of arguments processed per batch
+        ::param pool: optional pool (e.g. a multiprocessing.Pool for CPU
+                      bound functions, which need to be picklable) used
+                      instead of the thread pool
+        ::returns: the number of computed objects
+    '''
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(workers)
+
+    computed = [0]
+
+    def fetch_missing(keys):
+        computed[0] += len(keys)
+        return pool.map(_Replay(fetch_function), keys)
+
+    try:
+        args = iter(arg_list)
+        while True:
+            batch = [arg if isinstance(arg, tuple) else (arg, )
+                     for arg in islice(args, batch_size)]
+            if not batch:
+                break
+            cache.fetch_many([cache.getKey(*arg) for arg in batch],
+                             fetch_missing)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    log.info("Warm-up computed %d objects.", computed[0])
+    return computed[0]
+
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.codec
+    serializers and compressors used for persisting cache entries
+
+    Encoded entries start with a small header which records the serializer
+    and the compressor used, so that caches containing entries written with
+    different codecs remain readable. Entries with a time to live use the
+    second header version, which also records the entry's expiry time so
+    that it can be checked without decoding the payload (get_expiry).
+    Entries written by older eWRT
+    versions (gzip compressed pickles without header) are detected by the
+    gzip magic number.
+
+    Fast third-party compressors (lz4, zstandard) are registered if they
+    are installed.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import bz2
+import json
+import zlib
+
+from gzip import GzipFile
+from io import BytesIO
+from struct import Struct
+
+try:
+    from cPickle import dumps as pickle_dumps, loads as pickle_loads, \
+        HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dumps as pickle_dumps, loads as pickle_loads, \
+        HIGHEST_PROTOCOL
+
+# magic, header version, serializer id, compressor id
+HEADER = Struct('>4sBBB')
+# version 2 adds the expiry time stamp (0 ... the entry never expires)
+HEADER_V2 = Struct('>4sBBBd')
+# the number of leading bytes get_expiry requires
+MAX_HEADER_SIZE = max(HEADER.size, HEADER_V2.size)
+MAGIC = b'eWRT'
+HEADER_VERSION = 1
+HEADER_VERSION_EXPIRY = 2
+GZIP_MAGIC = b'\x1f\x8b'
+
+SERIALIZERS = {}
+COMPRESSORS = {}
+
+
+class _Entry(object):
+    ''' a registered serializer or compressor '''
+    __slots__ = ('name', 'entry_id', 'encode', 'decode')
+
+    def __init__(self, name, entry_id, encode, decode):
+        self.name = name
+        self.entry_id = entry_id
+        self.encode = encode
+        self.decode = decode
+
+
+def register_serializer(name, serializer_id, dumps, loads):
+    ''' registers a serializer
+        ::param name: the serializer's name
+        ::param serializer_id: the id recorded in the entry header (0-255)
+        ::param dumps: function(obj, protocol) returning bytes
+        ::param loads: function(bytes) returning the object
+    '''
+    entry = _Entry(name, serializer_id, dumps, loads)
+    SERIALIZERS[name] = SERIALIZERS[serializer_id] = entry
+
+
+def register_compressor(name, compressor_id, compress, decompress):
+    ''' registers a compressor
+        ::param name: the compressor's name
+        ::param compressor_id: the id recorded in the entry header (0-255)
+        ::param compress: function(data, level) returning bytes; level is
+                          None for the compressor's default level
+        ::param decompress: function(data) returning bytes
+    '''
+    entry = _Entry(name, compressor_id, compress, decompress)
+    COMPRESSORS[name] = COMPRESSORS[compressor_id] = entry
+
+
+def _lookup(registry, key, kind):
+    try:
+        return registry[key]
+    except KeyError:
+        raise ValueError("Unknown or unavailable %s '%s'." % (kind, key))
+
+
+# ----------------------------------------------------------------------
+# serializers
+# ----------------------------------------------------------------------
+
+def _raw_dumps(obj, protocol):
+    if not isinstance(obj, bytes):
+        raise TypeError("The raw serializer requires bytes, not %s."
+                        % type(obj).__name__)
+    return obj
+
+
+register_serializer('pickle', 1,
+                    lambda obj, protocol: pickle_dumps(obj, protocol),
+                    pickle_loads)
+register_serializer('raw', 2, _raw_dumps, lambda data: data)
+register_serializer('json', 3,
+                    lambda obj, protocol: json.dumps(
+                        obj, separators=(',', ':')).encode('utf8'),
+                    lambda data: json.loads(data.decode('utf8')))
+
+
+# ----------------------------------------------------------------------
+# compressors
+# ----------------------------------------------------------------------
+
+def _gzip_compress(data, level):
+    buf = BytesIO()
+    with GzipFile(fileobj=buf, mode='wb',
+                  compresslevel=9 if level is None else level) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _gzip_decompress(data):
+    with GzipFile(fileobj=BytesIO(data)) as f:
+        return f.read()
+
+
+register_compressor('none', 0, lambda data, level: data, lambda data: data)
+register_compressor('gzip', 1, _gzip_compress, _gzip_decompress)
+register_compressor('zlib', 2,
+                    lambda data, level: zlib.compress(
+                        data, -1 if level is None else level),
+                    zlib.decompress)
+register_compressor('bz2', 3,
+                    lambda data, level: bz2.compress(
+                        data, 9 if level is None else level),
+                    bz2.decompress)
+
+try:
+    import lzma
+    register_compressor('lzma', 4,
+                        lambda data, level: lzma.compress(data, preset=level),
+                        lzma.decompress)
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+    register_compressor('lz4', 5,
+                        lambda data, level: lz4.frame.compress(
+                            data, compression_level=level or 0),
+                        lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    register_compressor('zstd', 6,
+                        lambda data, level: zstandard.ZstdCompressor(
+                            level=3 if level is None else level).compress(data),
+                        lambda data: zstandard.ZstdDecompressor().decompress(
+                            data, max_output_size=2 ** 31))
+except ImportError:
+    pass
+
+
+# ----------------------------------------------------------------------
+# codecs
+# ----------------------------------------------------------------------
+
+class Codec(object):
+    ''' @class Codec
+        encodes objects using the given serializer and compressor
+
+        usage:
+          codec = Codec('json', 'zlib', level=1)
+          data = codec.encode({'a': 1})
+          assert decode(data) == {'a': 1}
+    '''
+
+    def __init__(self, serializer='pickle', compressor='gzip', level=None,
+                 protocol=HIGHEST_PROTOCOL):
+        ''' ::param serializer: 'pickle'*, 'raw' (bytes) or 'json'
+            ::param compressor: 'gzip'*, 'none', 'zlib', 'bz2', 'lzma',
+                                'lz4' or 'zstd'
+            ::param level: optional compression level
+            ::param protocol: the pickle protocol to use
+        '''
+        # verify that the codec is available
+        _lookup(SERIALIZERS, serializer, 'serializer')
+        _lookup(COMPRESSORS, compressor, 'compressor')
+
+        self.serializer = serializer
+        self.compressor = compressor
+        self.level = level
+        self.protocol = protocol
+
+    def encode(self, obj, expires=None):
+        ''' returns the encoded object (including the header)
+            ::param expires: optional expiry time stamp of the entry
+                             (0 ... the entry never expires)
+        '''
+        serializer = SERIALIZERS[self.serializer]
+        compressor = COMPRESSORS[self.compressor]
+        if expires is None:
+            header = HEADER.pack(MAGIC, HEADER_VERSION, serializer.entry_id,
+                                 compressor.entry_id)
+        else:
+            header = HEADER_V2.pack(MAGIC, HEADER_VERSION_EXPIRY,
+                                    serializer.entry_id, compressor.entry_id,
+                                    expires)
+        return header + compressor.encode(
+            serializer.encode(obj, self.protocol), self.level)
+
+    @staticmethod
+    def decode(data):
+        ''' decodes entries written with any codec '''
+        return decode(data)
+
+
+class LegacyCodec(object):
+    ''' @class LegacyCodec
+        gzip compressed pickles without header, as written by previous
+        versions of the DiskCache
+    '''
+
+    def encode(self, obj, expires=None):
+        ''' returns the encoded object; entries with an expiry time stamp
+            require a header and are therefore written as gzip compressed
+            pickles with a version 2 header '''
+        if expires is None:
+            return _gzip_compress(pickle_dumps(obj, 2), None)
+        return Codec('pickle', 'gzip', protocol=2).encode(obj, expires)
+
+    @staticmethod
+    def decode(data):
+        ''' decodes entries written with any codec '''
+        return decode(data)
+
+
+def decode(data):
+    ''' decodes the given entry, regardless of the codec it has been written
+        with
+        ::raises ValueError: for unknown formats or unavailable codecs
+    '''
+    if data[:2] == GZIP_MAGIC:
+        return pickle_loads(_gzip_decompress(data))
+
+    header = _get_header(data)
+    serializer = _lookup(SERIALIZERS, header[2], 'serializer')
+    compressor = _lookup(COMPRESSORS, header[3], 'compressor')
+    return serializer.decode(compressor.decode(data[_HEADERS[header[1]]
+                                                    .size:]))
+
+
+def get_expiry(data):
+    ''' returns the expiry time stamp of the given entry without decoding
+        its payload
+        ::returns: the time stamp, 0 for entries which never expire or None
+                   for entries which have been written without expiry
+                   information
+        ::raises ValueError: for unknown formats
+    '''
+    if data[:2] == GZIP_MAGIC:
+        return None
+    header = _get_header(data)
+    return header[4] if header[1] == HEADER_VERSION_EXPIRY else None
+
+
+_HEADERS = {HEADER_VERSION: HEADER, HEADER_VERSION_EXPIRY: HEADER_V2}
+
+
+def _get_header(data):
+    ''' returns the unpacked header of the given entry '''
+    if data[:4] != MAGIC:
+        raise ValueError("Unknown cache entry format.")
+    version = bytearray(data[4:5])[0]
+    if version not in _HEADERS:
+        raise ValueError("Unsupported cache entry version %d." % version)
+    return _HEADERS[version].unpack_from(data)
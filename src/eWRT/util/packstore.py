@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.packstore
+    append-only segment store for large numbers of (small) cache entries
+
+    Entries are appended to large segment files rather than being stored
+    in one file per object. An in-memory index maps keys to the entries'
+    offsets and is rebuilt by scanning the record headers of all segments.
+    Deleted and overwritten entries are reclaimed by compacting segments
+    in the background.
+
+    Multiple processes may share a store: writes are serialized by a file
+    lock and readers catch up with other processes' writes whenever a key
+    is not found in their index.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import os
+import logging
+import time
+
+from os.path import join, exists, getsize
+from struct import Struct
+from threading import RLock, Thread
+from zlib import crc32
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# record header: crc32, flags, key length, value length
+RECORD_HEADER = Struct('>IBHI')
+FLAG_PUT = 0
+FLAG_DELETE = 1
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.pack'
+LOCK_FILE = 'LOCK'
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_COMPACTION_THRESHOLD = 0.5
+# modification times of directories changed more recently are not trusted,
+# since file systems with coarse timestamps might not reflect later changes
+MTIME_RESOLUTION = 2.
+
+
+def encode_record(key, value, flags=FLAG_PUT):
+    ''' returns the binary representation of the given record
+        ::param key: the record's key (bytes)
+        ::param value: the record's value (bytes)
+        ::param flags: FLAG_PUT or FLAG_DELETE
+    '''
+    header = RECORD_HEADER.pack(0, flags, len(key), len(value))[4:]
+    crc = crc32(header + key + value) & 0xffffffff
+    return RECORD_HEADER.pack(crc, flags, len(key), len(value)) + key + value
+
+
+def decode_record(data):
+    ''' returns the flags, key and value of a binary record
+        ::raises ValueError: if the record is corrupt
+    '''
+    crc, flags, key_len, value_len = RECORD_HEADER.unpack_from(data)
+    if len(data) != RECORD_HEADER.size + key_len + value_len or \
+            crc32(data[4:]) & 0xffffffff != crc:
+        raise ValueError("Corrupt pack store record.")
+    key_end = RECORD_HEADER.size + key_len
+    return flags, data[RECORD_HEADER.size:key_end], data[key_end:]
+
+
+class _Segment(object):
+    ''' bookkeeping information on a single segment file '''
+    __slots__ = ('number', 'fname', 'size', 'live_bytes', 'reader')
+
+    def __init__(self, number, fname):
+        self.number = number
+        self.fname = fname
+        self.size = 0           # number of bytes scanned so far
+        self.live_bytes = 0     # bytes occupied by live records
+        self.reader = None
+
+    def dead_ratio(self):
+        ''' returns the fraction of the segment occupied by garbage '''
+        return 1. - float(self.live_bytes) / self.size if self.size else 0.
+
+    def read(self, offset, length):
+        ''' reads length bytes starting at the given offset '''
+        if self.reader is None:
+            self.reader = open(self.fname, 'rb')
+        self.reader.seek(offset)
+        return self.reader.read(length)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+class _StoreLock(object):
+    ''' a reentrant lock which also serializes access between processes
+        (if supported by the operating system) '''
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._thread_lock = RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl:
+            # the file is opened on every acquisition, since forked
+            # processes would otherwise share the lock
+            self._fd = os.open(self._fname, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+        return False
+
+
+class PackStore(object):
+    ''' @class PackStore
+        stores binary values in append-only segment files
+
+        @remarks
+        This class is thread safe and may be shared between processes.
+    '''
+
+    def __init__(self, store_dir, segment_size=DEFAULT_SEGMENT_SIZE,
+                 compaction_threshold=DEFAULT_COMPACTION_THRESHOLD,
+                 auto_compact=True):
+        ''' ::param store_dir: the directory holding the segment files
+            ::param segment_size: size in bytes after which a new segment
+                                  is started
+            ::param compaction_threshold: fraction of garbage which triggers
+                                          the compaction of a segment
+            ::param auto_compact: automatically compact segments in a
+                                  background thread
+        '''
+        self.store_dir = store_dir
+        self.segment_size = segment_size
+        self.compaction_threshold = compaction_threshold
+        self.auto_compact = auto_compact
+
+        if not exists(store_dir):
+            try:
+                os.makedirs(store_dir)
+            except OSError:     # created by a concurrent process
+                pass
+
+        self._lock = RLock()
+        self._write_lock = _StoreLock(join(store_dir, LOCK_FILE))
+        self._index = {}
+        self._segments = {}
+        self._writer = None
+        self._compaction = None
+        self._dir_mtime = None
+        self._refresh()
+
+    def __getstate__(self):
+        return {'store_dir': self.store_dir,
+                'segment_size': self.segment_size,
+                'compaction_threshold': self.compaction_threshold,
+                'auto_compact': self.auto_compact}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        if key in self._index:
+            return True
+        with self._lock:
+            self._refresh()
+            return key in self._index
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def newest_keys(self, max_keys=0):
+        ''' returns the keys starting with the most recently written one
+            ::param max_keys: optional maximum number of keys
+        '''
+        with self._lock:
+            self._refresh()
+            keys = sorted(self._index, key=self._index.get, reverse=True)
+        return keys[:max_keys] if max_keys else keys
+
+    def get(self, key):
+        ''' returns the value stored for the given key
+            ::raises KeyError: if the key is not present
+        '''
+        with self._lock:
+            if key not in self._index:
+                self._refresh()
+
+            for _ in range(2):
+                try:
+                    segment_no, offset, length = self._index[key]
+                except KeyError:
+                    raise KeyError(key)
+
+                try:
+                    _, record_key, value = decode_record(
+                        self._segments[segment_no].read(offset, length))
+                    if record_key.decode('utf8') == key:
+                        return value
+                except (IOError, OSError, ValueError):
+                    pass
+
+                # the segment has been compacted by another process
+                log.debug("Reloading the index of pack store %s.",
+                          self.store_dir)
+                self._refresh(reload=True)
+
+        raise KeyError(key)
+
+    def put(self, key, value):
+        ''' stores the value for the given key '''
+        self._append(key, value, FLAG_PUT)
+
+    def put_many(self, items):
+        ''' stores multiple (key, value) pairs acquiring the store's locks
+            only once '''
+        records = [(key, encode_record(key.encode('utf8'), value, FLAG_PUT))
+                   for key, value in items]
+        if not records:
+            return
+        with self._write_lock:
+            with self._lock:
+                self._refresh()
+                for key, record in records:
+                    self._write_record(key, FLAG_PUT, record)
+                self._trigger_compaction()
+
+    def delete(self, key):
+        ''' removes the given key from the store
+            ::raises KeyError: if the key is not present
+        '''
+        if key not in self:
+            raise KeyError(key)
+        self._append(key, b'', FLAG_DELETE)
+
+    def get_statistics(self):
+        ''' returns the size and the fraction of garbage of every segment '''
+        with self._lock:
+            return dict((s.number, {'bytes': s.size,
+                                    'live_bytes': s.live_bytes,
+                                    'dead_ratio': s.dead_ratio()})
+                        for s in self._segments.values())
+
+    def close(self):
+        ''' closes all open file handles '''
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for segment in self._segments.values():
+                segment.close()
+
+    def evict_oldest_segment(self):
+        ''' removes the oldest sealed segment including all live records it
+            contains (used for enforcing size limits)
+            ::returns: the number of removed records
+        '''
+        with self._write_lock:
+            with self._lock:
+                self._refresh()
+                sealed = self._sealed_segments()
+                if not sealed:
+                    return 0
+                segment = sealed[0]
+                keys = [key for key, entry in self._index.items()
+                        if entry[0] == segment.number]
+                for key in keys:
+                    del self._index[key]
+                del self._segments[segment.number]
+                segment.close()
+                os.remove(segment.fname)
+                return len(keys)
+
+    def compact(self, background=False, force=False):
+        ''' compacts all sealed segments whose fraction of garbage exceeds
+            the compaction_threshold
+            ::param background: perform the compaction in a separate thread
+            ::param force: compact all sealed segments
+        '''
+        if background:
+            with self._lock:
+                if self._compaction is None or \
+                        not self._compaction.is_alive():
+                    self._compaction = Thread(target=self.compact,
+                                              kwargs={'force': force})
+                    self._compaction.daemon = True
+                    self._compaction.start()
+            return
+
+        with self._lock:
+            candidates = [s.number for s in self._sealed_segments()
+                          if force or
+                          s.dead_ratio() >= self.compaction_threshold]
+
+        for segment_no in candidates:
+            with self._write_lock:
+                with self._lock:
+                    self._refresh()
+                    if segment_no in self._segments:
+                        self._compact_segment(self._segments[segment_no])
+
+    # ------------------------------------------------------------------
+    # internal methods
+    # ------------------------------------------------------------------
+
+    def _segment_fname(self, segment_no):
+        return join(self.store_dir, '%s%08d%s' % (SEGMENT_PREFIX, segment_no,
+                                                  SEGMENT_SUFFIX))
+
+    def _list_segments(self):
+        ''' returns the numbers of all segment files on disk '''
+        return sorted(int(fname[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                      for fname in os.listdir(self.store_dir)
+                      if fname.startswith(SEGMENT_PREFIX) and
+                      fname.endswith(SEGMENT_SUFFIX))
+
+    def _sealed_segments(self):
+        ''' returns all segments except for the active one '''
+        numbers = sorted(self._segments)
+        return [self._segments[no] for no in numbers[:-1]]
+
+    def _refresh(self, reload=False):
+        ''' synchronizes the index with the segment files on disk; the
+            segments are only listed if the store directory has changed,
+            otherwise only records appended to the active segment are read
+            ::param reload: rebuild the index from scratch
+        '''
+        if reload:
+            self.close()
+            self._index = {}
+            self._segments = {}
+            self._dir_mtime = None
+
+        try:
+            mtime = os.stat(self.store_dir).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime == self._dir_mtime:
+            # no segment has been created or removed
+            if self._segments:
+                self._scan(self._segments[max(self._segments)])
+            return
+
+        self._sync_segments()
+        self._dir_mtime = mtime if mtime is not None and \
+            time.time() - mtime > MTIME_RESOLUTION else None
+
+    def _sync_segments(self):
+        ''' lists the segment files and updates the index accordingly '''
+        on_disk = self._list_segments()
+        removed = set(self._segments).difference(on_disk)
+        if removed:
+            # segments compacted by other processes
+            for segment_no in removed:
+                self._segments.pop(segment_no).close()
+            self._index = dict((key, entry) for key, entry
+                               in self._index.items()
+                               if entry[0] not in removed)
+
+        for segment_no in on_disk:
+            if segment_no not in self._segments:
+                self._segments[segment_no] = _Segment(
+                    segment_no, self._segment_fname(segment_no))
+            self._scan(self._segments[segment_no])
+
+    def _scan(self, segment):
+        ''' adds all records which have been appended to the segment since
+            the last scan to the index '''
+        try:
+            file_size = getsize(segment.fname)
+        except OSError:
+            return
+        if file_size <= segment.size:
+            return
+
+        offset = segment.size
+        for flags, key, offset, length in self._iter_records(
+                segment.fname, segment.size, file_size):
+            self._index_record(segment, key, flags, offset, length)
+            offset += length
+        segment.size = offset
+
+    @staticmethod
+    def _iter_records(fname, start, end):
+        ''' yields the flags, key, offset and length of all complete records
+            between the start and end offset of the given segment file,
+            reading only the record headers and keys '''
+        with open(fname, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while offset + RECORD_HEADER.size <= end:
+                header = f.read(RECORD_HEADER.size)
+                _, flags, key_len, value_len = RECORD_HEADER.unpack(header)
+                length = RECORD_HEADER.size + key_len + value_len
+                if offset + length > end:
+                    break       # incomplete record
+                key = f.read(key_len).decode('utf8')
+                f.seek(value_len, 1)
+                yield flags, key, offset, length
+                offset += length
+
+    def _find_keys(self, keys, max_segment_no):
+        ''' returns the subset of keys for which records exist in segments
+            older than max_segment_no '''
+        keys = set(keys)
+        found = set()
+        for segment_no in sorted(self._segments):
+            if segment_no >= max_segment_no or not keys:
+                break
+            segment = self._segments[segment_no]
+            for _, key, _, _ in self._iter_records(segment.fname, 0,
+                                                   segment.size):
+                if key in keys:
+                    keys.discard(key)
+                    found.add(key)
+        return found
+
+    def _index_record(self, segment, key, flags, offset, length):
+        ''' updates the index with the given record '''
+        previous = self._index.pop(key, None)
+        if previous is not None and previous[0] in self._segments:
+            self._segments[previous[0]].live_bytes -= previous[2]
+
+        if flags == FLAG_PUT:
+            self._index[key] = (segment.number, offset, length)
+            segment.live_bytes += length
+
+    def _active_segment(self):
+        ''' returns the segment new records are appended to and repairs
+            incomplete records left by crashed writers '''
+        if self._segments:
+            segment = self._segments[max(self._segments)]
+            if getsize(segment.fname) > segment.size:
+                log.warning("Truncating incomplete record in %s.",
+                            segment.fname)
+                self._close_writer()
+                with open(segment.fname, 'r+b') as f:
+                    f.truncate(segment.size)
+            if segment.size < self.segment_size:
+                return segment
+            number = segment.number + 1
+        else:
+            number = 0
+
+        self._close_writer()
+        segment = _Segment(number, self._segment_fname(number))
+        open(segment.fname, 'ab').close()
+        self._segments[number] = segment
+        return segment
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _append(self, key, value, flags):
+        ''' appends a record to the active segment '''
+        record = encode_record(key.encode('utf8'), value, flags)
+        with self._write_lock:
+            with self._lock:
+                self._refresh()
+                self._write_record(key, flags, record)
+                self._trigger_compaction()
+
+    def _write_record(self, key, flags, record):
+        ''' writes the binary record to the active segment; requires the
+            write lock '''
+        segment = self._active_segment()
+        if self._writer is None or self._writer.name != segment.fname:
+            self._close_writer()
+            self._writer = open(segment.fname, 'ab')
+        self._writer.write(record)
+        self._writer.flush()
+
+        self._index_record(segment, key, flags, segment.size, len(record))
+        segment.size += len(record)
+
+    def _trigger_compaction(self):
+        ''' starts a background compaction if required '''
+        if not self.auto_compact or (self._compaction is not None and
+                                     self._compaction.is_alive()):
+            return
+        if any(s.dead_ratio() >= self.compaction_threshold
+               for s in self._sealed_segments()):
+            self.compact(background=True)
+
+    def _compact_segment(self, segment):
+        ''' copies the segment's live records to the active segment and
+            removes it; requires the write lock '''
+        with open(segment.fname, 'rb') as f:
+            data = f.read(segment.size)
+
+        records = []
+        offset = 0
+        while offset < len(data):
+            _, flags, key_len, value_len = RECORD_HEADER.unpack_from(data,
+                                                                     offset)
+            length = RECORD_HEADER.size + key_len + value_len
+            key = data[offset + RECORD_HEADER.size:
+                       offset + RECORD_HEADER.size + key_len].decode('utf8')
+            records.append((flags, key, offset, length))
+            offset += length
+
+        # tombstones are only kept as long as older segments still contain
+        # records of the deleted key
+        deleted = self._find_keys(
+            [key for flags, key, _, _ in records
+             if flags == FLAG_DELETE and key not in self._index],
+            segment.number)
+
+        for flags, key, offset, length in records:
+            live = self._index.get(key) == (segment.number, offset, length)
+            if live or (flags == FLAG_DELETE and key in deleted):
+                self._write_record(key, flags, data[offset:offset + length])
+
+        del self._segments[segment.number]
+        segment.close()
+        os.remove(segment.fname)
+        log.debug("Compacted pack store segment %s.", segment.fname)
@@ -1,6 +1,22 @@
 #!/usr/bin/env python
 
-''' pickelIterator '''
+''' pickelIterator
+
+    Iterators for writing and reading sequences of pickled objects.
+
+    Files are written in a chunked binary format: elements are pickled,
+    length-prefixed and grouped into zlib compressed chunks. A footer holds
+    the index of all chunks, the number of elements and a commit marker.
+    Files are written to a temporary file which is only renamed to its final
+    name (suffix .pkl) after the footer has been written, i.e. incomplete
+    files are never visible to readers.
+
+    ReadPickleIterator also reads files written by previous versions (suffix
+    .gz; gzip compressed, base64 encoded pickles, one per line).
+
+    ParallelPickleReader splits files into chunk aligned ranges which are
+    processed by a multiprocessing pool.
+'''
 
 # (C)opyrights 2008 - 2015 by Albert Weichselbraun <albert@weichselbraun.net>
 #
@@ -20,11 +36,57 @@
 __copyright__ = "GPL"
 
 import gzip
-from binascii import b2a_base64, a2b_base64
+import os
+import zlib
+
+from binascii import a2b_base64
+from bisect import bisect_right
+from itertools import islice
+from multiprocessing import Pool
+from os.path import basename, dirname, exists, isdir, join
+from struct import Struct
+from tempfile import mkstemp
+
+from six import string_types
+
 try:
-    from cPickle import dumps, loads
+    from os import replace
+except ImportError:  # python2
+    from os import rename as replace
+
+try:
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
-    from pickle import dumps, loads
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
+
+FILE_SUFFIX = '.pkl'
+LEGACY_FILE_SUFFIX = '.gz'
+
+MAGIC = b'eWRTpkl1'
+GZIP_MAGIC = b'\x1f\x8b'
+COMMIT_MARKER = b'COMMITTED'
+
+# compressed size and number of elements of a chunk
+CHUNK_HEADER = Struct('>II')
+# size of a pickled element
+ELEMENT_HEADER = Struct('>I')
+# offset of a chunk and the index of the chunk's first element
+INDEX_ENTRY = Struct('>QQ')
+# offset of the index, number of elements and commit marker
+FOOTER = Struct('>QQ9s')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_SHARD_SIZE = 10000
+
+
+def _get_umask():
+    ''' returns the process' umask '''
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# read once, since querying the umask temporarily changes it for all threads
+_UMASK = _get_umask()
 
 
 class AbstractIterator(object):
@@ -33,10 +95,9 @@ class AbstractIterator(object):
     and WritePickleIterator
     '''
 
-    def __init__(self, fname, file_mode=None):
+    def __init__(self, fname, file_mode='rb'):
         self.fname = self.get_filename(fname)
-        self.f = gzip.open(
-            self.fname, file_mode) if file_mode else gzip.open(self.fname)
+        self.f = open(self.fname, file_mode)
 
     def __iter__(self):
         return self
@@ -53,34 +114,362 @@ class AbstractIterator(object):
 
     @classmethod
     def get_filename(cls, fname):
-        return fname if fname.endswith('.gz') else fname + '.gz'
+        return fname if fname.endswith(FILE_SUFFIX) else fname + FILE_SUFFIX
 
 
 class WritePickleIterator(AbstractIterator):
-    ''' writes pickeled elements (available as iterator) to a file '''
+    ''' writes pickeled elements (available as iterator) to a file
 
-    def __init__(self, fname):
-        AbstractIterator.__init__(self, fname, file_mode='w')
+        usage:
+          with WritePickleIterator(fname) as w:
+              for obj in objects:
+                  w.dump(obj)
+
+        @remarks
+        The file only becomes visible after close() has been called. Writers
+        which are discarded without being closed (or left due to an
+        exception) remove their temporary file.
+    '''
+
+    def __init__(self, fname, chunk_size=DEFAULT_CHUNK_SIZE,
+                 protocol=HIGHEST_PROTOCOL, compression_level=-1):
+        ''' ::param fname: the file name
+            ::param chunk_size: the number of (uncompressed) bytes after
+                                which a chunk is written
+            ::param protocol: the pickle protocol to use
+            ::param compression_level: the zlib compression level
+        '''
+        self.fname = self.get_filename(fname)
+        self.chunk_size = chunk_size
+        self.protocol = protocol
+        self.compression_level = compression_level
+
+        fd, self._temp_fname = mkstemp(
+            prefix='_%s-' % basename(self.fname),
+            dir=dirname(self.fname) or '.')
+        self.f = os.fdopen(fd, 'wb')
+        self.f.write(MAGIC)
+
+        self._chunk = []
+        self._chunk_bytes = 0
+        self._index = []
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def __del__(self):
+        self.abort()
+
+    def __len__(self):
+        return self._count
 
     def dump(self, obj):
         ''' dumps the following object to the pickle file '''
-        p = b2a_base64(dumps(obj))
-        self.f.write(p)
+        data = dumps(obj, self.protocol)
+        self._chunk.append(ELEMENT_HEADER.pack(len(data)))
+        self._chunk.append(data)
+        self._chunk_bytes += ELEMENT_HEADER.size + len(data)
+        self._count += 1
+        if self._chunk_bytes >= self.chunk_size:
+            self._write_chunk()
+
+    def dump_many(self, objs):
+        ''' dumps all objects of the given iterable '''
+        for obj in objs:
+            self.dump(obj)
+
+    def close(self):
+        ''' writes the index and the commit marker and publishes the file '''
+        if self.f.closed:
+            return
+        self._write_chunk()
+        index_offset = self.f.tell()
+        self.f.write(b''.join(INDEX_ENTRY.pack(offset, first)
+                              for offset, first in self._index))
+        self.f.write(FOOTER.pack(index_offset, self._count, COMMIT_MARKER))
+        self.f.close()
+        # mkstemp creates files which are only accessible by their owner
+        os.chmod(self._temp_fname, 0o666 & ~_UMASK)
+        replace(self._temp_fname, self.fname)
+
+    def abort(self):
+        ''' discards the file '''
+        f = getattr(self, 'f', None)
+        if f is None or f.closed:
+            return
+        f.close()
+        try:
+            os.remove(self._temp_fname)
+        except OSError:
+            pass
+
+    def _write_chunk(self):
+        if not self._chunk:
+            return
+        data = zlib.compress(b''.join(self._chunk), self.compression_level)
+        element_count = len(self._chunk) // 2
+        self._index.append((self.f.tell(), self._count - element_count))
+        self.f.write(CHUNK_HEADER.pack(len(data), element_count))
+        self.f.write(data)
+        self._chunk = []
+        self._chunk_bytes = 0
 
 
 class ReadPickleIterator(AbstractIterator):
-    ''' provides an iterator over pickeled elements '''
+    ''' provides an iterator over pickeled elements
+
+        @remarks
+        Files in the chunked format support len() and seek() in constant
+        time (apart from loading the target chunk). Files written by
+        previous versions are scanned instead.
+    '''
+
+    @classmethod
+    def get_filename(cls, fname):
+        ''' returns the given file name, if it carries a pickle file suffix,
+            and otherwise the name of the existing file (preferring the
+            current file format over the legacy one) '''
+        if fname.endswith((FILE_SUFFIX, LEGACY_FILE_SUFFIX)):
+            return fname
+        for suffix in (FILE_SUFFIX, LEGACY_FILE_SUFFIX):
+            if exists(fname + suffix):
+                return fname + suffix
+        return fname + FILE_SUFFIX
 
     def __init__(self, fname):
+        ''' ::raises IOError: if the file is incomplete or corrupt '''
         AbstractIterator.__init__(self, fname)
+        magic = self.f.read(len(MAGIC))
+        self._legacy = magic[:2] == GZIP_MAGIC
+        self._position = 0
 
-    def __iter__(self):
-        return self
+        if self._legacy:
+            self.f.seek(0)
+            self._lines = gzip.GzipFile(fileobj=self.f)
+            self._count = None
+            return
+        elif magic != MAGIC:
+            self.f.close()
+            raise IOError("Unknown pickle file format: %s." % self.fname)
+
+        self.f.seek(0, os.SEEK_END)
+        file_size = self.f.tell()
+        if file_size < len(MAGIC) + FOOTER.size:
+            self.f.close()
+            raise IOError("Incomplete pickle file: %s." % self.fname)
+        self.f.seek(file_size - FOOTER.size)
+        index_offset, self._count, marker = FOOTER.unpack(
+            self.f.read(FOOTER.size))
+        if marker != COMMIT_MARKER:
+            self.f.close()
+            raise IOError("Incomplete pickle file: %s." % self.fname)
+
+        self.f.seek(index_offset)
+        index = self.f.read(file_size - FOOTER.size - index_offset)
+        self._chunk_offsets = []
+        self._chunk_starts = []
+        for pos in range(0, len(index), INDEX_ENTRY.size):
+            offset, first = INDEX_ENTRY.unpack_from(index, pos)
+            self._chunk_offsets.append(offset)
+            self._chunk_starts.append(first)
+        self._chunk_no = None
+        self._chunk = []
+
+    def __len__(self):
+        if self._count is None:
+            # legacy files need to be scanned
+            position = self._position
+            self.seek(0)
+            self._count = sum(1 for _ in self._lines)
+            self.seek(position)
+        return self._count
 
     def __next__(self):
         ''' returns the next pickled element in the file '''
-        line = self.f.readline()
-        if not line:
+        if self._legacy:
+            line = self._lines.readline()
+            if not line:
+                raise StopIteration
+            self._position += 1
+            return loads(a2b_base64(line))
+
+        if self._position >= self._count:
             raise StopIteration
+        chunk_no = bisect_right(self._chunk_starts, self._position) - 1
+        if chunk_no != self._chunk_no:
+            self._load_chunk(chunk_no)
+        obj = loads(self._chunk[self._position -
+                                self._chunk_starts[chunk_no]])
+        self._position += 1
+        return obj
+
+    def seek(self, position):
+        ''' moves to the element with the given (zero based) position '''
+        if position < 0:
+            raise ValueError("Invalid position %d." % position)
+        if not self._legacy:
+            self._position = position
+            return
+
+        self.f.seek(0)
+        self._lines = gzip.GzipFile(fileobj=self.f)
+        self._position = 0
+        for _ in range(position):
+            if not self._lines.readline():
+                break
+            self._position += 1
+
+    def tell(self):
+        ''' returns the position of the next element '''
+        return self._position
+
+    def get_ranges(self, shard_size=DEFAULT_SHARD_SIZE):
+        ''' splits the file into (start, stop) ranges of approximately
+            shard_size elements which are aligned to chunk boundaries;
+            files written by previous versions yield a single range
+            (0, None), since seeking requires a scan of the file
+        '''
+        if self._legacy:
+            return [(0, None)]
+
+        ranges = []
+        start = 0
+        for chunk_start in self._chunk_starts[1:] + [self._count]:
+            if chunk_start - start >= shard_size or \
+                    chunk_start == self._count and chunk_start > start:
+                ranges.append((start, chunk_start))
+                start = chunk_start
+        return ranges
+
+    def close(self):
+        if self._legacy:
+            self._lines.close()
+        self.f.close()
+
+    def _load_chunk(self, chunk_no):
+        ''' reads and decompresses the given chunk '''
+        self.f.seek(self._chunk_offsets[chunk_no])
+        size, element_count = CHUNK_HEADER.unpack(
+            self.f.read(CHUNK_HEADER.size))
+        data = zlib.decompress(self.f.read(size))
+        self._chunk = []
+        offset = 0
+        for _ in range(element_count):
+            length, = ELEMENT_HEADER.unpack_from(data, offset)
+            offset += ELEMENT_HEADER.size
+            self._chunk.append(data[offset:offset + length])
+            offset += length
+        self._chunk_no = chunk_no
+
+
+def _read_range(fname, start, stop):
+    ''' yields the elements start ... stop-1 of the given file '''
+    reader = ReadPickleIterator(fname)
+    try:
+        reader.seek(start)
+        for obj in islice(reader, None if stop is None else stop - start):
+            yield obj
+    finally:
+        reader.close()
+
+
+def _map_range(args):
+    fname, start, stop, function = args
+    return [function(obj) for obj in _read_range(fname, start, stop)]
+
+
+def _map_shard(args):
+    fname, start, stop, function = args
+    return function(_read_range(fname, start, stop))
+
+
+class ParallelPickleReader(object):
+    ''' @class ParallelPickleReader
+        processes the elements of pickle iterator files in parallel
+
+        usage:
+          reader = ParallelPickleReader(['./results'], processes=8)
+          for result in reader.imap(analyze, ordered=False):
+              ...
+          reader.close()
+
+        @remarks
+        Functions are called in the pool's worker processes and therefore
+        need to be picklable (i.e. defined at the module level).
+    '''
+
+    def __init__(self, fnames, processes=None, shard_size=DEFAULT_SHARD_SIZE):
+        ''' ::param fnames: pickle iterator files or directories containing
+                              such files
+            ::param processes: number of worker processes (default: number
+                               of cpus)
+            ::param shard_size: approximate number of elements per shard
+        '''
+        if isinstance(fnames, string_types):
+            fnames = [fnames]
+        self.ranges = []
+        for fname in self._expand(fnames):
+            reader = ReadPickleIterator(fname)
+            try:
+                self.ranges.extend((reader.fname, start, stop) for start, stop
+                                   in reader.get_ranges(shard_size))
+            finally:
+                reader.close()
+        self._pool = Pool(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def imap(self, function, ordered=True):
+        ''' yields function(element) for all elements
+            ::param ordered: preserve the order of the elements; unordered
+                             results are yielded as soon as a shard has
+                             been processed
+        '''
+        for results in self._map(_map_range, function, ordered):
+            for result in results:
+                yield result
+
+    def map_shards(self, function, ordered=True):
+        ''' yields function(iterator) for the iterator over every shard;
+            suitable for computing partial aggregates
+            ::param ordered: yield the results in the order of the shards
+        '''
+        return self._map(_map_shard, function, ordered)
+
+    def close(self):
+        ''' terminates the worker processes '''
+        self._pool.close()
+        self._pool.join()
+
+    def _map(self, worker, function, ordered):
+        tasks = [(fname, start, stop, function)
+                 for fname, start, stop in self.ranges]
+        imap = self._pool.imap if ordered else self._pool.imap_unordered
+        return imap(worker, tasks)
 
-        return loads(a2b_base64(line))
+    @staticmethod
+    def _expand(fnames):
+        ''' returns all pickle iterator files in the given list of files and
+            directories '''
+        for fname in fnames:
+            if not isdir(fname):
+                yield fname
+                continue
+            for name in sorted(os.listdir(fname)):
+                # skip temporary files of active writers
+                if name.endswith((FILE_SUFFIX, LEGACY_FILE_SUFFIX)) and \
+                        not name.startswith('_'):
+                    yield join(fname, name)
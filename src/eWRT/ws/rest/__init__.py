@@ -10,6 +10,7 @@
 import traceback
 import logging
 import random
+import time
 
 try:
     # urllib2 is merged into urllib in python3 (SV)
@@ -25,16 +26,27 @@ except:
     from urlparse import urlsplit, urlunsplit  # python2
 
 from six import string_types
+from six.moves.queue import Empty, Queue
 from json import dumps, loads
 from functools import partial
+from multiprocessing.pool import ThreadPool
 from socket import setdefaulttimeout
+from threading import Lock
 
 from eWRT.access.http import Retrieve
+from eWRT.ws.rest.pool import (BALANCING_POLICIES, FAILURE_THRESHOLD,
+                               HealthChecker, LatencyPolicy, ServerPool)
 
 
 # set higher timeout values
 WS_DEFAULT_TIMEOUT = 900
 
+# timeout of the health check requests
+HEALTH_CHECK_TIMEOUT = 10
+
+# threads per server for parallel and hedged requests
+THREADS_PER_SERVER = 4
+
 logger = logging.getLogger('eWRT.ws.rest')
 
 
@@ -91,7 +103,14 @@ class RESTClient(object):
         else:
             handle = self.retrieve(url)
 
-        response = handle.read()
+        return self._parse_response(handle.read(), return_plain)
+
+    @staticmethod
+    def _parse_response(response, return_plain=False):
+        ''' deserializes the given json response
+        :param response: the response body
+        :param return_plain: return the response without deserialization
+        '''
         if response:
             return response if return_plain else loads(response.decode('utf8'))
         else:
@@ -150,13 +169,60 @@ class RESTClient(object):
                                   json_encode_arguments, content_type)
 
 class MultiRESTClient(object):
-    ''' allows multiple URLs for access REST services '''
+    ''' allows multiple URLs for access REST services
+
+    Requests are routed to the server with the lowest average response
+    time (an exponentially weighted moving average, EWMA); servers without
+    measurements are tried first in their configured order. Failed requests
+    count with a multiple of the server's average response time (bounded by
+    the default timeout), so that failing servers are tried last. Other
+    balancing policies and background health checks are provided by
+    eWRT.ws.rest.pool.
+
+    Optionally requests to all services are executed in parallel
+    (parallel_requests) and requests are hedged, i.e. sent to the next
+    server if the current one has not answered within hedge_delay seconds.
+    Both use a thread pool, which is shared by all requests of the client.
+
+    submit_batches() streams arbitrarily large document collections in
+    batches to the servers.
+    '''
     MAX_BATCH_SIZE = 500
+    MAX_BATCH_BYTES = None
     URL_PATH = None
 
     def __init__(self, service_urls, user=None, password=None,
-                 default_timeout=WS_DEFAULT_TIMEOUT, use_random_server=False):
-
+                 default_timeout=WS_DEFAULT_TIMEOUT, use_random_server=False,
+                 parallel_requests=False, hedge_delay=None,
+                 route_by_latency=True, balancing_policy=None,
+                 health_check_interval=None, health_check_path='status',
+                 health_check_timeout=HEALTH_CHECK_TIMEOUT, max_threads=None):
+        ''' :param service_urls: the urls of the web services
+            :param user: username
+            :param password: password
+            :param default_timeout: the request timeout
+            :param use_random_server: shuffle the configured servers
+            :param parallel_requests: query all servers in parallel, if a
+                                      request is executed on all services
+            :param hedge_delay: optional delay in seconds after which the
+                                request is also sent to the next server;
+                                the first answer is returned
+            :param route_by_latency: order the servers by their average
+                                     response time (ignored if a
+                                     balancing_policy is given)
+            :param balancing_policy: the balancing policy object or its name
+                                     ('latency', 'round-robin',
+                                     'least-outstanding')
+            :param health_check_interval: optional interval in seconds for
+                                          probing the servers in the
+                                          background; failing servers are
+                                          marked down until they recover
+            :param health_check_path: the path requested by health checks
+            :param health_check_timeout: the timeout of health checks
+            :param max_threads: the maximum number of threads for parallel
+                                and hedged requests (default: four per
+                                server)
+        '''
         self._service_urls = self.fix_urls(service_urls, user, password)
 
         if use_random_server:
@@ -164,8 +230,57 @@ class MultiRESTClient(object):
 
         self.clients = self._connect_clients(self._service_urls,
                                              default_timeout=default_timeout)
+        self.parallel_requests = parallel_requests
+        self.hedge_delay = hedge_delay
+        self.max_threads = max_threads
+        self._thread_pool = None
+        self._thread_pool_lock = Lock()
+
+        if balancing_policy is None:
+            balancing_policy = LatencyPolicy() if route_by_latency else None
+        elif isinstance(balancing_policy, string_types):
+            balancing_policy = BALANCING_POLICIES[balancing_policy]()
+        self.pool = ServerPool(
+            balancing_policy,
+            failure_threshold=(FAILURE_THRESHOLD if health_check_interval
+                               else None),
+            max_failure_latency=default_timeout or WS_DEFAULT_TIMEOUT)
+
+        self.health_checker = None
+        if health_check_interval:
+            self.health_check_path = health_check_path
+            self.health_check_timeout = health_check_timeout
+            # health checks use a per request timeout rather than changing
+            # the socket default timeout of the REST requests
+            self._health_retrieve = Retrieve('eWRT.REST', sleep_time=0,
+                                             default_timeout=None)
+            self.health_checker = HealthChecker(
+                self.pool, lambda: self.clients, self._probe,
+                health_check_interval)
+            self.health_checker.start()
+
+    def _probe(self, client):
+        ''' requests the health check path from the given client '''
+        url = RESTClient.get_request_url(client.service_url,
+                                         self.health_check_path)
+        self._health_retrieve.open(url, user=client.user,
+                                   pwd=client.password,
+                                   timeout=self.health_check_timeout).close()
+
+    def close(self):
+        ''' stops the health checks and the threads of parallel and hedged
+            requests '''
+        if self.health_checker is not None:
+            self.health_checker.stop()
+        with self._thread_pool_lock:
+            thread_pool, self._thread_pool = self._thread_pool, None
+        if thread_pool is not None:
+            thread_pool.terminate()
 
     def is_online(self):
+        if self.health_checker is not None:
+            return any(self.pool.is_healthy(client)
+                       for client in self.clients)
         try:
             self.request('status')
             return True
@@ -235,32 +350,55 @@ class MultiRESTClient(object):
         @param return_plain: whether to return the result without prior
                              deserialization using json.load (False*)
         '''
+        return self._request(self._get_client_order(), path, parameters,
+                             return_plain, execute_all_services,
+                             json_encode_arguments, query_parameters,
+                             content_type, pass_through_exceptions)
+
+    def _request(self, clients, path, parameters=None, return_plain=False,
+                 execute_all_services=False, json_encode_arguments=True,
+                 query_parameters=None, content_type='application/json',
+                 pass_through_exceptions=()):
+        ''' performs the request on the given, ordered clients '''
+        arguments = {'command': path,
+                     'parameters': parameters,
+                     'return_plain': return_plain,
+                     'json_encode_arguments': json_encode_arguments,
+                     'query_parameters': query_parameters,
+                     'content_type': content_type}
+
+        if execute_all_services and self.parallel_requests:
+            outcomes = self._execute_parallel(clients, arguments)
+        elif not execute_all_services and self.hedge_delay is not None:
+            outcomes = self._execute_hedged(clients, arguments,
+                                            pass_through_exceptions)
+        else:
+            outcomes = self._execute_sequential(clients, arguments,
+                                                execute_all_services,
+                                                pass_through_exceptions)
+
+        return self._get_response(path, outcomes)
+
+    @staticmethod
+    def _get_response(path, outcomes):
+        ''' logs the failed requests
+            :param outcomes: the (client, success, result) tuples of all
+                             requests
+            :returns: the result of the last successful request
+            :raises Exception: if all requests have failed
+        '''
         response = None
         errors = []
-        for client in self.clients:
-            try:
-                response = client.execute(
-                    command=path,
-                    parameters=parameters,
-                    return_plain=return_plain,
-                    json_encode_arguments=json_encode_arguments,
-                    query_parameters=query_parameters,
-                    content_type=content_type)
-
-                if not execute_all_services:
-                    break
-
-            except Exception as e:  # ported to python3 (SV)
-                if pass_through_exceptions:
-                    raise e
-                else:
-                    msg = 'could not execute %s %s, error %s\n%s' % (
-                        client.service_url, path, e,
-                        traceback.format_exc())
-                    logger.warn(msg)
-                    errors.append(msg)
-
-        if len(errors) == len(self.clients):
+        for client, success, result in outcomes:
+            if success:
+                response = result
+            else:
+                msg = 'could not execute %s %s, error %s\n%s' % (
+                    client.service_url, path, result[0], result[1])
+                logger.warning(msg)
+                errors.append(msg)
+
+        if len(errors) == len(outcomes):
             print ('\n'.join(errors))
             raise Exception('Could not make request to path %s: %s' % (
                 path,
@@ -268,13 +406,224 @@ class MultiRESTClient(object):
 
         return response
 
+    def _execute(self, client, arguments):
+        ''' executes the request on the given client and records its
+            response time
+            :returns: a (client, success, result) tuple; the result of
+                      failed requests is an (exception, traceback) tuple
+        '''
+        start = self._start_request(client)
+        try:
+            result = client.execute(**arguments)
+        except Exception as e:  # ported to python3 (SV)
+            return self._finish_request(client, start, error=e)
+        return self._finish_request(client, start, result)
+
+    def _start_request(self, client):
+        ''' registers a request to the given client
+            :returns: the request's start time
+        '''
+        self.pool.acquire(client)
+        return time.time()
+
+    def _finish_request(self, client, start, result=None, error=None):
+        ''' records the response time of a request; failed requests need
+            to be finished while their exception is handled
+            :returns: the request's (client, success, result) tuple
+        '''
+        self.pool.release(client, time.time() - start, error)
+        if error is not None:
+            return client, False, (error, traceback.format_exc())
+        return client, True, result
+
+    @staticmethod
+    def _add_sequential_outcome(outcomes, outcome, execute_all_services,
+                                pass_through_exceptions):
+        ''' adds the outcome of a sequential request
+            :returns: True, if no further clients need to be queried
+            :raises Exception: the request's exception, if it has failed
+                               and exceptions are passed through
+        '''
+        outcomes.append(outcome)
+        if not outcome[1] and pass_through_exceptions:
+            raise outcome[2][0]
+        return outcome[1] and not execute_all_services
+
+    def _execute_sequential(self, clients, arguments, execute_all_services,
+                            pass_through_exceptions):
+        ''' tries the clients one after another '''
+        outcomes = []
+        for client in clients:
+            if self._add_sequential_outcome(
+                    outcomes, self._execute(client, arguments),
+                    execute_all_services, pass_through_exceptions):
+                break
+        return outcomes
+
+    def _get_thread_pool(self):
+        ''' :returns: the thread pool for parallel and hedged requests '''
+        with self._thread_pool_lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPool(
+                    self.max_threads or THREADS_PER_SERVER * len(self.clients))
+            return self._thread_pool
+
+    def _execute_parallel(self, clients, arguments):
+        ''' executes the request on all clients in parallel
+            :returns: the outcomes in the order of the clients
+        '''
+        return self._get_thread_pool().map(
+            partial(self._execute, arguments=arguments), clients)
+
+    def _execute_hedged(self, clients, arguments, pass_through_exceptions):
+        ''' sends the request to the first client and, if it does not
+            answer within hedge_delay seconds or fails, to the next one
+            :returns: the outcomes of all failed requests and of the first
+                      successful one
+        '''
+        results = Queue()
+        thread_pool = self._get_thread_pool()
+
+        def start(client):
+            # slower hedges finish in the background
+            thread_pool.apply_async(self._execute, (client, arguments),
+                                    callback=results.put)
+
+        outcomes = []
+        start(clients[0])
+        started = 1
+        while len(outcomes) < len(clients):
+            try:
+                outcome = results.get(timeout=self.hedge_delay
+                                      if started < len(clients) else None)
+            except Empty:
+                start(clients[started])
+                started += 1
+                continue
+
+            outcomes.append(outcome)
+            if outcome[1]:
+                break
+            if pass_through_exceptions:
+                raise outcome[2][0]
+            if started < len(clients):
+                # replace the failed request right away, even if an earlier
+                # one is still pending
+                start(clients[started])
+                started += 1
+        return outcomes
+
+    def get_latency(self):
+        ''' :returns: a dictionary with the average response time per
+                      service url '''
+        return self.pool.get_latency()
+
+    def get_statistics(self):
+        ''' :returns: the health, outstanding requests, average response
+                      time, requests and failures per service url '''
+        return self.pool.get_statistics()
+
+    def _get_client_order(self):
+        ''' :returns: the healthy clients in the order they should be
+                      queried '''
+        return self.pool.get_order(self.clients)
+
     def get_service_urls(self): 
         ''' '''
         return [client.service_url for client in self.clients]
     
     @classmethod
-    def get_document_batch(cls, documents, batch_size=None):
+    def get_document_batch(cls, documents, batch_size=None,
+                           max_batch_bytes=None):
+        ''' splits the documents into batches
+        :param documents: an iterable (e.g. a generator) of documents
+        :param batch_size: the maximum number of documents per batch
+                           (MAX_BATCH_SIZE*)
+        :param max_batch_bytes: the maximum size of the json encoded batch
+                                (MAX_BATCH_BYTES*); larger documents form a
+                                batch of their own
+        :returns: an iterator over lists of documents
+        '''
         batch_size = batch_size if batch_size else cls.MAX_BATCH_SIZE
-        for i in range(0, len(documents), batch_size):
-            yield documents[i:i+batch_size]
+        max_batch_bytes = max_batch_bytes or cls.MAX_BATCH_BYTES
+        batch = []
+        batch_bytes = 2     # the list's brackets
+        for document in documents:
+            # the json encoded document and its separator
+            size = len(dumps(document)) + 2 if max_batch_bytes else 0
+            if batch and (len(batch) >= batch_size or (
+                    max_batch_bytes and batch_bytes + size > max_batch_bytes)):
+                yield batch
+                batch = []
+                batch_bytes = 2
+            batch.append(document)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def submit_batches(self, path, documents, batch_size=None,
+                       max_batch_bytes=None, workers=None, max_pending=None,
+                       **kargs):
+        ''' submits the documents in batches to the healthy servers
+        :param path: the path to post the batches to
+        :param documents: an iterable (e.g. a generator) of documents
+        :param batch_size: the maximum number of documents per batch
+        :param max_batch_bytes: the maximum size of a json encoded batch
+        :param workers: the number of concurrent requests (default: the
+                        number of servers)
+        :param max_pending: the maximum number of batches which have been
+                            submitted but whose results have not been
+                            consumed yet (default: 2 * workers); documents
+                            are only read from the iterable as fast as the
+                            results are consumed
+        :param kargs: further arguments passed to request()
+        :returns: an iterator over the responses in the order of the
+                  batches; the first failed batch raises its exception
+        '''
+        workers = workers or len(self.clients)
+        max_pending = max(max_pending or 2 * workers, workers)
+        batches = enumerate(self.get_document_batch(documents, batch_size,
+                                                    max_batch_bytes))
+        results = Queue()
+        completed = {}
+        submitted = consumed = 0
+        exhausted = False
+        pool = ThreadPool(workers)
+        try:
+            while True:
+                while not exhausted and submitted - consumed < max_pending:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    pool.apply_async(self._submit_batch, (path, batch, kargs),
+                                     callback=results.put)
+                    submitted += 1
+                if consumed == submitted:
+                    break
+
+                # responses are reassembled in the order of the batches
+                while consumed not in completed:
+                    no, success, result = results.get()
+                    completed[no] = (success, result)
+                success, result = completed.pop(consumed)
+                consumed += 1
+                if not success:
+                    raise result
+                yield result
+        finally:
+            pool.terminate()
+
+    def _submit_batch(self, path, batch, kargs):
+        ''' submits a numbered batch for submit_batches
+        :returns: a (number, success, response or exception) tuple
+        '''
+        no, documents = batch
+        try:
+            # pick the server under the pool's lock, concurrent workers
+            # would otherwise all see the same statistics
+            clients = self.pool.reserve(self.clients)
+            return no, True, self._request(clients, path, documents, **kargs)
+        except Exception as e:
+            return no, False, e
             
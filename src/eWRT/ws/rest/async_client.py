@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+''' .. module:: eWRT.ws.rest.async_client
+
+    asyncio variants of the RESTClient and MultiRESTClient, which issue
+    their requests through a (shared) AsyncRetrieve object. Use
+    asyncio.gather() to perform many requests concurrently:
+
+    .. code-block:: python
+
+       async with AsyncMultiRESTClient(service_urls) as client:
+           results = await asyncio.gather(
+               *[client.request('annotate', doc) for doc in documents])
+
+    .. note:: This module requires Python 3.5 or later.
+'''
+import logging
+
+from functools import partial
+from json import dumps
+
+from eWRT.access.async_http import (AsyncRetrieve, DEFAULT_MAX_CONNECTIONS,
+                                    DEFAULT_MAX_CONNECTIONS_PER_HOST)
+from eWRT.access.http import Retrieve
+from eWRT.ws.rest import MultiRESTClient, RESTClient, WS_DEFAULT_TIMEOUT
+
+logger = logging.getLogger('eWRT.ws.rest')
+
+
+class AsyncRESTClient(RESTClient):
+    '''
+    class:: AsyncRESTClient
+
+    a RESTClient whose execute method returns a coroutine
+    '''
+
+    def __init__(self, service_url, user=None, password=None,
+                 authentification_method='basic',
+                 module_name='eWRT.REST', default_timeout=WS_DEFAULT_TIMEOUT,
+                 retrieve=None):
+        ''' :param service_url: the base url of the web service
+            :param user: username
+            :param password: password
+            :param authentification_method: authentification method to use
+                                            ('basic'*, 'digest').
+            :param module_name: the module name to add to the USER AGENT
+                                description (optional)
+            :param retrieve: an optional AsyncRetrieve object, which is
+                             shared with other clients
+        '''
+        self.service_url = service_url[:-1] if service_url.endswith("/") \
+            else service_url
+        self.user = user
+        self.password = password
+
+        if retrieve is None:
+            retrieve = AsyncRetrieve(
+                module_name, sleep_time=0,
+                default_timeout=default_timeout or WS_DEFAULT_TIMEOUT)
+        self.async_retrieve = retrieve
+        self.retrieve = partial(retrieve.open,
+                                user=user,
+                                pwd=password,
+                                authentification_method=authentification_method
+                                )
+
+    async def _json_request(self, url, parameters=None, return_plain=False,
+                            json_encode_arguments=True,
+                            content_type='application/json'):
+        ''' performs the given json request (see RESTClient._json_request) '''
+        if parameters:
+            if json_encode_arguments:
+                parameters = dumps(parameters)
+            if not isinstance(parameters, bytes):
+                parameters = parameters.encode('utf8')
+            handle = await self.retrieve(url, parameters,
+                                         {'Content-Type': content_type})
+        else:
+            handle = await self.retrieve(url)
+
+        return self._parse_response(handle.read(), return_plain)
+
+    async def close(self):
+        ''' closes the connections of the underlying AsyncRetrieve object '''
+        await self.async_retrieve.close()
+
+
+class AsyncMultiRESTClient(MultiRESTClient):
+    ''' a MultiRESTClient whose request method returns a coroutine; all
+        clients share an AsyncRetrieve object, which bounds the number of
+        concurrent requests '''
+
+    def __init__(self, service_urls, user=None, password=None,
+                 default_timeout=WS_DEFAULT_TIMEOUT, use_random_server=False,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 retrieve=None, balancing_policy=None,
+                 health_check_interval=None, health_check_path='status'):
+        ''' :param max_connections: maximum number of concurrent requests
+            :param max_connections_per_host: maximum number of concurrent
+                                             requests per server
+            :param retrieve: an optional AsyncRetrieve object (overrides
+                             max_connections and max_connections_per_host)
+            :param balancing_policy: the balancing policy (see
+                                     MultiRESTClient)
+            :param health_check_interval: optional interval of the
+                                          background health checks
+            :param health_check_path: the path requested by health checks
+        '''
+        if retrieve is None:
+            retrieve = AsyncRetrieve(
+                'eWRT.REST', sleep_time=0,
+                default_timeout=default_timeout or WS_DEFAULT_TIMEOUT,
+                max_connections=max_connections,
+                max_connections_per_host=max_connections_per_host)
+        self.retrieve = retrieve
+        MultiRESTClient.__init__(
+            self, service_urls, user, password, default_timeout,
+            use_random_server, balancing_policy=balancing_policy,
+            health_check_interval=health_check_interval,
+            health_check_path=health_check_path)
+
+    def _connect_clients(self, service_urls, user=None, password=None,
+                         default_timeout=WS_DEFAULT_TIMEOUT):
+        if isinstance(service_urls, str):
+            service_urls = [service_urls]
+
+        clients = []
+        for url in service_urls:
+            service_url, user, password = Retrieve.get_user_password(url)
+            clients.append(AsyncRESTClient(service_url=service_url,
+                                           user=user,
+                                           password=password,
+                                           default_timeout=default_timeout,
+                                           retrieve=self.retrieve))
+        return clients
+
+    async def is_online(self):
+        if self.health_checker is not None:
+            return MultiRESTClient.is_online(self)
+        try:
+            await self.request('status')
+            return True
+        except Exception:
+            return False
+
+    async def request(self, path, parameters=None, return_plain=False,
+                      execute_all_services=False, json_encode_arguments=True,
+                      query_parameters=None, content_type='application/json',
+                      pass_through_exceptions=()):
+        ''' performs the given json request (see MultiRESTClient.request);
+            the servers are ordered by the balancing policy '''
+        arguments = {'command': path,
+                     'parameters': parameters,
+                     'return_plain': return_plain,
+                     'json_encode_arguments': json_encode_arguments,
+                     'query_parameters': query_parameters,
+                     'content_type': content_type}
+        outcomes = []
+        for client in self._get_client_order():
+            if self._add_sequential_outcome(
+                    outcomes, await self._execute_async(client, arguments),
+                    execute_all_services, pass_through_exceptions):
+                break
+        return self._get_response(path, outcomes)
+
+    async def _execute_async(self, client, arguments):
+        ''' executes the request on the given client (see
+            MultiRESTClient._execute) '''
+        start = self._start_request(client)
+        try:
+            result = await client.execute(**arguments)
+        except Exception as e:
+            return self._finish_request(client, start, error=e)
+        return self._finish_request(client, start, result)
+
+    async def close(self):
+        ''' stops the health checks and closes the connections of the
+            shared AsyncRetrieve object '''
+        MultiRESTClient.close(self)
+        await self.retrieve.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+''' .. module:: eWRT.ws.rest.pool
+
+    load balancing and health checks for the MultiRESTClient
+
+    The ServerPool keeps track of the health, the number of outstanding
+    requests and the average response time of every server and orders the
+    healthy servers according to a balancing policy:
+
+    - LatencyPolicy: the server with the lowest average response time (per
+      outstanding request) first
+    - RoundRobinPolicy: rotates the servers with every request
+    - LeastOutstandingPolicy: the server with the fewest pending requests
+      first
+    - WeightedPolicy: smooth weighted round robin
+
+    Servers are marked down after failure_threshold consecutive failures or
+    a failed probe of the HealthChecker, which periodically requests a
+    status path from every server in a background thread, and receive no
+    traffic until they answer again. If all servers are down, all of them
+    are tried.
+
+    .. code-block:: python
+
+       client = MultiRESTClient(service_urls, balancing_policy='round-robin',
+                                health_check_interval=10)
+'''
+import logging
+import weakref
+
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger('eWRT.ws.rest')
+
+# weight of the latest response time in the per server latency average
+EWMA_ALPHA = 0.3
+
+# consecutive failures after which a server is marked down
+FAILURE_THRESHOLD = 3
+
+# failed requests count with FAILURE_PENALTY times the server's average
+# response time, but at least with MIN_FAILURE_LATENCY seconds
+FAILURE_PENALTY = 2.
+MIN_FAILURE_LATENCY = 1.
+
+
+class LatencyPolicy(object):
+    ''' prefers the servers with the lowest average response time multiplied
+        by the number of outstanding requests (plus one), so that concurrent
+        requests are spread across the servers; servers without
+        measurements are tried first '''
+
+    def order(self, clients, stats):
+        return sorted(clients, key=lambda client: (
+            (stats[client]['latency'] or 0) *
+            (stats[client]['outstanding'] + 1),
+            stats[client]['outstanding']))
+
+
+class RoundRobinPolicy(object):
+    ''' starts every request with the next server '''
+
+    def __init__(self):
+        self._next = 0
+
+    def order(self, clients, stats):
+        start = self._next % len(clients) if clients else 0
+        self._next += 1
+        return clients[start:] + clients[:start]
+
+
+class LeastOutstandingPolicy(object):
+    ''' prefers the servers with the fewest outstanding requests and, for
+        the same number of requests, the lower average response time '''
+
+    def order(self, clients, stats):
+        return sorted(clients, key=lambda client: (
+            stats[client]['outstanding'], stats[client]['latency'] or 0))
+
+
+class WeightedPolicy(object):
+    ''' smooth weighted round robin: a server with weight 3 is tried first
+        three times as often as a server with weight 1 and the requests are
+        interleaved rather than sent in bursts '''
+
+    def __init__(self, weights, default_weight=1):
+        ''' :param weights: a dictionary with the weight of every service
+                            url
+            :param default_weight: the weight of servers without an entry
+        '''
+        self.weights = dict((url.rstrip('/'), weight)
+                            for url, weight in weights.items())
+        self.default_weight = default_weight
+        self._current = {}
+
+    def get_weight(self, client):
+        return self.weights.get(client.service_url.rstrip('/'),
+                                self.default_weight)
+
+    def order(self, clients, stats):
+        if not clients:
+            return []
+        total = 0
+        for client in clients:
+            weight = self.get_weight(client)
+            self._current[client] = self._current.get(client, 0) + weight
+            total += weight
+        ordered = sorted(clients, key=lambda client: -self._current[client])
+        self._current[ordered[0]] -= total
+        return ordered
+
+
+BALANCING_POLICIES = {'latency': LatencyPolicy,
+                      'round-robin': RoundRobinPolicy,
+                      'least-outstanding': LeastOutstandingPolicy}
+
+
+class ServerPool(object):
+    '''
+    class:: ServerPool
+
+    thread-safe bookkeeping of the servers' health, outstanding requests
+    and response times
+    '''
+
+    def __init__(self, policy=None, failure_threshold=None,
+                 max_failure_latency=None):
+        ''' :param policy: the balancing policy or None to keep the
+                           configured order
+            :param failure_threshold: consecutive failures after which a
+                                      server is marked down (None: never)
+            :param max_failure_latency: optional upper bound of the
+                                        response time recorded for failed
+                                        requests
+        '''
+        self.policy = policy
+        self.failure_threshold = failure_threshold
+        self.max_failure_latency = max_failure_latency
+        self._servers = {}
+        self._lock = Lock()
+
+    def _get_server(self, client):
+        state = self._servers.get(client)
+        if state is None:
+            state = self._servers[client] = {
+                'healthy': True, 'latency': None, 'outstanding': 0,
+                'consecutive_failures': 0, 'requests': 0, 'failures': 0,
+                'reserved': 0}
+        return state
+
+    def _get_order(self, clients):
+        stats = dict((client, self._get_server(client))
+                     for client in clients)
+        healthy = [client for client in clients
+                   if stats[client]['healthy']] or list(clients)
+        if self.policy is None:
+            return healthy
+        return self.policy.order(healthy, stats)
+
+    def get_order(self, clients):
+        ''' :returns: the healthy clients in the order they should be
+                      queried or all clients, if none of them is healthy '''
+        with self._lock:
+            return self._get_order(clients)
+
+    def reserve(self, clients):
+        ''' orders the clients like get_order, but moves the client with
+            the fewest outstanding requests to the front and registers the
+            next request to it right away, so that concurrent callers
+            spread over the servers rather than all picking the same one
+            ::param clients: the clients to choose from
+            :returns: the clients in the order they should be queried
+        '''
+        with self._lock:
+            order = self._get_order(clients)
+            if not order:
+                return order
+            first = min(order, key=lambda client:
+                        self._servers[client]['outstanding'])
+            state = self._servers[first]
+            state['outstanding'] += 1
+            state['reserved'] += 1
+        return [first] + [client for client in order if client is not first]
+
+    def acquire(self, client):
+        ''' registers a request to the given client '''
+        with self._lock:
+            state = self._get_server(client)
+            if state['reserved']:
+                # already counted as outstanding by reserve()
+                state['reserved'] -= 1
+            else:
+                state['outstanding'] += 1
+            state['requests'] += 1
+
+    def release(self, client, latency, error=None):
+        ''' registers the completion of a request
+            :param latency: the request's response time
+            :param error: the request's exception or None on success
+        '''
+        with self._lock:
+            state = self._get_server(client)
+            state['outstanding'] -= 1
+            if error is not None:
+                latency = max(latency, MIN_FAILURE_LATENCY,
+                              FAILURE_PENALTY * (state['latency'] or 0))
+                if self.max_failure_latency is not None:
+                    latency = min(latency, self.max_failure_latency)
+            state['latency'] = latency if state['latency'] is None \
+                else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * state['latency']
+            if error is None:
+                state['consecutive_failures'] = 0
+                self._set_health(client, state, True)
+                return
+
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            if self.failure_threshold is not None and \
+                    state['consecutive_failures'] >= self.failure_threshold:
+                self._set_health(client, state, False)
+
+    def set_health(self, client, healthy):
+        ''' marks the given client up or down '''
+        with self._lock:
+            state = self._get_server(client)
+            if healthy:
+                state['consecutive_failures'] = 0
+            self._set_health(client, state, healthy)
+
+    @staticmethod
+    def _set_health(client, state, healthy):
+        if state['healthy'] != healthy:
+            if healthy:
+                logger.info('server %s is up', client.service_url)
+            else:
+                logger.warning('server %s is down', client.service_url)
+            state['healthy'] = healthy
+
+    def is_healthy(self, client):
+        with self._lock:
+            return self._get_server(client)['healthy']
+
+    def get_latency(self):
+        ''' :returns: a dictionary with the average response time per
+                      service url '''
+        with self._lock:
+            return dict((client.service_url, state['latency'])
+                        for client, state in self._servers.items()
+                        if state['latency'] is not None)
+
+    def get_statistics(self):
+        ''' :returns: a dictionary with the health, outstanding requests,
+                      average response time, requests and failures per
+                      service url '''
+        with self._lock:
+            return dict((client.service_url, dict(state))
+                        for client, state in self._servers.items())
+
+
+class HealthChecker(object):
+    '''
+    class:: HealthChecker
+
+    periodically probes the servers in a background thread and marks them
+    up or down; the thread only keeps a weak reference to the checker and
+    terminates once the checker (and its owner) have been collected
+    '''
+
+    def __init__(self, pool, get_clients, probe, interval):
+        ''' :param pool: the ServerPool to update
+            :param get_clients: a function returning the clients to probe
+            :param probe: a function which raises an exception, if the
+                          given client is not available
+            :param interval: the delay between two checks in seconds
+        '''
+        self.pool = pool
+        self.get_clients = get_clients
+        self.probe = probe
+        self.interval = interval
+        self._stopped = Event()
+        self._thread = None
+
+    def check(self):
+        ''' probes all servers once '''
+        for client in self.get_clients():
+            try:
+                self.probe(client)
+                healthy = True
+            except Exception as e:
+                logger.debug('health check of %s failed: %s',
+                             client.service_url, e)
+                healthy = False
+            self.pool.set_health(client, healthy)
+
+    def start(self):
+        ''' starts the background checks '''
+        if self._thread is None:
+            self._stopped = Event()
+            self._thread = Thread(target=self._run, args=(
+                weakref.ref(self), self._stopped, self.interval))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        ''' stops the background checks '''
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def _run(checker_ref, stopped, interval):
+        while not stopped.wait(interval):
+            checker = checker_ref()
+            if checker is None:
+                return
+            checker.check()
+            del checker
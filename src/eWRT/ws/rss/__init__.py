@@ -30,11 +30,15 @@ def parse(url, last_modified=None):
     feed = feedparser.parse(url, modified=last_modified)
     retrieve = Retrieve("rss", HTTP_FETCH_DELAY)
     
-    result = []
-    for item in feed['items']:
-        if datetime.fromtimestamp(
-                mktime(item['updated_parsed'])) > last_modified:
-            item['content'] = retrieve.open(item['link']).read()
-            result.append(item)
+    result = [item for item in feed['items']
+              if datetime.fromtimestamp(
+                  mktime(item['updated_parsed'])) > last_modified]
+
+    # retrieve the referenced pages concurrently
+    content = dict(retrieve.fetch_many(set(item['link'] for item in result)))
+    for item in result:
+        if isinstance(content[item['link']], Exception):
+            raise content[item['link']]
+        item['content'] = content[item['link']]
 
     return result
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+''' shared fixtures of the eWRT.access tests '''
+import gzip
+import io
+import socket
+import time
+
+from base64 import b64encode
+from threading import Lock, Thread
+
+import pytest
+
+from six.moves import BaseHTTPServer, socketserver
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ''' a simple keep-alive server used for testing '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(head_only=True)
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond(body=self.rfile.read(
+            int(self.headers.get('Content-Length', 0))))
+
+    def _respond(self, head_only=False, body=None):
+        self.server.requests.append(self.path)
+        headers = {}
+        status = 200
+        if body is None:
+            body = b'hello ' + self.path.encode('ascii')
+
+        if self.path.startswith('/slow'):
+            with self.server.lock:
+                self.server.active += 1
+                self.server.max_active = max(self.server.active,
+                                             self.server.max_active)
+            time.sleep(0.1)
+            with self.server.lock:
+                self.server.active -= 1
+        elif self.path == '/unavailable' and \
+                self.server.requests.count(self.path) == 1:
+            status = 503
+        elif self.path == '/overloaded' and \
+                self.server.requests.count(self.path) == 1:
+            status = 429
+            headers['Retry-After'] = '1'
+        elif self.path == '/protected':
+            credentials = b'Basic ' + b64encode(b'user:secret')
+            if self.headers.get('Authorization', '').encode('ascii') \
+                    != credentials:
+                status = 401
+                headers['WWW-Authenticate'] = 'Basic realm="test"'
+        elif self.path.startswith('/etag'):
+            headers['ETag'] = '"v1"'
+            headers['Last-Modified'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+            if self.headers.get('If-None-Match') == '"v1"':
+                status, body = 304, b''
+        elif self.path == '/max-age':
+            headers['Cache-Control'] = 'max-age=60'
+        elif self.path.startswith('/vary'):
+            headers['Cache-Control'] = 'max-age=60'
+            headers['Vary'] = '*' if self.path == '/vary-all' \
+                else 'Accept-Language, Accept-Encoding'
+            body += b' ' + self.headers.get('Accept-Language', '').encode(
+                'ascii')
+        elif self.path == '/no-store':
+            headers['Cache-Control'] = 'no-store'
+            headers['ETag'] = '"v1"'
+        elif self.path == '/gzip':
+            stream = io.BytesIO()
+            with gzip.GzipFile(fileobj=stream, mode='wb') as f:
+                f.write(body)
+            body = stream.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+
+class LocalServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.connections = 0
+        self.requests = []
+        self.lock = Lock()
+        self.active = self.max_active = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+@pytest.fixture
+def http_servers():
+    ''' returns a function which starts LocalServers; all servers are shut
+        down after the test '''
+    servers = []
+
+    def start_server():
+        server = LocalServer()
+        Thread(target=server.serve_forever).start()
+        servers.append(server)
+        return server
+
+    yield start_server
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def http_server(http_servers):
+    ''' a running LocalServer '''
+    return http_servers()
+
+
+@pytest.fixture
+def unused_port():
+    ''' a local port without a listening server '''
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
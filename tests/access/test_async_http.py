@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+from urllib.error import HTTPError
+
+import pytest
+
+from eWRT.access import http
+from eWRT.access.async_http import AsyncRetrieve
+from eWRT.access.ratelimit import MemoryBucketStore, RateLimiter
+from eWRT.ws.rest.async_client import AsyncMultiRESTClient
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncRetrieve(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_server(self, http_server):
+        self.server = http_server
+        self.url = http_server.url
+
+    def setUp(self):
+        http.RETRY_WAIT_TIME_RANGE = (0, 0)
+
+    def tearDown(self):
+        http.RETRY_WAIT_TIME_RANGE = (2, 10)
+
+    def testConcurrency(self):
+        async def test():
+            async with AsyncRetrieve('test', sleep_time=0,
+                                     max_connections=10,
+                                     max_connections_per_host=4) as r:
+                return await asyncio.gather(
+                    *[r.open('%s/slow%d' % (self.url, i)) for i in range(12)])
+
+        start = time.time()
+        responses = run(test())
+        # twelve requests with at most four in parallel
+        assert 0.3 <= time.time() - start < 5
+        assert self.server.max_active == 4
+        assert [r.read() for r in responses] == \
+            [('hello /slow%d' % i).encode('ascii') for i in range(12)]
+        assert responses[0].code == 200
+
+    def testHostLimitsDoNotBlockOtherHosts(self):
+        ''' requests waiting for a busy host do not take global slots '''
+        other_url = self.url.replace('127.0.0.1', 'localhost')
+        finished = []
+
+        async def get(r, url):
+            await r.open(url)
+            finished.append(url)
+
+        async def test():
+            async with AsyncRetrieve('test', sleep_time=0,
+                                     max_connections=2,
+                                     max_connections_per_host=1) as r:
+                await asyncio.gather(get(r, self.url + '/slow0'),
+                                     get(r, self.url + '/slow1'),
+                                     get(r, other_url + '/fast'))
+
+        run(test())
+        assert finished[0] == other_url + '/fast'
+
+    def testBlockingBucketStore(self):
+        ''' bucket stores with blocking I/O are used from the executor '''
+        threads = []
+
+        class Store(object):
+            ''' stands in for a file or redis bucket store '''
+            store = MemoryBucketStore()
+
+            def update(self, key, function):
+                threads.append(threading.current_thread())
+                return self.store.update(key, function)
+
+        async def test():
+            async with AsyncRetrieve(
+                    'test', rate_limiter=RateLimiter(rate=100.,
+                                                     store=Store())) as r:
+                return await r.open(self.url + '/')
+
+        assert run(test()).read() == b'hello /'
+        assert threads and threading.main_thread() not in threads
+
+    def testSemantics(self):
+        async def test():
+            async with AsyncRetrieve('test', sleep_time=0) as r:
+                gzip = await r.open(self.url + '/gzip')
+                unavailable = await r.open(self.url + '/unavailable',
+                                           retry=1)
+                protected = await r.open(self.url + '/protected',
+                                         user='user', pwd='secret')
+                head = await r.open(self.url + '/', head_only=True)
+                with pytest.raises(HTTPError):
+                    await r.open(self.url + '/protected')
+                return gzip, unavailable, protected, head
+
+        gzip, unavailable, protected, head = run(test())
+        assert gzip.read() == b'hello /gzip'
+        assert gzip.headers['Content-Encoding'] == 'gzip'
+        assert unavailable.read() == b'hello /unavailable'
+        assert protected.read() == b'hello /protected'
+        assert head.read() == b''
+
+    def testThrottling(self):
+        async def test():
+            r = AsyncRetrieve('test', sleep_time=0.1)
+            await asyncio.gather(*[r.open(self.url + '/') for _ in range(4)])
+            await r.close()
+
+        start = time.time()
+        run(test())
+        assert 0.3 <= time.time() - start < 5
+
+    def testMultiRESTClient(self):
+        async def test():
+            async with AsyncMultiRESTClient(
+                    ['http://127.0.0.1:1/', self.url]) as client:
+                results = await asyncio.gather(
+                    *[client.request('echo', {'id': i}) for i in range(20)])
+                assert await client.request('status', return_plain=True) \
+                    == b'hello /status'
+                return results
+
+        assert run(test()) == [{'id': i} for i in range(20)]
+        assert self.server.requests.count('/echo') == 20
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import gzip
+import io
+import unittest
+import zlib
+
+import pytest
+
+from pytest import raises
+
+from eWRT.access.compression import DecompressedResponse, decompress, \
+    iter_chunks
+from eWRT.access.http import Retrieve
+
+CONTENT = b''.join(b'line %d\n' % i for i in range(100000))
+
+
+class _Response(io.BytesIO):
+    ''' a minimal urllib2 response '''
+
+    def __init__(self, data, encoding):
+        io.BytesIO.__init__(self, data)
+        self.headers = {'Content-Encoding': encoding}
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return io.BytesIO.read(self, size)
+
+    def geturl(self):
+        return 'http://localhost/'
+
+
+def gzip_compress(data):
+    stream = io.BytesIO()
+    with gzip.GzipFile(fileobj=stream, mode='wb') as f:
+        f.write(data)
+    return stream.getvalue()
+
+
+class TestDecompression(unittest.TestCase):
+
+    def testEncodings(self):
+        raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw_deflate = raw_deflate.compress(CONTENT) + raw_deflate.flush()
+
+        for encoding, data in (('gzip', gzip_compress(CONTENT)),
+                               ('x-gzip', gzip_compress(CONTENT)),
+                               ('deflate', zlib.compress(CONTENT)),
+                               ('deflate', raw_deflate)):
+            f = decompress(_Response(data, encoding), encoding)
+            assert isinstance(f, DecompressedResponse)
+            assert f.read() == CONTENT
+            # the response is read incrementally
+            assert f.response.reads > 1
+
+        response = _Response(CONTENT, 'identity')
+        assert decompress(response, 'identity') is response
+
+    def testMultiMemberGzip(self):
+        data = gzip_compress(b'first ') + gzip_compress(b'second')
+        assert decompress(_Response(data, 'gzip'), 'gzip').read() == \
+            b'first second'
+
+    def testTruncated(self):
+        data = gzip_compress(CONTENT)[:-100]
+        with raises(IOError):
+            decompress(_Response(data, 'gzip'), 'gzip').read()
+        with raises(IOError):
+            decompress(_Response(data[:5], 'gzip'), 'gzip').read()
+
+    def testEmpty(self):
+        for encoding in ('gzip', 'deflate'):
+            assert decompress(_Response(b'', encoding), encoding).read() == b''
+
+    def testLines(self):
+        f = decompress(_Response(gzip_compress(CONTENT), 'gzip'), 'gzip')
+        lines = list(f)
+        assert lines[-1] == b'line 99999\n' and len(lines) == 100000
+        assert f.geturl() == 'http://localhost/'
+        f.close()
+        assert f.response.closed
+
+    def testIterChunks(self):
+        f = decompress(_Response(gzip_compress(CONTENT), 'gzip'), 'gzip')
+        chunks = list(f.iter_chunks(100000))
+        assert b''.join(chunks) == CONTENT
+        assert max(len(chunk) for chunk in chunks) == 100000
+        assert list(iter_chunks(io.BytesIO(b'abc'), 2)) == [b'ab', b'c']
+
+
+class TestRetrieveDecompression(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_server(self, http_server):
+        self.server = http_server
+        self.url = http_server.url
+
+    def testIterChunks(self):
+        r = Retrieve('test', sleep_time=0)
+        assert list(r.iter_chunks(self.url + '/gzip', chunk_size=4)) == \
+            [b'hell', b'o /g', b'zip']
+        f = r.open(self.url + '/gzip')
+        assert f.headers.get('Content-Encoding') == 'gzip'
+        assert f.read() == b'hello /gzip'
+
+    def testHeadRequest(self):
+        f = Retrieve('test', sleep_time=0).open(self.url + '/gzip',
+                                                 head_only=True)
+        assert f.headers.get('Content-Encoding') == 'gzip'
+        assert f.read() == b''
+
+
+if __name__ == '__main__':
+    unittest.main()
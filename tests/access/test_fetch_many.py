@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+import time
+import unittest
+
+import pytest
+
+from six.moves.urllib.error import URLError
+
+from eWRT.access.http import Retrieve
+
+
+class TestFetchMany(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_servers(self, http_servers, unused_port):
+        self.servers = [http_servers(), http_servers()]
+        self.urls = [server.url for server in self.servers]
+        self.unused_port = unused_port
+
+    def testFetchMany(self):
+        urls = ['%s/slow%d' % (base_url, i)
+                for i in range(6) for base_url in self.urls]
+        failing_url = 'http://127.0.0.1:%d/' % self.unused_port
+
+        start = time.time()
+        results = list(Retrieve('test', sleep_time=0).fetch_many(
+            urls + [failing_url], workers=4, workers_per_host=2))
+        # 12 requests, two hosts with two concurrent requests each
+        assert 0.3 <= time.time() - start < 5
+
+        assert len(results) == 13
+        content = dict(results)
+        assert isinstance(content.pop(failing_url), URLError)
+        assert content == dict((url, b'hello /' + url.split('/', 3)[3]
+                                .encode('ascii')) for url in urls)
+        assert [server.max_active for server in self.servers] == [2, 2]
+
+    def testOrderOfCompletion(self):
+        r = Retrieve('test', sleep_time=0)
+        urls = [self.urls[0] + '/slow', self.urls[1] + '/fast']
+        assert [url for url, _ in r.fetch_many(urls)] == urls[::-1]
+        assert list(r.fetch_many([])) == []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,7 +18,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
-import urllib2
+
+try:
+    import urllib.request as urllib2
+except ImportError:
+    import urllib2  # python2
 
 from pytest import raises
 
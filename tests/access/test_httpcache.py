@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import unittest
+
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from eWRT.access.http import Retrieve
+from eWRT.access.httpcache import CachedResponse, HTTPCache, get_max_age, \
+    get_vary
+from eWRT.util.cache import MemoryCache
+
+
+class TestHTTPCache(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_server(self, http_server):
+        self.server = http_server
+        self.url = http_server.url
+
+    def testMaxAge(self):
+        assert get_max_age({'Cache-Control': 'public, max-age=120'}) == 120
+        assert get_max_age({'Cache-Control': 'max-age=120, no-cache'}) == 0
+        assert get_max_age({'Expires': 'Wed, 21 Oct 2015 07:38:00 GMT',
+                            'Date': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 600
+        assert get_max_age({}) == 0
+
+    def testGetVary(self):
+        assert get_vary({'Vary': 'Accept-Language, User-Agent'},
+                        {'accept-language': 'de'}) == \
+            [('accept-language', 'de'), ('user-agent', None)]
+        assert get_vary({'Vary': 'Accept-Encoding'}, {}) == []
+        assert get_vary({'Vary': 'Cookie, *'}, {}) is None
+        assert get_vary({}, None) == []
+
+    def testConditionalRequests(self):
+        cache = HTTPCache(cache=MemoryCache())
+        r = Retrieve('test', sleep_time=0, http_cache=cache)
+        for _ in range(3):
+            f = r.open(self.url + '/etag')
+            assert f.read() == b'hello /etag'
+            assert f.headers.get('etag') == '"v1"'
+            assert f.getcode() == 200
+        # the first request fetches the resource, the others revalidate it
+        assert self.server.requests == ['/etag'] * 3
+        assert cache.get_statistics() == {'hits': 0, 'revalidated': 2,
+                                          'misses': 1, 'stored': 1}
+
+    def testFreshResponses(self):
+        cache_dir = mkdtemp()
+        try:
+            cache = HTTPCache(cache_dir)
+            r = Retrieve('test', sleep_time=0, http_cache=cache)
+            for path in ('/max-age', '/gzip', '/no-store'):
+                for _ in range(2):
+                    assert r.open(self.url + path).read() == \
+                        b'hello ' + path.encode('ascii')
+            # POST and HEAD requests bypass the cache
+            assert r.open(self.url + '/max-age', data=b'x').read() == b'x'
+            assert r.open(self.url + '/max-age', head_only=True).read() == b''
+        finally:
+            rmtree(cache_dir)
+
+        # only /max-age has been served from the cache
+        assert self.server.requests == ['/max-age', '/gzip', '/gzip',
+                                        '/no-store', '/no-store',
+                                        '/max-age', '/max-age']
+        assert cache.get_statistics()['hits'] == 1
+
+    def testUncacheableResponsesAreStreamed(self):
+        cache = HTTPCache(cache=MemoryCache())
+        r = Retrieve('test', sleep_time=0, http_cache=cache)
+        for path in ('/gzip', '/no-store', '/vary-all'):
+            f = r.open(self.url + path)
+            assert not isinstance(f, CachedResponse)
+            assert f.read().startswith(b'hello ' + path.encode('ascii'))
+        assert isinstance(r.open(self.url + '/max-age'), CachedResponse)
+        assert cache.get_statistics()['stored'] == 1
+
+    def testVary(self):
+        cache = HTTPCache(cache=MemoryCache())
+        r = Retrieve('test', sleep_time=0, http_cache=cache)
+        for language in ('en', 'en', 'de', 'de', 'en'):
+            assert r.open(self.url + '/vary',
+                          headers={'Accept-Language': language}).read() == \
+                b'hello /vary ' + language.encode('ascii')
+        for _ in range(2):
+            assert r.open(self.url + '/vary-all').read() == b'hello /vary-all '
+
+        # cached responses are only served for matching request headers and
+        # responses which vary on all headers are not cached at all
+        assert self.server.requests == ['/vary', '/vary', '/vary',
+                                        '/vary-all', '/vary-all']
+        assert cache.get_statistics()['hits'] == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
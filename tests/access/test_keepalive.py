@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+import unittest
+
+import pytest
+
+import eWRT.access.http
+
+from eWRT.access.http import Retrieve
+from eWRT.access.keepalive import HTTPConnectionPool
+
+
+class TestKeepAlive(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_server(self, http_server):
+        self.server = http_server
+        self.url = http_server.url
+
+    def setUp(self):
+        eWRT.access.http.RETRY_WAIT_TIME_RANGE = (0, 0)
+
+    def tearDown(self):
+        eWRT.access.http.RETRY_WAIT_TIME_RANGE = (2, 10)
+
+    def get(self, retrieve, path, **kargs):
+        f = retrieve.open(self.url + path, **kargs)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testConnectionReuse(self):
+        with Retrieve('test', sleep_time=0, keep_alive=True) as r:
+            for i in range(5):
+                assert self.get(r, '/page%d' % i) == \
+                    ('hello /page%d' % i).encode('ascii')
+            assert self.get(r, '/gzip') == b'hello /gzip'
+            assert self.get(r, '/', head_only=True) == b''
+            assert self.get(r, '/head') == b'hello /head'
+        assert self.server.connections == 1
+        assert len(self.server.requests) == 8
+
+    def testWithoutKeepAlive(self):
+        r = Retrieve('test', sleep_time=0)
+        for i in range(3):
+            assert self.get(r, '/page%d' % i) == \
+                ('hello /page%d' % i).encode('ascii')
+        assert self.server.connections == 3
+
+    def testRetryAndAuthentication(self):
+        with Retrieve('test', sleep_time=0, keep_alive=True) as r:
+            assert self.get(r, '/unavailable', retry=1) == \
+                b'hello /unavailable'
+            assert self.get(r, '/protected', user='user', pwd='secret') == \
+                b'hello /protected'
+            assert self.get(r, '/done') == b'hello /done'
+        assert self.server.requests == ['/unavailable', '/unavailable',
+                                        '/protected', '/protected', '/done']
+
+    def testStaleConnection(self):
+        ''' connections closed by the server are transparently replaced '''
+        r = Retrieve('test', sleep_time=0, keep_alive=True)
+        assert self.get(r, '/first') == b'hello /first'
+        for connections in r._connection_pool._idle.values():
+            for conn, _ in connections:
+                conn.sock.close()
+        assert self.get(r, '/second') == b'hello /second'
+        assert self.server.connections == 2
+        r.close()
+
+    def testPoolSize(self):
+        pool = HTTPConnectionPool(pool_size=1)
+
+        class Connection(object):
+            sock = True
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        connections = [Connection() for _ in range(3)]
+        for conn in connections:
+            pool.put('host', conn)
+        assert len(pool) == 1
+        assert [c.closed for c in connections] == [False, True, True]
+        assert pool.get('host') is connections[0]
+        assert pool.get('host') is None
+
+        pool.put('host', connections[0], reusable=False)
+        assert len(pool) == 0 and connections[0].closed
+
+
+if __name__ == '__main__':
+    unittest.main()
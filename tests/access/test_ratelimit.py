@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import time
+import unittest
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+
+import pytest
+
+from eWRT.access.http import Retrieve
+from eWRT.access.ratelimit import FileBucketStore, MemoryBucketStore, \
+    RateLimiter, RedisBucketStore, get_rate_limit_reset, get_retry_after, \
+    reserve
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def testReserve(self):
+        # a new bucket permits a burst of three requests
+        state = None
+        for _ in range(3):
+            state, wait = reserve(state, 100., rate=2., burst=3)
+            assert wait == 0
+        # afterwards one request every 0.5 seconds
+        state, wait = reserve(state, 100., rate=2., burst=3)
+        assert wait == 0.5
+        state, wait = reserve(state, 100.25, rate=2., burst=3)
+        assert wait == 0.75
+        # the bucket refills after an idle period, up to its capacity
+        state, wait = reserve(state, 200., rate=2., burst=3)
+        assert wait == 0 and state == (2., 200.)
+
+    def testBlock(self):
+        now = [100.]
+        limiter = RateLimiter(rate=100., burst=10, clock=lambda: now[0])
+        assert limiter.reserve('a') == 0
+        limiter.block('a', 10)
+        assert limiter.reserve('a') == 10
+        assert limiter.reserve('b') == 0
+
+        # the first request after the block is permitted right away
+        limiter.block('b', 10)
+        now[0] = 110.
+        assert limiter.reserve('b') == 0
+        assert limiter.reserve('b') == 0.01
+
+    def _check_store(self, store):
+        clock = lambda: 100.
+        limiter = RateLimiter(rate=1., burst=2, store=store, clock=clock)
+        assert limiter.reserve('host') == 0
+        assert limiter.reserve('host') == 0
+        assert limiter.reserve('host') == 1
+        # a second limiter (process) shares the bucket
+        other = RateLimiter(rate=1., burst=2, store=store, clock=clock)
+        assert other.reserve('host') == 2
+        assert other.reserve('other.host') == 0
+
+    def testMemoryStore(self):
+        self._check_store(MemoryBucketStore())
+
+    def testFileStore(self):
+        bucket_dir = mkdtemp()
+        try:
+            self._check_store(FileBucketStore(bucket_dir))
+        finally:
+            rmtree(bucket_dir)
+
+    def testRedisStore(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self._check_store(RedisBucketStore(fakeredis.FakeStrictRedis()))
+
+    def testThreads(self):
+        limiter = RateLimiter(rate=1000., burst=1, clock=lambda: 100.)
+        waits = []
+
+        def reserve_many():
+            waits.extend(limiter.reserve('host') for _ in range(100))
+
+        threads = [Thread(target=reserve_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the reservations are spread over 0.4 seconds
+        assert sorted(waits) == pytest.approx([i / 1000. for i in range(400)])
+
+    def testHeaders(self):
+        assert get_retry_after({'Retry-After': '120'}) == 120
+        assert get_retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+                               now=1445412470) == 10
+        assert get_retry_after({'Retry-After': 'soon'}) is None
+        assert get_retry_after({}) is None
+
+        assert get_rate_limit_reset({'X-RateLimit-Remaining': '0',
+                                     'X-RateLimit-Reset': '30'}) == 30
+        assert get_rate_limit_reset({'X-RateLimit-Remaining': '0',
+                                     'X-RateLimit-Reset': '1445412480'},
+                                    now=1445412470) == 10
+        assert get_rate_limit_reset({'X-RateLimit-Remaining': '5',
+                                     'X-RateLimit-Reset': '30'}) is None
+
+
+class TestRetrieveRateLimit(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _start_server(self, http_server):
+        self.server = http_server
+        self.url = http_server.url
+
+    def testRetryAfter(self):
+        r = Retrieve('test', sleep_time=0.01)
+        start = time.time()
+        assert r.open(self.url + '/overloaded', retry=1).read() == \
+            b'hello /overloaded'
+        assert 1 <= time.time() - start < 5
+        assert self.server.requests == ['/overloaded', '/overloaded']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+import socket
+import time
+import unittest
+
+import pytest
+
+from pytest import raises
+from six.moves.urllib.error import HTTPError, URLError
+
+from eWRT.access.http import Retrieve
+from eWRT.access.retry import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, \
+    CIRCUIT_OPEN, CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def http_error(code):
+    return HTTPError('http://localhost/', code, 'error', {}, None)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def testBackoff(self):
+        policy = RetryPolicy(max_retries=10, backoff=1, max_backoff=5,
+                             jitter=False)
+        assert [policy.get_delay(i) for i in range(5)] == [1, 2, 4, 5, 5]
+
+        policy = policy.replace(jitter=True)
+        assert policy.max_retries == 10
+        assert all(0 <= policy.get_delay(3) <= 5 for _ in range(100))
+
+    def testRetryable(self):
+        policy = RetryPolicy()
+        assert policy.is_retryable(http_error(503))
+        assert policy.is_retryable(http_error(429))
+        assert not policy.is_retryable(http_error(404))
+        assert policy.is_retryable(URLError('connection refused'))
+        assert policy.is_retryable(socket.timeout())
+        assert not policy.is_retryable(ValueError())
+
+    def testNextDelay(self):
+        policy = RetryPolicy(max_retries=2, backoff=1, jitter=False,
+                             deadline=10)
+        now = time.time()
+        assert policy.next_delay(0, http_error(503), now) == 1
+        assert policy.next_delay(1, http_error(503), now, min_delay=5) == 5
+        assert policy.next_delay(2, http_error(503), now) is None
+        assert policy.next_delay(0, http_error(404), now) is None
+        # the delay would exceed the deadline
+        assert policy.next_delay(1, http_error(503), now - 9) is None
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def testStates(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.1)
+        breaker.record('a', http_error(503))
+        breaker.record('a', http_error(404))    # not a failure
+        breaker.record('a', http_error(503))
+        assert breaker.get_state('a') == CIRCUIT_CLOSED
+
+        breaker.record('a', http_error(503))
+        assert breaker.get_state('a') == CIRCUIT_OPEN
+        with raises(CircuitOpenError):
+            breaker.before_request('a')
+        breaker.before_request('b')
+
+        # after the recovery timeout a single trial request is permitted
+        time.sleep(0.1)
+        breaker.before_request('a')
+        assert breaker.get_state('a') == CIRCUIT_HALF_OPEN
+        with raises(CircuitOpenError):
+            breaker.before_request('a')
+        breaker.record('a', URLError('timeout'))
+        assert breaker.get_state('a') == CIRCUIT_OPEN
+
+        time.sleep(0.1)
+        breaker.before_request('a')
+        breaker.record('a')
+        assert breaker.get_state('a') == CIRCUIT_CLOSED
+
+        statistics = breaker.get_statistics()['a']
+        assert statistics['state'] == CIRCUIT_CLOSED
+        assert statistics['failures'] == 4
+        assert statistics['successes'] == 2
+        assert statistics['rejected'] == 2
+        assert statistics['opened'] == 2
+
+
+class TestRetrieveRetries(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _get_port(self, unused_port):
+        self.unused_port = unused_port
+
+    def testConnectionErrors(self):
+        host = '127.0.0.1:%d' % self.unused_port
+        url = 'http://%s/' % host
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+        r = Retrieve('test', sleep_time=0, circuit_breaker=breaker,
+                     retry_policy=RetryPolicy(max_retries=5, backoff=0.01))
+
+        start = time.time()
+        with raises(CircuitOpenError):
+            r.open(url)
+        with raises(CircuitOpenError):
+            r.open(url)
+        assert time.time() - start < 5
+
+        statistics = breaker.get_statistics()[host]
+        assert statistics['failures'] == 3
+        assert statistics['rejected'] == 2
+
+    def testThrottlingErrorKeepsTrial(self):
+        class _FailingRateLimiter(object):
+            def acquire(self, host):
+                raise RuntimeError('rate limiter unavailable')
+
+        host = '127.0.0.1:%d' % self.unused_port
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record(host, URLError('timeout'))
+        r = Retrieve('test', rate_limiter=_FailingRateLimiter(),
+                     circuit_breaker=breaker)
+        with raises(RuntimeError):
+            r.open('http://%s/' % host)
+        # the half-open trial has not been used up
+        assert breaker.get_state(host) == CIRCUIT_OPEN
+        breaker.before_request(host)
+
+    def testDeadline(self):
+        url = 'http://127.0.0.1:%d/' % self.unused_port
+        r = Retrieve('test', sleep_time=0,
+                     retry_policy=RetryPolicy(max_retries=100, backoff=0.1,
+                                              jitter=False, deadline=0.5))
+        start = time.time()
+        with raises(URLError):
+            r.open(url)
+        # without the deadline the retries would take minutes
+        assert time.time() - start < 5
+
+
+if __name__ == '__main__':
+    unittest.main()
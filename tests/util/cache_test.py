@@ -2,16 +2,24 @@
 # Unittests
 # run nosetest from python-nose to execute these tests
 #
+import gc
 import pytest
+import os
 import unittest
+import weakref
 
 from multiprocessing import Pool
 from shutil import rmtree
 from os.path import exists, join
+from threading import Thread
+from time import sleep
 
+from eWRT.util import cache
+from eWRT.util.codec import Codec
 from eWRT.util.module_path import get_resource
 from eWRT.util.cache import (MemoryCache, MemoryCached, DiskCached, DiskCache,
-                             Cache, IterableCache, RedisCached)
+                             Cache, IterableCache, RedisCache, RedisCached,
+                             rekey_cache, get_object_size, TieredCache, TieredCached)
 
 
 
@@ -64,6 +72,147 @@ class TestMemoryCached(TestCached):
     def sub(a=2, b=1):
         return a-b 
 
+class TestMemoryCachePolicies(unittest.TestCase):
+    ''' tests the eviction policies and the ttl of the MemoryCache '''
+
+    def testLRUEviction(self):
+        c = MemoryCache(max_cache_size=3)
+        for key in (1, 2, 3):
+            c.fetchObjectId(key, str, key)
+        c.fetchObjectId(1, str, 1)          # refresh 1
+        c.fetchObjectId(4, str, 4)          # evicts 2
+        assert len(c) == 3
+        assert 2 not in c
+        assert all(key in c for key in (1, 3, 4))
+
+    def testLFUEviction(self):
+        c = MemoryCache(max_cache_size=3, policy='lfu')
+        for key in (1, 2, 3):
+            c.fetchObjectId(key, str, key)
+        for key in (1, 1, 3):
+            c.fetchObjectId(key, str, key)
+        c.fetchObjectId(4, str, 4)          # evicts 2 (used once)
+        c.fetchObjectId(5, str, 5)          # evicts 4 (used once, newer)
+        assert 2 not in c and 4 not in c
+        assert all(key in c for key in (1, 3, 5))
+
+    def testLFURemoval(self):
+        c = MemoryCache(max_cache_size=2, policy='lfu')
+        c.fetchObjectId(1, str, 1)
+        c.fetchObjectId(2, str, 2)
+        c.fetchObjectId(2, str, 2)
+        del c[1]
+        c.fetchObjectId(3, str, 3)
+        c.fetchObjectId(4, str, 4)          # evicts 3
+        assert 3 not in c
+        assert 2 in c and 4 in c
+
+    def testTTL(self):
+        calls = []
+        def compute(x):
+            calls.append(x)
+            return x
+
+        c = MemoryCache(ttl=0.05)
+        c.fetchObjectId(1, compute, 1)
+        c.fetchObjectId(1, compute, 1)
+        assert calls == [1]
+        sleep(0.1)
+        c.fetchObjectId(1, compute, 1)
+        assert calls == [1, 1]
+
+        # expired objects are not contained in the cache
+        c[2] = 2
+        assert 2 in c
+        sleep(0.1)
+        assert 2 not in c
+        with pytest.raises(KeyError):
+            c[2]
+
+
+class TestMemoryCacheBudget(unittest.TestCase):
+    ''' tests byte budgeted MemoryCaches '''
+
+    def testByteBudget(self):
+        c = MemoryCache(max_cache_bytes=1000, sizer=len)
+        for x in range(4):
+            c.fetchObjectId(x, lambda: 300 * 'x')
+        assert len(c) == 3
+        assert c.cache_bytes == 900
+        assert 0 not in c
+
+        # objects exceeding the budget are not cached
+        c.fetchObjectId('large', lambda: 1001 * 'x')
+        assert 'large' not in c
+        assert c.getCacheStatistics()['cache_bytes'] == 900
+
+        # objects exceeding the budget replace previously cached ones
+        c[2] = 'x'
+        c[2] = 1001 * 'x'
+        assert 2 not in c
+        assert c.cache_bytes == 600
+        c[2] = 300 * 'x'
+
+        del c[1]
+        assert c.cache_bytes == 600
+
+    def testObjectSize(self):
+        small = get_object_size({'a': 1})
+        large = get_object_size({'a': 1, 'b': list(range(1000))})
+        assert small < large
+        # shared objects are only counted once
+        shared = list(range(1000))
+        assert get_object_size(100 * [shared]) < 2 * get_object_size(shared)
+
+
+class TestThreadSafeMemoryCache(unittest.TestCase):
+    ''' tests the single-flight semantics of thread safe MemoryCaches '''
+
+    def testSingleFlight(self):
+        calls = []
+        def slow_square(x):
+            calls.append(x)
+            sleep(0.2)
+            return x * x
+
+        c = MemoryCache(thread_safe=True)
+        results = []
+        threads = [Thread(target=lambda: results.append(
+            c.fetchObjectId(7, slow_square, 7))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert calls == [7]
+        assert results == 8 * [49]
+        stats = c.getCacheStatistics()
+        assert stats['cache_misses'] == 1
+        assert stats['cache_hits'] + stats['cache_waits'] == 7
+
+    def testErrorPropagation(self):
+        def failing(x):
+            sleep(0.2)
+            raise ValueError(x)
+
+        c = MemoryCache(thread_safe=True)
+        errors = []
+        def worker():
+            try:
+                c.fetchObjectId(1, failing, 1)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(errors) == 4
+        assert 1 not in c
+
+
 # todo: failing
 class SkipTestDiskCached(TestCached):
     @staticmethod
@@ -81,7 +230,7 @@ class SkipTestDiskCached(TestCached):
 
     def tearDown(self):
         ''' remove the cache directories '''
-        for cacheDirNo in range(10):
+        for cacheDirNo in range(13):
             if exists(get_cache_dir(cacheDirNo)):
                 rmtree(get_cache_dir(cacheDirNo))
         
@@ -149,6 +298,197 @@ class SkipTestDiskCached(TestCached):
             for x,y in zip(cachedIterator, getTestIterator(iteratorSize)):
                 assert x == y
 
+    def testIterableCachePartialRead(self):
+        ''' partially consumed iterables are not cached '''
+        i = IterableCache(get_cache_dir(5))
+        assert next(i.fetch(range, 5)) == 0
+        assert list(i.fetch(lambda x: ['new'], 5)) == ['new']
+        assert list(i.fetch(range, 5)) == ['new']
+
+    def testPackStorage(self):
+        ''' tests the DiskCache with the segment file backend '''
+        c = DiskCache(get_cache_dir(7), storage='pack')
+        assert c.fetch(str, 3) == "3"
+        assert c.getKey(3) in c
+        assert c.fetch(lambda x: "other", 3) == "3"
+        del c[c.getKey(3)]
+        assert c.getKey(3) not in c
+        assert c.getCacheStatistics() == {'cache_hits': 1, 'cache_misses': 1}
+
+    def testMixedCodecs(self):
+        ''' entries remain readable if the codec changes '''
+        CACHE_DIR = get_cache_dir(8)
+        DiskCache(CACHE_DIR).fetch(str, 1)
+        DiskCache(CACHE_DIR, codec=Codec('json', 'zlib')).fetch(str, 2)
+
+        c = DiskCache(CACHE_DIR, codec=Codec('pickle', 'none'))
+        assert c.fetch(lambda x: None, 1) == "1"
+        assert c.fetch(lambda x: None, 2) == "2"
+
+    def testKeyDigest(self):
+        ''' keyword argument order does not influence the key '''
+        c = DiskCache(get_cache_dir(9), key_digest='fast')
+        assert c.fetch(TestCached.add, a=1, b=2) == 3
+        assert c.fetch(lambda **kargs: None, b=2, a=1) == 3
+        assert c.getCacheStatistics()['cache_hits'] == 1
+
+    def testRekeyCache(self):
+        CACHE_DIR = get_cache_dir(9)
+        for x in range(5):
+            DiskCache(CACHE_DIR).fetchObjectId(x, str, x)
+
+        c = DiskCache(CACHE_DIR, key_digest='sha1')
+        assert rekey_cache(c, range(7)) == 5
+        assert all(c.fetchObjectId(x, lambda: None) == str(x)
+                   for x in range(5))
+        assert not exists(join(CACHE_DIR, Cache.getObjectId(1)))
+
+        # entries stored by fetch() with keyword arguments
+        old = DiskCache(CACHE_DIR)
+        old.fetch(TestCached.add, b=2, a=1)
+        assert rekey_cache(c, calls=[((), {'b': 2, 'a': 1})]) == 1
+        assert c.fetch(lambda **kargs: None, a=1, b=2) == 3
+
+    def testLegacyObjectIds(self):
+        ''' object ids of 'legacy' caches remain the ones of previous
+            versions (keyword arguments in the order of the call) '''
+        c = DiskCache(get_cache_dir(9))
+        assert c.getObjectId(c.getKey(1, b=2, a=1)) == \
+            'e8c22f709ae21aa755592852942f4a4ef23270a7'
+        assert c.getObjectId(c.getKey('x')) == \
+            Cache.getObjectId((('x', ), ()))
+
+    def testTTL(self):
+        ''' tests the expiry of entries '''
+        CACHE_DIR = get_cache_dir(12)
+        c = DiskCache(CACHE_DIR, ttl=60)
+        assert c.fetch(str, 1) == "1"
+        assert c.fetch(lambda x: "new", 1) == "1"
+
+        # ttl functions compute the time to live per object
+        c = DiskCache(CACHE_DIR, ttl=lambda key, obj: -1)
+        assert c.fetch(str, 2) == "2"
+        assert c.fetch(lambda x: "new", 2) == "new"
+        self.assertRaises(KeyError, c.__getitem__, c.getKey(2))
+        assert c.getKey(2) not in c
+
+        # entries without expiry are refreshed by caches with a ttl
+        DiskCache(CACHE_DIR).fetch(str, 3)
+        assert DiskCache(CACHE_DIR, ttl=60).fetch(lambda x: "new", 3) == "new"
+
+    def testContainsKeepsAccessTime(self):
+        ''' membership tests do not count as an access of the entry '''
+        for ttl in (0, 60):
+            c = DiskCache(get_cache_dir(12), ttl=ttl, max_cache_entries=10)
+            c[1] = 'x' * 1000
+            fname = c._store.get_fname(c.getObjectId(1))
+            os.utime(fname, (1000, 1000))
+            assert 1 in c and 2 not in c
+            assert os.stat(fname).st_mtime == 1000
+
+    def testStaleWhileRevalidate(self):
+        ''' stale entries are returned and refreshed in the background '''
+        c = DiskCache(get_cache_dir(12), stale_while_revalidate=3600,
+                      ttl=lambda key, obj: -1 if obj == 'old' else 60)
+        assert c.fetch(lambda x: 'old', 1) == 'old'
+        assert c.fetch(lambda x: 'new', 1) == 'old'
+        c.wait_for_refreshes()
+        assert c.fetch(lambda x: 'newer', 1) == 'new'
+
+        c[2] = 'old'
+        assert c.fetch_many([2, 3], lambda keys: ['new'] * len(keys)) == \
+            ['old', 'new']
+        c.wait_for_refreshes()
+        assert c[2] == 'new'
+
+        # second level caches of TieredCaches refresh stale entries, too
+        c[3] = 'old'
+        assert 3 in c
+        tiered = TieredCache(MemoryCache(), c)
+        assert tiered.fetchObjectId(3, lambda: 'new') == 'old'
+        c.wait_for_refreshes()
+        assert c[3] == 'new' and tiered[3] == 'new'
+
+    def testMaxCacheEntries(self):
+        ''' the janitor evicts the least recently used entries '''
+        CACHE_DIR = get_cache_dir(12)
+        c = DiskCache(CACHE_DIR, max_cache_entries=20, janitor_interval=0)
+        shards = {}
+        for no in range(40):
+            c[no] = no
+            os.utime(c._store.get_fname(c.getObjectId(no)), (1000, 1000))
+            shards.setdefault(c.getObjectId(no)[0], []).append(no)
+        # hits update the entries' access time
+        hot = max(shards.values(), key=len)[0]
+        assert c[hot] == hot
+
+        # the first cycle extrapolates the cache size from partial scans
+        evicted = c.collect_garbage(full=True) + c.collect_garbage(full=True)
+        remaining = [no for no in range(40) if no in c]
+        assert len(remaining) == 40 - evicted <= 20
+        assert hot in remaining
+        assert sum(stats['entries'] for stats
+                   in c.getShardStatistics().values()) == len(remaining)
+
+    def testFlatShards(self):
+        ''' flat stores are scanned by object id prefix and the cache
+            directory is only listed once per scan cycle '''
+        c = DiskCache(get_cache_dir(12), janitor_interval=0)
+        for no in range(50):
+            c[no] = no
+        store = c._store
+        assert store.shards() == list('0123456789abcdef')
+
+        listed = []
+        original_listdir = cache.listdir
+        cache.listdir = lambda path: listed.append(path) or \
+            original_listdir(path)
+        try:
+            entries = [store.scan_shard(shard) for shard in store.shards()]
+        finally:
+            cache.listdir = original_listdir
+        assert len(listed) == 1
+        assert sum(len(shard) for shard in entries) == 50
+        for shard, shard_entries in zip(store.shards(), entries):
+            assert all(os.path.basename(fname).startswith(shard)
+                       for _, _, fname in shard_entries)
+
+    def testJanitorReleasesCache(self):
+        ''' the janitor does not keep caches which are not closed alive '''
+        c = DiskCache(get_cache_dir(12), max_cache_entries=5,
+                      janitor_interval=0.01)
+        janitor = c._janitor
+        cache_ref = weakref.ref(c)
+        del c
+        gc.collect()
+        assert cache_ref() is None
+        janitor.stop()
+
+    def testMaxCacheBytes(self):
+        ''' size limits are enforced per shard '''
+        c = DiskCache(get_cache_dir(12), cache_nesting_level=1,
+                      max_cache_bytes=5000, janitor_interval=0.01)
+        c.set_many((no, 100 * str(no)) for no in range(200))
+        sleep(0.5)
+        c.close()
+
+        stats = c.getShardStatistics()
+        assert len(stats) == 16
+        assert sum(s['bytes'] for s in stats.values()) <= 5000
+        assert 0 < sum(s['entries'] for s in stats.values()) < 200
+
+    def testPackStorageLimits(self):
+        ''' pack stores evict their oldest segments '''
+        c = DiskCache(get_cache_dir(12), storage='pack', max_cache_bytes=4000,
+                      max_cache_entries=100, janitor_interval=0)
+        for no in range(200):
+            c[no] = 10 * str(no)
+        c.collect_garbage()
+        assert sum(s['bytes'] for s in c.getShardStatistics().values()) \
+            <= 4000
+        assert 199 in c and 0 not in c
+        c.close()
+
     @pytest.mark.slow
     def testThreadSafety(self):
         '''  tests whether everything is thread safe '''
@@ -164,6 +504,128 @@ class SkipTestDiskCached(TestCached):
             p.join()
 
 
+class TestTieredCache(unittest.TestCase):
+    ''' tests the two-level TieredCache '''
+
+    def tearDown(self):
+        if exists(get_cache_dir(10)):
+            rmtree(get_cache_dir(10))
+
+    def testWriteThrough(self):
+        l2 = DiskCache(get_cache_dir(10))
+        c = TieredCache(MemoryCache(), l2)
+        assert c.fetch(str, 1) == "1"
+        assert c.getKey(1) in l2
+
+        # second level hits are promoted to the first level
+        c2 = TieredCache(MemoryCache(), l2)
+        assert c2.fetch(lambda x: None, 1) == "1"
+        assert c2.fetch(lambda x: None, 1) == "1"
+        assert c2.getKey(1) in c2.l1
+        stats = c2.getCacheStatistics()
+        assert stats['l1_hits'] == 1 and stats['l2_hits'] == 1
+        assert stats['l1_hit_ratio'] == 0.5
+
+    def testGarbageCollection(self):
+        ''' unclosed write-back caches can be collected '''
+        c = TieredCache(MemoryCache(), DiskCache(get_cache_dir(10)),
+                        write_back=True, flush_interval=0.01)
+        ref = weakref.ref(c)
+        del c
+        gc.collect()
+        assert ref() is None
+
+    def testWriteBack(self):
+        l2 = DiskCache(get_cache_dir(10))
+        c = TieredCache(MemoryCache(max_cache_size=1), l2, write_back=True)
+        assert c.fetch(str, 1) == "1"
+        assert c.fetch(str, 2) == "2"
+        assert c.getKey(1) not in l2
+
+        # evicted from the first level but not yet written to the second
+        assert c.fetch(lambda x: None, 1) == "1"
+        assert c.getCacheStatistics()['cache_misses'] == 2
+
+        c.flush()
+        assert c.getKey(1) in l2 and c.getKey(2) in l2
+
+    def testTieredCached(self):
+        @TieredCached(MemoryCache(), DiskCache(get_cache_dir(10)))
+        def square(x):
+            return x * x
+
+        assert square(3) == 9
+        del square[square.getKey(3)]
+        assert square.getKey(3) not in square
+
+
+def fetch_strings(keys, calls=[]):
+    ''' batch fetch function used by TestFetchMany '''
+    calls.append(list(keys))
+    return [None if key == 'none' else str(key) for key in keys]
+
+
+class TestFetchMany(unittest.TestCase):
+    ''' tests the bulk fetch_many API of the different caches '''
+
+    def tearDown(self):
+        if exists(get_cache_dir(11)):
+            rmtree(get_cache_dir(11))
+
+    def _check_cache(self, cache):
+        calls = fetch_strings.__defaults__[0]
+        del calls[:]
+        assert cache.fetch_many([1, 2, 'none'], fetch_strings) == \
+            ['1', '2', None]
+        assert cache.fetch_many([3, 2, 1, 'none'], fetch_strings) == \
+            ['3', '2', '1', None]
+        # None results are not cached
+        assert calls == [[1, 2, 'none'], [3, 'none']]
+
+        # batch functions may return dictionaries
+        assert cache.fetch_many([4, 1], lambda keys: {4: 'four'}) == \
+            ['four', '1']
+        self.assertRaises(ValueError, cache.fetch_many, [5, 6],
+                          lambda keys: ['5'])
+
+    def testMemoryCache(self):
+        self._check_cache(MemoryCache())
+        cache = MemoryCache(thread_safe=True)
+        self._check_cache(cache)
+        assert cache.getCacheStatistics()['cache_misses'] == 8
+
+    def testDiskCache(self):
+        cache = DiskCache(get_cache_dir(11))
+        self._check_cache(cache)
+        assert cache.getCacheStatistics() == {'cache_hits': 3,
+                                              'cache_misses': 8}
+        assert DiskCache(get_cache_dir(11))[4] == 'four'
+
+    def testPackStorage(self):
+        self._check_cache(DiskCache(get_cache_dir(11), storage='pack'))
+
+    def testTieredCache(self):
+        cache = TieredCache(MemoryCache(max_cache_size=2),
+                            DiskCache(get_cache_dir(11)), write_back=True)
+        self._check_cache(cache)
+        cache.flush()
+        assert 3 in cache.l2 and 'none' not in cache.l2
+        stats = cache.getCacheStatistics()
+        assert stats['cache_requests'] == 11 and stats['cache_misses'] == 8
+
+    def testIterableCache(self):
+        cache = IterableCache(get_cache_dir(11))
+        iterators = cache.fetch_many([2, 3], lambda keys: [range(key)
+                                                          for key in keys])
+        assert [list(iterator) for iterator in iterators] == [[0, 1],
+                                                             [0, 1, 2]]
+
+        iterators = cache.fetch_many([3, 1], lambda keys: [['new']
+                                                          for key in keys])
+        assert [list(iterator) for iterator in iterators] == [[0, 1, 2],
+                                                             ['new']]
+
+
 def f(c):
     ''' Function for checking Diskcache with larger files.
 
@@ -217,6 +679,122 @@ class TestRedisCache(unittest.TestCase):
     def test_dict_type_preservation(self):
         d = dummy_return_dict(2)
         assert(isinstance(d, dict))
+
+
+# the commands used by the RedisCache, which are supported by the redis
+# client pinned in requirements.txt (2.10.3)
+LEGACY_REDIS_COMMANDS = ('delete', 'execute', 'execute_command', 'exists',
+                         'flushall', 'get', 'hdel', 'hgetall', 'hmget',
+                         'hset', 'incrby', 'mget', 'ping', 'pipeline', 'set',
+                         'ttl', 'zcard', 'zrange', 'zrem', 'zscore')
+
+
+class _LegacyRedis(object):
+    ''' restricts a redis client (and its pipelines) to the commands of the
+        pinned redis client '''
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        if name not in LEGACY_REDIS_COMMANDS:
+            raise AttributeError("redis 2.10.3 does not support %s" % name)
+        attr = getattr(self._client, name)
+        if name == 'pipeline':
+            return lambda *args, **kargs: _LegacyRedis(attr(*args, **kargs))
+        return attr
+
+
+class TestRedisCacheBackend(unittest.TestCase):
+    ''' tests the RedisCache against an in-process fake Redis server '''
+
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self.connection = _LegacyRedis(fakeredis.FakeStrictRedis())
+
+    def tearDown(self):
+        self.connection.flushall()
+
+    def testFetch(self):
+        cache = RedisCache(connection=self.connection)
+        calls = []
+        fn = lambda x: calls.append(x) or {'value': x}
+        assert cache.fetch(fn, 1) == {'value': 1}
+        assert cache.fetch(fn, 1) == {'value': 1}
+        assert calls == [1]
+        assert ((1, ), ()) in cache
+        del cache[((1, ), ())]
+        assert ((1, ), ()) not in cache
+
+    def testLRUEviction(self):
+        cache = RedisCache(max_cache_size=3, connection=self.connection)
+        for key in 'abc':
+            cache[key] = key
+        cache['a']          # 'b' is now the least recently used object
+        cache['d'] = 'd'
+        assert 'b' not in cache
+        assert all(key in cache for key in 'acd')
+        assert self.connection.zcard('eWRT:lru') == 3
+
+        # overwriting objects does not trigger evictions
+        cache['a'] = 'A'
+        assert all(key in cache for key in 'acd')
+
+    def testByteBudget(self):
+        cache = RedisCache(max_cache_bytes=1000, connection=self.connection)
+        for no in range(10):
+            cache[no] = no * 100 * 'x'
+        assert 0 < cache.cache_bytes <= 1000
+        assert 9 in cache and 0 not in cache
+
+        # objects exceeding the budget are not cached
+        cache['big'] = 2000 * 'x'
+        assert 'big' not in cache
+
+        # and remove the objects they replace
+        cache_bytes = cache.cache_bytes
+        cache[9] = 2000 * 'x'
+        assert 9 not in cache
+        assert self.connection.zscore('eWRT:lru', cache.getObjectId(9)) \
+            is None
+        assert cache.cache_bytes < cache_bytes
+        assert cache.cache_bytes == sum(
+            int(size) for size in
+            self.connection.hgetall('eWRT:sizes').values())
+
+    def testRemoveObjects(self):
+        ''' removals and evictions keep the byte count of the cache '''
+        cache = RedisCache(max_cache_size=3, max_cache_bytes=1000,
+                           connection=self.connection)
+        for key in 'abcd':
+            cache[key] = 100 * key
+        del cache['d']
+        assert list(key in cache for key in 'abcd') == \
+            [False, True, True, False]
+        assert cache.cache_bytes == sum(
+            int(size) for size in
+            self.connection.hgetall('eWRT:sizes').values())
+
+    def testFetchMany(self):
+        cache = RedisCache(max_cache_size=10, connection=self.connection)
+        cache.set_many({1: 'one', 2: 'two'})
+        requested = []
+
+        def fetch_numbers(keys):
+            requested.extend(keys)
+            return dict((key, str(key)) for key in keys)
+
+        assert cache.fetch_many([1, 2, 3, 4], fetch_numbers) == \
+            ['one', 'two', '3', '4']
+        assert requested == [3, 4]
+        assert cache[4] == '4'
+        self.assertRaises(ValueError, cache.fetch_many, [5, 6],
+                          lambda keys: ['5'])
+
+    def testTTL(self):
+        cache = RedisCache(ttl=60, connection=self.connection)
+        cache['a'] = 1
+        assert 0 < self.connection.ttl('eWRT:d:' + cache.getObjectId('a')) <= 60
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import asyncio
+import unittest
+
+from concurrent.futures import TimeoutError
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from pytest import raises
+
+from eWRT.util.async_cache import AsyncCache, AsyncDiskCached, \
+    AsyncMemoryCached, AsyncRedisCached
+from eWRT.util.cache import DiskCache, MemoryCache
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncCache(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    async def lookup(self, x):
+        self.calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    def testDeduplication(self):
+        ''' concurrent requests for the same key are only computed once '''
+        cache = AsyncCache(MemoryCache())
+
+        async def test():
+            results = await asyncio.gather(
+                *[cache.fetch(self.lookup, x) for x in (1, 1, 2, 1)])
+            assert results == [2, 2, 4, 2]
+            assert await cache.fetch(self.lookup, 1) == 2
+
+        run(test())
+        assert sorted(self.calls) == [1, 2]
+        assert cache.getCacheStatistics() == {'cache_hits': 1,
+                                              'cache_misses': 2,
+                                              'cache_waits': 2}
+
+    def testErrorPropagation(self):
+        cache = AsyncCache(MemoryCache())
+
+        async def fail(x):
+            await asyncio.sleep(0.01)
+            raise ValueError(x)
+
+        async def test():
+            results = await asyncio.gather(cache.fetch(fail, 1),
+                                           cache.fetch(fail, 1),
+                                           return_exceptions=True)
+            assert all(isinstance(r, ValueError) for r in results)
+            assert await cache.fetch(self.lookup, 1) == 2
+
+        run(test())
+
+    def testStaleWhileRevalidate(self):
+        ''' stale entries are refreshed by awaiting the fetch_function '''
+        cache_dir = mkdtemp()
+        try:
+            disk_cache = DiskCache(
+                cache_dir, stale_while_revalidate=3600,
+                ttl=lambda key, obj: -1 if obj == 2 else 60)
+            cache = AsyncCache(disk_cache)
+
+            async def test():
+                assert await cache.fetch(self.lookup, 1) == 2
+                assert await cache.fetch(self.lookup, 1) == 2
+                # the refresh is scheduled in this event loop
+                await asyncio.get_event_loop().run_in_executor(
+                    None, disk_cache.wait_for_refreshes)
+
+            run(test())
+            assert self.calls == [1, 1]
+        finally:
+            rmtree(cache_dir)
+
+    def testRefreshWithoutRunningLoop(self):
+        ''' refreshes never block the background refresher forever '''
+        cache = AsyncCache(MemoryCache(), refresh_timeout=0.05)
+        loop = asyncio.new_event_loop()
+        try:
+            with raises(TimeoutError):
+                cache._refresh_threadsafe(loop, 1, self.lookup, (1, ), {})
+            # process the scheduled (and cancelled) refresh
+            loop.run_until_complete(asyncio.sleep(0.05))
+        finally:
+            loop.close()
+
+        # closed loops are skipped
+        calls = len(self.calls)
+        cache._refresh_threadsafe(loop, 2, self.lookup, (2, ), {})
+        assert len(self.calls) == calls
+
+    def testDecorators(self):
+        cache_dir = mkdtemp()
+        try:
+            @AsyncDiskCached(cache_dir)
+            async def disk_lookup(x):
+                return await self.lookup(x)
+
+            @AsyncMemoryCached
+            async def memory_lookup(x):
+                return await self.lookup(x)
+
+            @AsyncMemoryCached(10)
+            async def bounded_lookup(x):
+                return await self.lookup(x)
+
+            async def test():
+                for fn in (disk_lookup, memory_lookup, bounded_lookup):
+                    assert await fn(3) == 6
+                    assert await fn(3) == 6
+
+            run(test())
+            assert self.calls == [3, 3, 3]
+            assert disk_lookup.offload and not memory_lookup.offload
+        finally:
+            rmtree(cache_dir)
+
+    def testRedis(self):
+        fakeredis = pytest.importorskip('fakeredis')
+
+        @AsyncRedisCached({'connection': fakeredis.FakeStrictRedis()})
+        async def redis_lookup(x):
+            return await self.lookup(x)
+
+        async def test():
+            assert await redis_lookup(4) == 8
+            assert await redis_lookup(4) == 8
+
+        run(test())
+        assert self.calls == [4]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import unittest
+
+from collections import OrderedDict
+
+from eWRT.util.cachekey import (KEY_DIGESTS, encode_key, get_memory_key,
+                                is_fast_key)
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def testCanonicalEncoding(self):
+        ''' equal keys yield equal encodings '''
+        assert encode_key({'a': 1, 'b': 2}) == encode_key({'b': 2, 'a': 1})
+        assert encode_key(OrderedDict([('b', 2), ('a', 1)])) == \
+            encode_key({'a': 1, 'b': 2})
+        assert encode_key(set(range(100))) == \
+            encode_key(set(reversed(range(100))))
+        assert encode_key(0.1 + 0.2) == encode_key(0.30000000000000004)
+
+    def testTypesAreDistinguished(self):
+        keys = [1, 1.0, True, '1', b'1', (1, ), [1], None, '', ()]
+        encodings = set(encode_key(key) for key in keys)
+        assert len(encodings) == len(keys)
+
+        # concatenated strings must not collide
+        assert encode_key(('ab', 'c')) != encode_key(('a', 'bc'))
+
+    def testStableDigests(self):
+        ''' the canonical encoding must not change between versions '''
+        assert encode_key((('wien', 3), (('lang', 'de'), ))) == \
+            b't2:t2:s4:wieni3;t1:t2:s4:langs2:de'
+        assert KEY_DIGESTS['sha1']('x') == \
+            'fb50e14d0e16555ddb1f7dc4a9e3f056632366c5'
+
+    def testMemoryKey(self):
+        key = ((1, 'a'), ())
+        assert is_fast_key(key)
+        assert get_memory_key(key) is key
+        assert not is_fast_key(((1.0, ), ()))
+        assert get_memory_key(1) != get_memory_key(True)
+        assert get_memory_key([1, 2]) == get_memory_key([1, 2])
+        # encoded keys never collide with text keys
+        assert get_memory_key(u's1:a') != get_memory_key(b'a')
+        assert get_memory_key(u'i1;') != get_memory_key(1.0)
+
+    def testFastDigest(self):
+        ''' the same digest is used on every Python version '''
+        assert KEY_DIGESTS['fast']('x') == KEY_DIGESTS['md5']('x')
+
+
+if __name__ == '__main__':
+    unittest.main()
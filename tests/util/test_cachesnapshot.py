@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from pytest import raises
+
+from eWRT.util.cache import DiskCache, MemoryCache
+from eWRT.util.cachesnapshot import load_snapshot, save_snapshot, warm_up
+
+
+class TestCacheSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.snapshot = join(self.tmp_dir, 'snapshot')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def testMemoryCacheSnapshot(self):
+        cache = MemoryCache(ttl=3600)
+        for no in range(10):
+            cache[no] = str(no)
+        cache[('tuple', {'dict': 1})] = 'complex key'
+        cache[3]
+
+        assert save_snapshot(cache, self.snapshot, max_entries=5) == 5
+        restored = MemoryCache(max_cache_size=3)
+        assert load_snapshot(restored, self.snapshot) == 5
+        # the hottest entries remain in the smaller cache
+        assert len(restored) == 3
+        assert 3 in restored and 9 in restored and 8 not in restored
+        assert ('tuple', {'dict': 1}) in restored
+
+        save_snapshot(cache, self.snapshot)
+        restored = MemoryCache()
+        load_snapshot(restored, self.snapshot)
+        assert restored[('tuple', {'dict': 1})] == 'complex key'
+        assert restored._expires[3] == cache._expires[3]
+
+    def testDiskCacheSnapshot(self):
+        cache = DiskCache(join(self.tmp_dir, 'cache'), key_digest='sha1')
+        for no in range(10):
+            cache[no] = str(no)
+
+        assert save_snapshot(cache, self.snapshot) == 10
+        restored = DiskCache(join(self.tmp_dir, 'restored'), storage='pack',
+                             key_digest='sha1')
+        assert load_snapshot(restored, self.snapshot) == 10
+        assert restored[7] == '7'
+
+        with raises(ValueError):
+            load_snapshot(MemoryCache(), self.snapshot)
+        with raises(ValueError):
+            load_snapshot(DiskCache(join(self.tmp_dir, 'legacy')),
+                          self.snapshot)
+
+    def testWarmUp(self):
+        calls = []
+
+        def square(x, offset=0):
+            calls.append(x)
+            return x * x + offset
+
+        cache = MemoryCache()
+        cache.fetch(square, 2)
+        assert warm_up(cache, square, range(5), workers=2, batch_size=2) == 4
+        assert cache.fetch(square, 4) == 16
+        assert sorted(calls) == [0, 1, 2, 3, 4]
+
+
+if __name__ == '__main__':
+    unittest.main()
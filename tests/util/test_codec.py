@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import pickle
+import unittest
+
+from gzip import GzipFile
+from io import BytesIO
+
+from pytest import raises
+
+from eWRT.util.codec import COMPRESSORS, Codec, LegacyCodec, decode, \
+    get_expiry
+
+TEST_OBJECT = {'name': 'Wien', 'population': 1897491, 'tags': ['a', 'b']}
+
+
+class TestCodec(unittest.TestCase):
+
+    def testRoundTrip(self):
+        ''' all available compressors can be combined with all serializers '''
+        compressors = set(c for c in COMPRESSORS if not isinstance(c, int))
+        for compressor in compressors:
+            for serializer in ('pickle', 'json'):
+                codec = Codec(serializer, compressor, level=1)
+                assert decode(codec.encode(TEST_OBJECT)) == TEST_OBJECT
+
+    def testRawSerializer(self):
+        codec = Codec('raw', 'none')
+        data = codec.encode(b'<html/>')
+        assert data.endswith(b'<html/>')
+        assert decode(data) == b'<html/>'
+        with raises(TypeError):
+            codec.encode(u'text')
+
+    def testLegacyFormat(self):
+        ''' entries without header written by previous versions '''
+        buf = BytesIO()
+        with GzipFile(fileobj=buf, mode='wb') as f:
+            pickle.dump(TEST_OBJECT, f)
+        assert decode(buf.getvalue()) == TEST_OBJECT
+        assert decode(LegacyCodec().encode(TEST_OBJECT)) == TEST_OBJECT
+
+    def testExpiry(self):
+        ''' the expiry time stamp is readable without decoding the payload '''
+        for codec in (Codec('json', 'zlib'), LegacyCodec()):
+            assert get_expiry(codec.encode(TEST_OBJECT)) is None
+            data = codec.encode(TEST_OBJECT, expires=1500000000.5)
+            assert get_expiry(data) == 1500000000.5
+            assert decode(data) == TEST_OBJECT
+            assert get_expiry(codec.encode(TEST_OBJECT, expires=0)) == 0
+
+    def testUnknownCodec(self):
+        with raises(ValueError):
+            Codec(compressor='unknown')
+        with raises(ValueError):
+            decode(b'unknown format')
+
+
+if __name__ == '__main__':
+    unittest.main()
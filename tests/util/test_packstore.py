@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import os
+import time
+import unittest
+
+from multiprocessing import Pool
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from eWRT.util.packstore import FLAG_DELETE, PackStore
+
+
+def _put_range(args):
+    ''' stores the given range of keys (helper for testMultiProcessing) '''
+    store_dir, start = args
+    store = PackStore(store_dir)
+    for no in range(start, start + 50):
+        store.put('key%d' % no, str(no).encode('ascii'))
+    return 0
+
+
+class TestPackStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.store_dir)
+
+    def testPutGetDelete(self):
+        store = PackStore(self.store_dir)
+        store.put('a', b'alpha')
+        store.put('b', b'beta')
+        store.put('a', b'ALPHA')
+        assert store.get('a') == b'ALPHA'
+        assert 'b' in store
+        store.delete('b')
+        assert 'b' not in store
+        self.assertRaises(KeyError, store.get, 'b')
+        self.assertRaises(KeyError, store.delete, 'b')
+
+        # the index is rebuilt from the segment files
+        store.close()
+        store = PackStore(self.store_dir)
+        assert len(store) == 1
+        assert store.get('a') == b'ALPHA'
+
+    def testSegmentsAndCompaction(self):
+        store = PackStore(self.store_dir, segment_size=1024,
+                          auto_compact=False)
+        for no in range(200):
+            store.put('key%d' % no, 20 * b'x')
+        for no in range(150):
+            store.delete('key%d' % no)
+        assert len(store.get_statistics()) > 1
+
+        store.compact()
+        stats = store.get_statistics()
+        assert sum(s['bytes'] for s in stats.values()) < 200 * 40
+        assert len(store) == 50
+        assert store.get('key199') == 20 * b'x'
+
+        store.close()
+        store = PackStore(self.store_dir)
+        assert len(store) == 50
+        assert 'key10' not in store
+
+    def testTombstones(self):
+        ''' tombstones are dropped once no older segment holds their key '''
+        store = PackStore(self.store_dir, segment_size=1024,
+                          auto_compact=False)
+        for no in range(100):
+            store.put('key%d' % no, 20 * b'x')
+        store.delete('key0')
+        store.delete('key99')
+        for no in range(100, 150):
+            store.put('key%d' % no, 20 * b'x')
+
+        def tombstones():
+            return set(key for segment in store._segments.values()
+                       for flags, key, _, _ in store._iter_records(
+                           segment.fname, 0, segment.size)
+                       if flags == FLAG_DELETE)
+
+        assert tombstones() == set(['key0', 'key99'])
+        store.compact(force=True)
+        assert tombstones() == set()
+        store.close()
+        store = PackStore(self.store_dir)
+        assert len(store) == 148
+        assert 'key0' not in store and 'key99' not in store
+
+    def testRefresh(self):
+        ''' the segments are only listed if the store directory changed '''
+        store = PackStore(self.store_dir)
+        store.put('a', b'alpha')
+        past = time.time() - 60
+        os.utime(self.store_dir, (past, past))
+
+        listings = []
+        list_segments = store._list_segments
+        store._list_segments = lambda: listings.append(1) or list_segments()
+        assert 'b' not in store
+        assert len(listings) == 1
+        for _ in range(10):
+            store.put('b', b'beta')
+            assert 'c' not in store
+        assert len(listings) == 1
+
+        # records appended by other writers are still visible
+        other = PackStore(self.store_dir)
+        other.put('c', b'gamma')
+        assert store.get('c') == b'gamma'
+        assert len(listings) == 1
+
+    def testEvictOldestSegment(self):
+        store = PackStore(self.store_dir, segment_size=1024)
+        for no in range(100):
+            store.put('key%d' % no, 20 * b'x')
+        segments = len(store.get_statistics())
+
+        evicted = store.evict_oldest_segment()
+        assert evicted > 0 and len(store) == 100 - evicted
+        assert 'key0' not in store and 'key99' in store
+        assert len(store.get_statistics()) == segments - 1
+        assert len(PackStore(self.store_dir)) == 100 - evicted
+
+    def testIncompleteRecord(self):
+        ''' incomplete records of crashed writers are ignored and
+            overwritten '''
+        store = PackStore(self.store_dir)
+        store.put('a', b'alpha')
+        store.close()
+        with open(join(self.store_dir, 'segment-00000000.pack'), 'ab') as f:
+            f.write(b'\x00\x01\x02')
+
+        store = PackStore(self.store_dir)
+        assert store.get('a') == b'alpha'
+        store.put('b', b'beta')
+        store.close()
+        assert PackStore(self.store_dir).get('b') == b'beta'
+
+    def testMultiProcessing(self):
+        ''' concurrent writers are visible to other processes '''
+        store = PackStore(self.store_dir)
+        p = Pool(4)
+        p.map(_put_range, [(self.store_dir, start)
+                           for start in range(0, 200, 50)])
+        p.close()
+        p.join()
+
+        assert all(store.get('key%d' % no) == str(no).encode('ascii')
+                   for no in range(200))
+
+
+if __name__ == '__main__':
+    unittest.main()
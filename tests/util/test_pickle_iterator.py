@@ -1,12 +1,25 @@
 #!/usr/bin/env python
+import gzip
+import os
+import pickle
+import stat
 import unittest
 
+from binascii import b2a_base64
+from os import listdir
+from shutil import rmtree
+
 from tempfile import mkdtemp
 from random import randint
 from os.path import join
 from unittest.case import TestCase
 
-from eWRT.util.pickleIterator import ReadPickleIterator, WritePickleIterator
+from eWRT.util.pickleIterator import ReadPickleIterator, WritePickleIterator, \
+    ParallelPickleReader
+
+
+def square(x):
+    return x * x
 
 
 class TestPickle(TestCase):
@@ -41,6 +54,105 @@ class TestPickle(TestCase):
         pw = WritePickleIterator( join( self.fdir, self.TESTFILE_NAME ) )
         for element in self.test_dict:
             pw.dump(element)
+        pw.close()
+
+    def testSeek(self):
+        """ tests random access to files consisting of multiple chunks """
+        fname = join(self.fdir, self.TESTFILE_NAME)
+        with WritePickleIterator(fname, chunk_size=100) as pw:
+            pw.dump_many(range(1000))
+
+        pr = ReadPickleIterator(fname)
+        assert len(pr) == 1000
+        pr.seek(998)
+        assert list(pr) == [998, 999]
+        pr.seek(17)
+        assert next(pr) == 17 and pr.tell() == 18
+        pr.seek(0)
+        assert list(pr) == list(range(1000))
+        pr.close()
+
+    def testIncompleteFile(self):
+        """ files only become visible once they have been committed """
+        fname = join(self.fdir, self.TESTFILE_NAME)
+        pw = WritePickleIterator(fname)
+        pw.dump(1)
+        self.assertRaises(IOError, ReadPickleIterator, fname)
+        pw.abort()
+        assert listdir(self.fdir) == []
+
+        try:
+            with WritePickleIterator(fname) as pw:
+                pw.dump(1)
+                raise ValueError
+        except ValueError:
+            pass
+        assert listdir(self.fdir) == []
+
+        # truncated files are detected
+        with WritePickleIterator(fname) as pw:
+            pw.dump_many(range(10))
+        with open(fname + '.pkl', 'rb') as f:
+            data = f.read()
+        with open(fname + '.pkl', 'wb') as f:
+            f.write(data[:-3])
+        self.assertRaises(IOError, ReadPickleIterator, fname)
+
+    def testLegacyFormat(self):
+        """ reads files written by previous versions """
+        fname = join(self.fdir, self.TESTFILE_NAME + '.gz')
+        with gzip.open(fname, 'wb') as f:
+            for element in self.test_dict:
+                f.write(b2a_base64(pickle.dumps(element)))
+
+        # legacy files are found without their suffix, too
+        pr = ReadPickleIterator(join(self.fdir, self.TESTFILE_NAME))
+        assert pr.fname == fname
+        assert len(pr) == len(self.test_dict)
+        pr.seek(3)
+        assert list(pr) == self.test_dict[3:]
+        pr.close()
+
+        with ParallelPickleReader(self.fdir, processes=1) as reader:
+            assert reader.ranges == [(fname, 0, None)]
+
+    def testFilePermissions(self):
+        """ committed files are created according to the umask """
+        fname = join(self.fdir, self.TESTFILE_NAME)
+        umask = os.umask(0o022)
+        os.umask(umask)
+        with WritePickleIterator(fname) as pw:
+            pw.dump(1)
+        assert stat.S_IMODE(os.stat(fname + '.pkl').st_mode) == \
+            0o666 & ~umask
+
+class TestParallelPickleReader(TestCase):
+
+    def setUp(self):
+        self.fdir = mkdtemp()
+        for no in range(3):
+            with WritePickleIterator(join(self.fdir, 'part%d' % no),
+                                     chunk_size=50) as pw:
+                pw.dump_many(range(no * 1000, (no + 1) * 1000))
+
+    def tearDown(self):
+        rmtree(self.fdir)
+
+    def testImap(self):
+        with ParallelPickleReader(self.fdir, processes=2,
+                                  shard_size=100) as reader:
+            assert len(reader.ranges) > 3
+            assert list(reader.imap(square)) == [x * x for x in range(3000)]
+            assert sorted(reader.imap(square, ordered=False)) == \
+                [x * x for x in range(3000)]
+
+    def testMapShards(self):
+        fnames = [join(self.fdir, 'part0'), join(self.fdir, 'part2')]
+        with ParallelPickleReader(fnames, processes=2) as reader:
+            assert len(reader.ranges) == 2
+            assert sum(reader.map_shards(sum, ordered=False)) == \
+                sum(range(1000)) + sum(range(2000, 3000))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+import gc
+import random
+import socket
+import threading
+import time
+import unittest
+import weakref
+
+import pytest
+
+from pytest import raises
+
+from eWRT.ws.rest import MultiRESTClient, WS_DEFAULT_TIMEOUT
+from eWRT.ws.rest.pool import (HealthChecker, LeastOutstandingPolicy,
+                               ServerPool, WeightedPolicy)
+
+
+class _Client(object):
+    ''' a REST client with a fixed response time '''
+
+    def __init__(self, service_url, latency, fail=False):
+        self.service_url = service_url
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.threads = set()
+
+    def execute(self, command, **kargs):
+        self.calls += 1
+        self.threads.add(threading.current_thread())
+        if self.fail and command == 'status':
+            raise IOError('%s is down' % self.service_url)
+        time.sleep(self.latency)
+        if self.fail:
+            raise IOError('%s failed' % self.service_url)
+        return self.service_url
+
+
+class _BatchClient(_Client):
+    ''' a REST client which returns the submitted documents '''
+
+    def execute(self, command, parameters=None, **kargs):
+        self.calls += 1
+        time.sleep(random.uniform(0, self.latency))
+        if self.fail or 'fail' in parameters:
+            raise IOError('%s failed' % self.service_url)
+        return [document.upper() for document in parameters]
+
+
+def get_client(clients, **kargs):
+    client = MultiRESTClient(['http://%s' % c.service_url for c in clients],
+                             **kargs)
+    client.clients = clients
+    return client
+
+
+class TestMultiRESTClient(unittest.TestCase):
+
+    def testLatencyRouting(self):
+        slow, fast = _Client('slow', 0.05), _Client('fast', 0.01)
+        client = get_client([slow, fast])
+        # servers without measurements are tried first
+        assert client.request('test') == 'slow'
+        assert client.request('test') == 'fast'
+        for _ in range(3):
+            assert client.request('test') == 'fast'
+        assert slow.calls == 1 and fast.calls == 4
+        latency = client.get_latency()
+        assert latency['slow'] > latency['fast']
+
+        client = get_client([_Client('a', 0.05), _Client('b', 0.01)],
+                            route_by_latency=False)
+        assert [client.request('test') for _ in range(3)] == ['a'] * 3
+
+    def testFailover(self):
+        broken, working = _Client('broken', 0, fail=True), _Client('ok', 0)
+        client = get_client([broken, working])
+        assert client.request('test') == 'ok'
+        # failed servers are tried last
+        assert client.request('test') == 'ok'
+        assert broken.calls == 1
+
+        client = get_client([_Client('a', 0, fail=True),
+                             _Client('b', 0, fail=True)])
+        with raises(Exception) as e:
+            client.request('test')
+        assert 'Could not make request to path test' in str(e.value)
+        with raises(IOError):
+            client.request('test', pass_through_exceptions=True)
+
+    def testParallelRequests(self):
+        clients = [_Client('a', 0.1), _Client('b', 0.1), _Client('c', 0.1)]
+        client = get_client(clients, parallel_requests=True)
+        start = time.time()
+        assert client.request('test', execute_all_services=True) == 'c'
+        assert time.time() - start < 0.25
+        assert [c.calls for c in clients] == [1, 1, 1]
+
+        # the threads are reused by subsequent requests
+        clients = [_Client('a', 0), _Client('b', 0), _Client('c', 0)]
+        client = get_client(clients, parallel_requests=True, max_threads=3)
+        for _ in range(4):
+            client.request('test', execute_all_services=True)
+        assert len(set.union(*[c.threads for c in clients])) <= 3
+        client.close()
+        assert client._thread_pool is None
+
+    def testHedgedRequests(self):
+        slow, fast = _Client('slow', 0.5), _Client('fast', 0.01)
+        client = get_client([slow, fast], hedge_delay=0.05,
+                            route_by_latency=False)
+        start = time.time()
+        assert client.request('test') == 'fast'
+        assert time.time() - start < 0.2
+        assert slow.calls == fast.calls == 1
+
+        # failures trigger the next request immediately
+        broken = _Client('broken', 0, fail=True)
+        client = get_client([broken, _Client('ok', 0)], hedge_delay=10)
+        start = time.time()
+        assert client.request('test') == 'ok'
+        assert time.time() - start < 1
+
+        # ... even if an earlier request is still pending
+        slow, broken, ok = _Client('slow', 2), \
+            _Client('broken', 0, fail=True), _Client('ok', 0)
+        client = get_client([slow, broken, ok], hedge_delay=0.5,
+                            route_by_latency=False)
+        start = time.time()
+        assert client.request('test') == 'ok'
+        assert time.time() - start < 0.9
+        assert slow.calls == broken.calls == ok.calls == 1
+
+        client = get_client([_Client('a', 0, fail=True),
+                             _Client('b', 0, fail=True)], hedge_delay=0.01)
+        with raises(Exception):
+            client.request('test')
+
+
+class TestServerPool(unittest.TestCase):
+
+    def testRoundRobin(self):
+        clients = [_Client('a', 0), _Client('b', 0), _Client('c', 0)]
+        client = get_client(clients, balancing_policy='round-robin')
+        assert [client.request('test') for _ in range(6)] == \
+            ['a', 'b', 'c', 'a', 'b', 'c']
+
+    def testLeastOutstanding(self):
+        a, b = _Client('a', 0), _Client('b', 0)
+        pool = ServerPool(LeastOutstandingPolicy())
+        pool.acquire(a)
+        assert pool.get_order([a, b]) == [b, a]
+        pool.acquire(b)
+        pool.acquire(b)
+        assert pool.get_order([a, b]) == [a, b]
+        pool.release(b, 0.1)
+        pool.release(b, 0.1)
+        assert pool.get_order([a, b]) == [b, a]
+        assert pool.get_statistics()['b']['requests'] == 2
+
+    def testWeighted(self):
+        clients = [_Client('a', 0), _Client('b', 0), _Client('c', 0)]
+        client = get_client(clients, balancing_policy=WeightedPolicy(
+            {'a': 3, 'c': 0}))
+        responses = [client.request('test') for _ in range(8)]
+        assert responses.count('a') == 6 and responses.count('b') == 2
+        # requests are interleaved
+        assert responses[:4] == ['a', 'a', 'b', 'a']
+
+    def testFailurePenalty(self):
+        server = _Client('a', 0)
+        pool = ServerPool(max_failure_latency=10)
+        pool.acquire(server)
+        pool.release(server, 0.1)
+        # fast failures count with at least MIN_FAILURE_LATENCY
+        pool.acquire(server)
+        pool.release(server, 0.001, IOError())
+        assert pool.get_latency()['a'] == pytest.approx(0.3 + 0.7 * 0.1)
+        # repeated failures are bounded by max_failure_latency
+        for _ in range(50):
+            pool.acquire(server)
+            pool.release(server, 0.001, IOError())
+        assert 9 < pool.get_latency()['a'] <= 10
+
+    def testMarkDown(self):
+        broken, working = _Client('broken', 0, fail=True), _Client('ok', 0)
+        pool = ServerPool(failure_threshold=2)
+        pool.acquire(broken)
+        pool.release(broken, 1, IOError())
+        assert pool.get_order([broken, working]) == [broken, working]
+        pool.acquire(broken)
+        pool.release(broken, 1, IOError())
+        assert pool.get_order([broken, working]) == [working]
+        # all servers are tried, if none of them is healthy
+        pool.set_health(working, False)
+        assert pool.get_order([broken, working]) == [broken, working]
+        # successful requests mark the server up
+        pool.acquire(working)
+        pool.release(working, 0.1)
+        assert pool.get_order([broken, working]) == [working]
+
+    def testHealthChecker(self):
+        broken, working = _Client('broken', 0, fail=True), _Client('ok', 0)
+        client = get_client([broken, working], route_by_latency=False)
+        checker = HealthChecker(client.pool, lambda: client.clients,
+                                lambda c: c.execute('status'), 0.01)
+        checker.check()
+        assert client.pool.is_healthy(working)
+        assert not client.pool.is_healthy(broken)
+        assert [client.request('test') for _ in range(3)] == ['ok'] * 3
+        assert broken.calls == 1
+
+        broken.fail = False
+        checker.start()
+        try:
+            for _ in range(100):
+                if client.pool.is_healthy(broken):
+                    break
+                time.sleep(0.01)
+        finally:
+            checker.stop()
+        assert client.request('test') == 'broken'
+
+    def testBackgroundHealthChecks(self):
+        client = MultiRESTClient(['http://127.0.0.1:1'],
+                                 health_check_interval=0.01,
+                                 health_check_timeout=1)
+        # the health checks do not change the timeout of other requests
+        assert socket.getdefaulttimeout() == WS_DEFAULT_TIMEOUT
+        try:
+            for _ in range(100):
+                if not client.is_online():
+                    break
+                time.sleep(0.01)
+            assert not client.is_online()
+        finally:
+            client.close()
+        assert client.health_checker._thread is None
+
+    def testHealthCheckerReleasesClient(self):
+        ''' clients which are not closed stop their health checks once they
+            have been garbage collected '''
+        client = MultiRESTClient(['http://127.0.0.1:1'],
+                                 health_check_interval=0.01,
+                                 health_check_timeout=1)
+        thread = client.health_checker._thread
+        client_ref = weakref.ref(client)
+        del client
+        # the thread might be probing the servers right now
+        for _ in range(100):
+            gc.collect()
+            if client_ref() is None:
+                break
+            time.sleep(0.01)
+        assert client_ref() is None
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+class TestBatchSubmission(unittest.TestCase):
+
+    def testGetDocumentBatch(self):
+        documents = (str(no) for no in range(25))
+        batches = list(MultiRESTClient.get_document_batch(documents, 10))
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+
+        # batches are limited by their size in bytes, too
+        documents = ['a' * 10, 'b' * 10, 'c' * 30, 'd' * 2, 'e' * 2]
+        batches = list(MultiRESTClient.get_document_batch(
+            documents, 10, max_batch_bytes=40))
+        assert batches == [['a' * 10, 'b' * 10], ['c' * 30],
+                           ['d' * 2, 'e' * 2]]
+        assert list(MultiRESTClient.get_document_batch([])) == []
+
+    def testSubmitBatches(self):
+        clients = [_BatchClient('a', 0.02), _BatchClient('b', 0.02)]
+        client = get_client(clients)
+        documents = ('doc%d' % no for no in range(100))
+        results = list(client.submit_batches('annotate', documents,
+                                             batch_size=3))
+        assert len(results) == 34
+        assert sum(results, []) == ['DOC%d' % no for no in range(100)]
+        # the batches are spread across the servers
+        assert all(c.calls > 5 for c in clients)
+
+    def testConcurrentBatchesSpreadOverServers(self):
+        # concurrent workers must not all pick the fastest server
+        clients = [_BatchClient('a', 0.01), _BatchClient('b', 0.03),
+                   _BatchClient('c', 0.03)]
+        client = get_client(clients)
+        documents = ['doc%d' % no for no in range(60)]
+        results = list(client.submit_batches('annotate', documents,
+                                             batch_size=2, workers=3))
+        assert sum(results, []) == [doc.upper() for doc in documents]
+        assert all(c.calls >= 5 for c in clients)
+        for state in client.pool.get_statistics().values():
+            assert state['outstanding'] == 0 and state['reserved'] == 0
+
+    def testReserve(self):
+        a, b = _Client('a', 0), _Client('b', 0)
+        pool = ServerPool()
+        assert pool.reserve([a, b]) == [a, b]
+        # a already has an outstanding request
+        assert pool.reserve([a, b]) == [b, a]
+        stats = pool.get_statistics()
+        assert stats['a']['outstanding'] == stats['b']['outstanding'] == 1
+        # acquiring a reserved server does not count the request twice
+        pool.acquire(a)
+        pool.acquire(b)
+        stats = pool.get_statistics()
+        assert stats['a']['outstanding'] == stats['b']['outstanding'] == 1
+        assert stats['a']['requests'] == stats['b']['requests'] == 1
+
+    def testBackPressure(self):
+        consumed = []
+
+        def documents():
+            for no in range(1000):
+                consumed.append(no)
+                yield 'doc%d' % no
+
+        client = get_client([_BatchClient('a', 0.01), _BatchClient('b', 0)])
+        results = client.submit_batches('annotate', documents(),
+                                        batch_size=10, workers=2,
+                                        max_pending=4)
+        assert next(results) == ['DOC%d' % no for no in range(10)]
+        # only max_pending batches (plus the next one) have been read
+        assert len(consumed) <= 51
+        results.close()
+
+    def testFailedBatch(self):
+        client = get_client([_BatchClient('a', 0)])
+        results = client.submit_batches(
+            'annotate', ['x', 'y', 'fail', 'z'], batch_size=2)
+        assert next(results) == ['X', 'Y']
+        with raises(Exception) as e:
+            next(results)
+        assert 'Could not make request to path annotate' in str(e.value)
+
+
+if __name__ == '__main__':
+    unittest.main()